@@ -1,8 +1,17 @@
-from flask import Flask, jsonify, render_template_string, request, g
+from flask import Flask, Response, jsonify, render_template_string, request, g
 import sqlite3
 import os
 import json
-from datetime import datetime, timezone
+import base64
+import csv
+import io
+import zlib
+import mmap
+import struct
+import heapq
+import sys
+from itertools import accumulate, islice, repeat
+from datetime import datetime, timedelta, timezone
 from collections import defaultdict, Counter
 import requests
 import time
@@ -10,133 +19,798 @@ import re
 
 app = Flask(__name__)
 DB_PATH = os.path.join(os.path.dirname(__file__), "json", "analytics_test.db")
+# Cold snapshot archive segments written by the bot (snapshot_archive.path is relative to this)
+ARCHIVE_DIR = os.path.join(os.path.dirname(DB_PATH), 'analytics_archive')
+# Shard files of a sharded DB (shards.path is relative to this); DB_PATH is then the catalog
+SHARD_DIR = os.path.join(os.path.dirname(DB_PATH), 'analytics_shards')
 
 # Configuration for NightyScript micro-API
 NIGHTY_API_BASE_URL = os.environ.get('NIGHTY_API_BASE_URL', 'http://127.0.0.1:5500')
 
 WEBHOOK_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'json', 'global_analytics_webhook.json')
 
-def get_db():
-    if 'db_conn' not in g:
-        g.db_conn = sqlite3.connect(DB_PATH)
-        g.db_conn.row_factory = sqlite3.Row
-    return g.db_conn
+# Matches the server_config.snapshot_retention_days column default and the bot's DATA_RETENTION_DAYS
+DEFAULT_RETENTION_DAYS = 90
+
+# Secondary indexes created by schema v3 (name, table, columns)
+SCHEMA_INDEXES = [
+    ('idx_snapshots_guild_ts_ms', 'snapshots', 'guild_id, timestamp_ms'),
+    ('idx_snapshots_ts_ms', 'snapshots', 'timestamp_ms'),
+    ('idx_demographics_member', 'demographics', 'member_id'),
+    ('idx_demographics_guild_joined_ms', 'demographics', 'guild_id, joined_at_ms'),
+    ('idx_demographics_guild_created_ms', 'demographics', 'guild_id, account_created_ms'),
+    ('idx_demographics_ts_ms', 'demographics', 'timestamp_ms'),
+]
+# Indexes superseded by the epoch-ms columns
+OBSOLETE_INDEXES = [
+    'idx_snapshots_guild_ts',
+    'idx_snapshots_ts',
+    'idx_demographics_guild_joined',
+    'idx_demographics_guild_created',
+]
+
+# Integer epoch-millisecond companions of the ISO text columns: {table: [(ms_column, iso_column), ...]}
+EPOCH_MS_COLUMNS = {
+    'snapshots': [('timestamp_ms', 'timestamp')],
+    'demographics': [
+        ('timestamp_ms', 'timestamp'),
+        ('joined_at_ms', 'joined_at'),
+        ('account_created_ms', 'account_created'),
+    ],
+}
+EPOCH_BACKFILL_CHUNK = 5000
+# Discord snowflake columns, stored as INTEGER since schema v4 but always serialized as strings
+# in JSON responses (JavaScript numbers lose precision above 2**53)
+SNOWFLAKE_COLUMNS = ('guild_id', 'member_id')
+UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+# A snowflake's top 42 bits are its creation time in ms since the Discord epoch, so creation-time
+# ranges are id ranges: compare member_id against snowflake_floor(ms) to use the primary key.
+DISCORD_EPOCH_MS = 1420070400000
+SNOWFLAKE_MS_SQL = "(({} >> 22) + 1420070400000)"
+
+def snowflake_floor(ms):
+    """Smallest snowflake created at or after epoch ms"""
+    return max(ms - DISCORD_EPOCH_MS, 0) << 22
+
+def to_epoch_ms(dt):
+    """Convert a datetime to integer epoch milliseconds (naive datetimes are treated as UTC)"""
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - UNIX_EPOCH) // timedelta(milliseconds=1)
+
+def from_epoch_ms(ms):
+    """Convert integer epoch milliseconds back to an ISO 8601 UTC string (None stays None)"""
+    return None if ms is None else (UNIX_EPOCH + timedelta(milliseconds=ms)).isoformat()
+
+# Snapshot archive segment layout; keep in sync with the writer in server analytics.py.
+# Header, one column entry per column, then each column's delta-of-deltas (row_count - 2 little-endian
+# signed ints of the entry's width, 8-byte aligned; width 0 means all zero and nothing is stored).
+ARCHIVE_MAGIC = b'SNAPARC1'
+ARCHIVE_HEADER = struct.Struct('<8sHI')  # magic, column count, row count
+ARCHIVE_COLUMN = struct.Struct('<32sBqqQ')  # name, delta-of-delta width, first value, first delta, data offset
+ARCHIVE_WIDTH_CODES = {1: 'b', 2: 'h', 4: 'i', 8: 'q'}
+ARCHIVE_NULL = -1  # stored in place of NULL in the nullable columns
+
+def read_archive_segment(path):
+    """
+    Decode a segment file into {column: [values]}. The file is memory-mapped and each column's
+    delta-of-deltas are read through a cast memoryview over the map, without copying them out first.
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+        magic, column_count, row_count = ARCHIVE_HEADER.unpack_from(view, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f'{path} is not a snapshot archive segment')
+        dod_count = max(row_count - 2, 0)
+        columns = {}
+        for i in range(column_count):
+            name, width, first, delta, offset = ARCHIVE_COLUMN.unpack_from(view, ARCHIVE_HEADER.size + i * ARCHIVE_COLUMN.size)
+            name = name.rstrip(b'\0').decode()
+            if width == 0:
+                dods = repeat(0, dod_count)
+            else:
+                with view[offset:offset + width * dod_count] as raw, raw.cast(ARCHIVE_WIDTH_CODES[width]) as cast:
+                    # memoryview.cast uses native byte order
+                    dods = cast.tolist() if sys.byteorder == 'little' else [
+                        int.from_bytes(raw[j:j + width], 'little', signed=True) for j in range(0, len(raw), width)
+                    ]
+            columns[name] = list(accumulate(accumulate(dods, initial=delta), initial=first))[:row_count]
+        return columns
+
+def archived_snapshot_rows(db, guild_id=None):
+    """Yield a guild's (or every guild's) archived snapshots as dicts, in timestamp_ms order per guild"""
+    if guild_id:
+        segments = db.execute('SELECT path FROM snapshot_archive WHERE guild_id = ? ORDER BY first_ms', (guild_id,))
+    else:
+        segments = db.execute('SELECT path FROM snapshot_archive ORDER BY first_ms')
+    for (path,) in segments.fetchall():
+        try:
+            columns = read_archive_segment(os.path.join(ARCHIVE_DIR, path))
+        except FileNotFoundError:
+            continue
+        # Segments written before schema v15 have no valid_to_ms column
+        for ms, count, first, low, high, boosters, samples, valid_to in zip(
+                columns['timestamp_ms'], columns['member_count'], columns['member_count_first'],
+                columns['member_count_min'], columns['member_count_max'], columns['boosters'],
+                columns['sample_count'], columns.get('valid_to_ms', columns['timestamp_ms'])):
+            yield {
+                'timestamp': from_epoch_ms(ms), 'timestamp_ms': ms, 'member_count': count,
+                'member_first': first, 'member_min': low, 'member_max': high,
+                'boosters': None if boosters == ARCHIVE_NULL else boosters,
+                'sample_count': samples, 'valid_to_ms': valid_to,
+            }
+
+def expand_runs(rows):
+    """
+    Yield rows with each run row (valid_to_ms past timestamp_ms) expanded back into sample_count
+    copies evenly spaced over [timestamp_ms, valid_to_ms]
+    """
+    for row in rows:
+        start, end, count = row['timestamp_ms'], row['valid_to_ms'], row['sample_count']
+        if end <= start or count < 2:
+            yield row
+            continue
+        for i in range(count):
+            ms = start + (end - start) * i // (count - 1)
+            point = dict(row)
+            point.update(timestamp_ms=ms, timestamp=row['timestamp'] if i == 0 else from_epoch_ms(ms))
+            yield point
+
+def last_run_sample_ms(start, end, samples, at_ms):
+    """When the last snapshot at or before at_ms (>= start) of a row was taken, its run spread as expand_runs spreads it"""
+    if end <= start or samples < 2:
+        return start
+    if end <= at_ms:
+        return end
+    # Largest i with start + (end - start) * i // (samples - 1) <= at_ms
+    i = ((at_ms - start + 1) * (samples - 1) - 1) // (end - start)
+    return start + (end - start) * i // (samples - 1)
+
+def run_samples_before(start, end, samples, at_ms):
+    """How many of a row's snapshots were taken before at_ms, its run spread as expand_runs spreads it"""
+    if at_ms <= start:
+        return 0
+    if end < at_ms or end <= start or samples < 2:
+        return samples
+    # Largest i with start + (end - start) * i // (samples - 1) < at_ms, plus one
+    return ((at_ms - start) * (samples - 1) - 1) // (end - start) + 1
+
+def snapshot_history(db, guild_id=None):
+    """
+    A guild's (or every guild's) member-count series ordered by timestamp_ms: archived segments merged
+    with the live snapshots rows, with run rows expanded into the snapshots they stand for. Rows support
+    row['column'] for timestamp, timestamp_ms, member_count, member_first, member_min, member_max and
+    boosters; compacted rows carry their bucket's first/min/max.
+    """
+    live_sql = (
+        'SELECT timestamp, timestamp_ms, member_count, boosters, COALESCE(member_count_first, member_count) AS member_first, '
+        'COALESCE(member_count_min, member_count) AS member_min, COALESCE(member_count_max, member_count) AS member_max, '
+        'COALESCE(sample_count, 1) AS sample_count, COALESCE(valid_to_ms, timestamp_ms) AS valid_to_ms '
+        'FROM snapshots'
+    )
+    if guild_id:
+        live = db.execute(live_sql + ' WHERE guild_id = ? ORDER BY timestamp_ms', (guild_id,))
+    else:
+        live = db.execute(live_sql + ' ORDER BY timestamp_ms')
+    archived = archived_snapshot_rows(db, guild_id)
+    if not guild_id:
+        # Segments, and runs, of different guilds overlap in time
+        return sorted(expand_runs(heapq.merge(archived, live, key=lambda row: row['timestamp_ms'])), key=lambda row: row['timestamp_ms'])
+    # A guild's runs end before its next row starts, so expanding keeps the order
+    return list(expand_runs(heapq.merge(archived, live, key=lambda row: row['timestamp_ms'])))
+
+def snowflake_str(value):
+    """Serialize a snowflake id for JSON (None stays None)"""
+    return None if value is None else str(value)
+
+def row_to_json(row):
+    """dict(row) with snowflake id columns converted to strings"""
+    data = dict(row)
+    for column in SNOWFLAKE_COLUMNS:
+        if column in data:
+            data[column] = snowflake_str(data[column])
+    return data
+
+def backfill_epoch_columns(db, chunk_size=EPOCH_BACKFILL_CHUNK):
+    """Fill NULL epoch-ms columns from their ISO text columns in rowid-ordered chunks, committing per chunk"""
+    filled = 0
+    for table, pairs in EPOCH_MS_COLUMNS.items():
+        driver_ms, driver_iso = pairs[0]
+        # Columns generated from the row since v14 need no backfill
+        generated = {row[1] for row in db.execute(f'PRAGMA table_xinfo({table})') if row[6]}
+        assignments = ', '.join(
+            f"{ms_col} = CAST(ROUND((julianday({iso_col}) - 2440587.5) * 86400000) AS INTEGER)"
+            for ms_col, iso_col in pairs if ms_col not in generated
+        )
+        last_rowid = 0
+        while True:
+            rowids = [row[0] for row in db.execute(
+                f"SELECT rowid FROM {table} WHERE {driver_ms} IS NULL AND {driver_iso} IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                (last_rowid, chunk_size)
+            ).fetchall()]
+            if not rowids:
+                break
+            cur = db.execute(
+                f"UPDATE {table} SET {assignments} WHERE rowid BETWEEN ? AND ? AND {driver_ms} IS NULL",
+                (rowids[0], rowids[-1])
+            )
+            db.commit()
+            filled += cur.rowcount
+            last_rowid = rowids[-1]
+    return filled
+
+def add_missing_columns(db, table, columns):
+    """Add any of the (name, declaration) columns that a legacy table is missing"""
+    existing = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    for name, declaration in columns:
+        if name not in existing:
+            db.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+# Column set of the original (version 1) tables: {table: ([(column, declaration), ...], table_constraint)}
+BASE_TABLES = {
+    'snapshots': ([
+        ('id', 'INTEGER PRIMARY KEY AUTOINCREMENT'),
+        ('guild_id', 'TEXT'),
+        ('guild_name', 'TEXT'),
+        ('timestamp', 'TEXT'),
+        ('member_count', 'INTEGER'),
+        ('channel_count', 'INTEGER'),
+        ('text_channels', 'INTEGER'),
+        ('voice_channels', 'INTEGER'),
+        ('categories', 'INTEGER'),
+        ('role_count', 'INTEGER'),
+        ('bots', 'INTEGER'),
+        ('boosters', 'INTEGER DEFAULT 0'),
+        ('is_auto', 'INTEGER'),
+    ], None),
+    'demographics': ([
+        ('guild_id', 'TEXT'),
+        ('member_id', 'TEXT'),
+        ('name', 'TEXT'),
+        ('account_created', 'TEXT'),
+        ('joined_at', 'TEXT'),
+        ('timestamp', 'TEXT'),
+    ], 'PRIMARY KEY (guild_id, member_id)'),
+    'server_config': ([
+        ('guild_id', 'TEXT PRIMARY KEY'),
+        ('guild_name', 'TEXT'),
+        ('auto_snapshot', 'INTEGER DEFAULT 0'),
+        ('last_auto_snapshot', 'TEXT'),
+        ('first_snapshot_date', 'TEXT'),
+        ('chart_style', "TEXT DEFAULT 'emoji'"),
+        ('snapshot_retention_days', 'INTEGER DEFAULT 90'),
+        ('auto_snapshot_interval_hours', 'REAL DEFAULT 20'),
+        ('last_snapshot', 'TEXT'),
+    ], None),
+    'demographics_servers': ([
+        ('guild_id', 'TEXT PRIMARY KEY'),
+    ], None),
+}
+
+def migrate_base_tables(db):
+    """v1: original tables, plus columns older script versions did not create"""
+    for table, (columns, constraint) in BASE_TABLES.items():
+        definitions = [f"{name} {declaration}" for name, declaration in columns]
+        if constraint:
+            definitions.append(constraint)
+        db.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(definitions)})")
+        add_missing_columns(db, table, [(name, declaration) for name, declaration in columns if 'PRIMARY KEY' not in declaration])
+
+def migrate_epoch_ms_columns(db):
+    """v2: integer epoch-ms companions of the ISO text columns (backfilled after migrating)"""
+    for table, pairs in EPOCH_MS_COLUMNS.items():
+        add_missing_columns(db, table, [(ms_col, 'INTEGER') for ms_col, _ in pairs])
+
+def migrate_secondary_indexes(db):
+    """v3: secondary indexes for the per-guild and time-range queries"""
+    for index_name in OBSOLETE_INDEXES:
+        db.execute(f"DROP INDEX IF EXISTS {index_name}")
+    for index_name, table, columns in SCHEMA_INDEXES:
+        db.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+def rebuild_table(db, table, columns, constraint=None, where="1=1"):
+    """Recreate a table with new column declarations, copying the shared columns of rows matching where"""
+    old_columns = {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+    definitions = [f"{name} {declaration}" for name, declaration in columns]
+    if constraint:
+        definitions.append(constraint)
+    shared = ', '.join(name for name, _ in columns if name in old_columns)
+    db.execute(f"CREATE TABLE {table}_rebuild ({', '.join(definitions)})")
+    db.execute(f"INSERT INTO {table}_rebuild ({shared}) SELECT {shared} FROM {table} WHERE {where}")
+    db.execute(f"DROP TABLE {table}")
+    db.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+
+def migrate_integer_snowflakes(db):
+    """
+    v4: guild_id/member_id become INTEGER columns. INTEGER affinity converts the stored decimal
+    strings on copy, and text parameters (e.g. route arguments) still compare correctly against them.
+    """
+    for table, (columns, constraint) in BASE_TABLES.items():
+        columns = [
+            (name, declaration.replace('TEXT', 'INTEGER', 1) if name in SNOWFLAKE_COLUMNS else declaration)
+            for name, declaration in columns
+        ]
+        columns += [(ms_col, 'INTEGER') for ms_col, _ in EPOCH_MS_COLUMNS.get(table, [])]
+        # server_config/demographics_servers keys become rowid aliases, which reject non-numeric text
+        where = "guild_id NOT GLOB '*[^0-9]*' AND guild_id != ''" if table in ('server_config', 'demographics_servers') else '1=1'
+        rebuild_table(db, table, columns, constraint, where)
+    # Dropping the old tables dropped their indexes
+    migrate_secondary_indexes(db)
+
+# Demographics columns and index added by schema v5
+SEEN_COLUMNS = [('first_seen_ms', 'INTEGER'), ('last_seen_ms', 'INTEGER')]
+SEEN_INDEXES = [('idx_demographics_first_seen_ms', 'demographics', 'first_seen_ms')]
+
+def migrate_seen_columns(db):
+    """v5: first_seen_ms/last_seen_ms on demographics, seeded from the last fetch timestamp"""
+    add_missing_columns(db, 'demographics', SEEN_COLUMNS)
+    db.execute(
+        "UPDATE demographics SET first_seen_ms = COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)), "
+        "last_seen_ms = COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)) "
+        "WHERE first_seen_ms IS NULL"
+    )
+    for index_name, table, columns in SEEN_INDEXES:
+        db.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+# Snapshot columns added by schema v6 for the bot's tiered compaction. A compacted row is the last
+# raw snapshot of its hour/day plus that bucket's first/min/max member_count and sample count.
+ROLLUP_COLUMNS = [
+    ('rollup_level', 'INTEGER DEFAULT 0'),  # 0 raw, 1 hourly, 2 daily
+    ('member_count_first', 'INTEGER'),
+    ('member_count_min', 'INTEGER'),
+    ('member_count_max', 'INTEGER'),
+    ('sample_count', 'INTEGER DEFAULT 1'),
+]
+
+def migrate_rollup_columns(db):
+    """v6: rollup columns on snapshots for tiered compaction"""
+    add_missing_columns(db, 'snapshots', ROLLUP_COLUMNS)
+
+# Guild dimension added by schema v7: current name, first/last snapshot time and latest counts per
+# guild (maintained by the bot on every snapshot insert), plus a change-only name history.
+GUILD_TABLES = [
+    """CREATE TABLE IF NOT EXISTS guilds (
+            guild_id INTEGER PRIMARY KEY, name TEXT,
+            first_snapshot TEXT, first_snapshot_ms INTEGER, last_snapshot TEXT, last_snapshot_ms INTEGER,
+            member_count INTEGER, channel_count INTEGER, role_count INTEGER, bots INTEGER, boosters INTEGER)""",
+    """CREATE TABLE IF NOT EXISTS guild_name_history (
+            guild_id INTEGER, name TEXT, changed_at_ms INTEGER,
+            PRIMARY KEY (guild_id, changed_at_ms))""",
+]
+SNAPSHOT_TS_MS_SQL = "COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER))"
+
+def rebuild_guilds(db):
+    """Recompute guilds and guild_name_history from the snapshots table"""
+    db.execute('DELETE FROM guilds')
+    db.execute('DELETE FROM guild_name_history')
+    db.execute(f"""
+        INSERT INTO guilds (guild_id, first_snapshot_ms, last_snapshot_ms)
+        SELECT guild_id, MIN({SNAPSHOT_TS_MS_SQL}), MAX({SNAPSHOT_TS_MS_SQL})
+        FROM snapshots WHERE guild_id IS NOT NULL GROUP BY guild_id
+    """)
+    db.execute(f"""
+        UPDATE guilds SET
+            first_snapshot = (SELECT timestamp FROM snapshots s WHERE s.guild_id = guilds.guild_id
+                              ORDER BY {SNAPSHOT_TS_MS_SQL}, id LIMIT 1),
+            name = (SELECT guild_name FROM snapshots s WHERE s.guild_id = guilds.guild_id AND guild_name IS NOT NULL
+                    ORDER BY {SNAPSHOT_TS_MS_SQL} DESC, id DESC LIMIT 1),
+            (last_snapshot, member_count, channel_count, role_count, bots, boosters) = (
+                SELECT timestamp, member_count, channel_count, role_count, bots, boosters FROM snapshots s
+                WHERE s.guild_id = guilds.guild_id ORDER BY {SNAPSHOT_TS_MS_SQL} DESC, id DESC LIMIT 1)
+    """)
+    db.execute(f"""
+        INSERT OR IGNORE INTO guild_name_history (guild_id, name, changed_at_ms)
+        SELECT guild_id, guild_name, ts_ms FROM (
+            SELECT guild_id, guild_name, {SNAPSHOT_TS_MS_SQL} AS ts_ms,
+                   LAG(guild_name) OVER (PARTITION BY guild_id ORDER BY {SNAPSHOT_TS_MS_SQL}, id) AS previous_name
+            FROM snapshots WHERE guild_id IS NOT NULL AND guild_name IS NOT NULL
+        ) WHERE previous_name IS NULL OR previous_name != guild_name
+    """)
+
+def migrate_guild_tables(db):
+    """v7: guilds dimension and guild_name_history, backfilled from snapshots"""
+    for statement in GUILD_TABLES:
+        db.execute(statement)
+    rebuild_guilds(db)
+
+# Member name search index added by schema v8: an external-content FTS5 table with the trigram
+# tokenizer (substring matching), kept in sync with demographics by triggers.
+NAME_SEARCH_OBJECTS = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS demographics_fts USING fts5(name, content='demographics', content_rowid='rowid', tokenize='trigram')",
+    """CREATE TRIGGER IF NOT EXISTS demographics_fts_insert AFTER INSERT ON demographics BEGIN
+            INSERT INTO demographics_fts (rowid, name) VALUES (new.rowid, new.name);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS demographics_fts_delete AFTER DELETE ON demographics BEGIN
+            INSERT INTO demographics_fts (demographics_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        END""",
+    """CREATE TRIGGER IF NOT EXISTS demographics_fts_update AFTER UPDATE OF name ON demographics BEGIN
+            INSERT INTO demographics_fts (demographics_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO demographics_fts (rowid, name) VALUES (new.rowid, new.name);
+        END""",
+    "CREATE INDEX IF NOT EXISTS idx_demographics_name_nocase ON demographics (name COLLATE NOCASE)",
+]
+
+def migrate_name_search(db):
+    """v8: trigram full-text index over demographics.name (built from the existing rows) and a NOCASE name index"""
+    for statement in NAME_SEARCH_OBJECTS:
+        db.execute(statement)
+    db.execute("INSERT INTO demographics_fts (demographics_fts) VALUES ('rebuild')")
+
+def migrate_search_key_index(db):
+    """v9: replace the NOCASE name index with ones on the member search sort key (all guilds / one guild), for keyset paging"""
+    db.execute('DROP INDEX IF EXISTS idx_demographics_name_nocase')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_demographics_name_key ON demographics (name COLLATE NOCASE, guild_id, member_id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_demographics_guild_name ON demographics (guild_id, name COLLATE NOCASE, member_id)')
+
+def migrate_snapshot_archive(db):
+    """v10: index of the cold snapshot archive segment files (paths relative to ARCHIVE_DIR)"""
+    db.execute("""CREATE TABLE IF NOT EXISTS snapshot_archive (
+            guild_id INTEGER, first_ms INTEGER, last_ms INTEGER, row_count INTEGER, path TEXT, bytes INTEGER,
+            PRIMARY KEY (guild_id, first_ms))""")
+
+def migrate_shard_catalog(db):
+    """v11: shard layout of a sharded DB (no rows unless sharding is enabled; paths relative to SHARD_DIR)"""
+    db.execute('CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, path TEXT)')
+
+def migrate_member_events(db):
+    """
+    v12: join/leave event log (kind 1 = join, -1 = leave) and demographics.left_ms. Members missing
+    from their guild's latest fetch are marked as already gone, without logging an event.
+    """
+    db.execute("""CREATE TABLE IF NOT EXISTS member_events (
+        guild_id INTEGER, timestamp_ms INTEGER, member_id INTEGER, kind INTEGER,
+        PRIMARY KEY (guild_id, timestamp_ms, member_id)) WITHOUT ROWID""")
+    db.execute('CREATE INDEX IF NOT EXISTS idx_member_events_ts_ms ON member_events (timestamp_ms)')
+    add_missing_columns(db, 'demographics', [('left_ms', 'INTEGER')])
+    db.execute("""
+        UPDATE demographics SET left_ms = last_seen_ms
+        FROM (SELECT guild_id, MAX(last_seen_ms) AS latest_ms FROM demographics GROUP BY guild_id) AS latest
+        WHERE demographics.guild_id = latest.guild_id AND demographics.last_seen_ms < latest.latest_ms
+    """)
+
+def migrate_member_names(db):
+    """v13: change-only member name history, seeded with each member's most recently fetched name"""
+    db.execute("""CREATE TABLE IF NOT EXISTS member_names (
+        member_id INTEGER, since_ms INTEGER, name TEXT,
+        PRIMARY KEY (member_id, since_ms)) WITHOUT ROWID""")
+    # timestamp_ms may still await its backfill here; v5 filled last_seen_ms from the ISO timestamp
+    db.execute("""
+        INSERT OR IGNORE INTO member_names (member_id, since_ms, name)
+        SELECT member_id, COALESCE(first_seen_ms, 0), name
+        FROM (SELECT member_id, first_seen_ms, name, MAX(COALESCE(last_seen_ms, 0)) FROM demographics GROUP BY member_id)
+    """)
+
+def migrate_snowflake_created(db):
+    """
+    v14: account_created/account_created_ms become virtual columns computed from the member_id
+    snowflake instead of stored copies (their index goes too: member_id ranges replace it)
+    """
+    db.execute('DROP INDEX IF EXISTS idx_demographics_guild_created_ms')
+    for column in ('account_created_ms', 'account_created'):
+        db.execute(f'ALTER TABLE demographics DROP COLUMN {column}')
+    created_ms = SNOWFLAKE_MS_SQL.format('member_id')
+    db.execute(f'ALTER TABLE demographics ADD COLUMN account_created_ms INTEGER GENERATED ALWAYS AS ({created_ms}) VIRTUAL')
+    db.execute(
+        "ALTER TABLE demographics ADD COLUMN account_created TEXT GENERATED ALWAYS AS "
+        f"(strftime('%Y-%m-%dT%H:%M:%f000+00:00', {created_ms} / 1000.0, 'unixepoch')) VIRTUAL"
+    )
+
+def migrate_snapshot_runs(db):
+    """v15: valid_to_ms on snapshots, set on rows that stand for a run of identical snapshots"""
+    add_missing_columns(db, 'snapshots', [('valid_to_ms', 'INTEGER')])
+
+def migrate_structure_snapshots(db):
+    """v16: channel/role structure blobs keyed by content hash, and each guild's change-only log of them"""
+    db.execute("""CREATE TABLE IF NOT EXISTS structure_blobs (
+        hash TEXT PRIMARY KEY, body BLOB) WITHOUT ROWID""")
+    db.execute("""CREATE TABLE IF NOT EXISTS guild_structures (
+        guild_id INTEGER, timestamp_ms INTEGER, hash TEXT,
+        PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+def migrate_member_profile_index(db):
+    """v17: replace the member_id index with one covering the member profile lookup (every guild of a member, by join time)"""
+    db.execute('DROP INDEX IF EXISTS idx_demographics_member')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_demographics_member_profile ON demographics (member_id, joined_at_ms, guild_id, first_seen_ms, last_seen_ms, left_ms)')
+
+def migrate_membership_sets(db):
+    """v18: dense integer ids for member snowflakes, and a compressed bitmap of those ids per guild member fetch"""
+    db.execute('CREATE TABLE IF NOT EXISTS member_ids (dense_id INTEGER PRIMARY KEY, member_id INTEGER NOT NULL UNIQUE)')
+    db.execute("""CREATE TABLE IF NOT EXISTS membership_sets (
+        guild_id INTEGER, timestamp_ms INTEGER, member_count INTEGER, bitmap BLOB,
+        PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+def migrate_role_histograms(db):
+    """v19: per-snapshot role histogram (members holding each role), packed as sorted (role_id, count) int64 pairs"""
+    db.execute("""CREATE TABLE IF NOT EXISTS role_histograms (
+        guild_id INTEGER, timestamp_ms INTEGER, histogram BLOB,
+        PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+def migrate_archive_sample_counts(db):
+    """v20: snapshots each archive segment stands for (a run or rollup row counts its samples); NULL on older segments"""
+    # Catalog-only: shard files dropped snapshot_archive after their first migration pass
+    if db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshot_archive'").fetchone():
+        add_missing_columns(db, 'snapshot_archive', [('sample_count', 'INTEGER')])
+
+def migrate_member_profile_key_index(db):
+    """
+    v21: narrow the member profile index to columns a fetch never rewrites, so advancing last_seen_ms
+    stays an index-free update; the profile reads the seen/left columns by rowid
+    """
+    db.execute('DROP INDEX IF EXISTS idx_demographics_member_profile')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_demographics_member_profile ON demographics (member_id, joined_at_ms, guild_id)')
+
+# Ordered schema migrations keyed by PRAGMA user_version.
+# Keep identical (same versions, same DDL) to SCHEMA_MIGRATIONS in server analytics.py; append only.
+# Shard files run them too and then keep only their shard-local tables, so a migration must not
+# assume any other table exists.
+SCHEMA_MIGRATIONS = [
+    (1, 'base tables', migrate_base_tables),
+    (2, 'epoch-ms columns', migrate_epoch_ms_columns),
+    (3, 'secondary indexes', migrate_secondary_indexes),
+    (4, 'integer snowflake keys', migrate_integer_snowflakes),
+    (5, 'demographics first/last seen', migrate_seen_columns),
+    (6, 'snapshot rollup columns', migrate_rollup_columns),
+    (7, 'guilds dimension', migrate_guild_tables),
+    (8, 'member name search index', migrate_name_search),
+    (9, 'member search key index', migrate_search_key_index),
+    (10, 'snapshot archive segments', migrate_snapshot_archive),
+    (11, 'shard catalog', migrate_shard_catalog),
+    (12, 'member churn events', migrate_member_events),
+    (13, 'member name history', migrate_member_names),
+    (14, 'snowflake account creation', migrate_snowflake_created),
+    (15, 'snapshot runs', migrate_snapshot_runs),
+    (16, 'structure snapshots', migrate_structure_snapshots),
+    (17, 'member profile index', migrate_member_profile_index),
+    (18, 'membership bitmaps', migrate_membership_sets),
+    (19, 'role histograms', migrate_role_histograms),
+    (20, 'archive sample counts', migrate_archive_sample_counts),
+    (21, 'member profile key index', migrate_member_profile_key_index),
+]
+_schema_ready = set()  # DB paths already migrated by this process
+
+def run_schema_migrations(db):
+    """
+    Apply every migration newer than the DB's user_version, in order. Each step runs in its own
+    IMMEDIATE transaction and re-checks the version under the lock. db must be in autocommit mode.
+    """
+    applied = []
+    for version, description, migrate in SCHEMA_MIGRATIONS:
+        if db.execute('PRAGMA user_version').fetchone()[0] >= version:
+            continue
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('PRAGMA user_version').fetchone()[0] < version:
+                migrate(db)
+                db.execute(f'PRAGMA user_version = {version}')
+                applied.append(f"v{version}: {description}")
+            db.execute('COMMIT')
+        except Exception:
+            db.execute('ROLLBACK')
+            raise
+    return applied
+
+def ensure_schema(force=False):
+    """
+    Bring the database up to the latest schema version once per process; later calls are a set lookup.
+    Returns (applied migrations, backfilled rows).
+    """
+    if DB_PATH in _schema_ready and not force:
+        return [], 0
+    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    conn = sqlite3.connect(DB_PATH, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')  # only takes effect while the file is empty
+        applied = run_schema_migrations(conn)
+        align_partitions(conn)
+        filled = backfill_epoch_columns(conn)
+        for path in shard_paths(conn):
+            prepare_shard(path)
+    finally:
+        conn.close()
+    _schema_ready.add(DB_PATH)
+    return applied, filled
+
+# --- Sharded layout ---
+# Optional (enabled from the bot): each guild's rows of SHARD_TABLES live in shard file
+# guild_id % shard count, and DB_PATH is the catalog holding everything else. A guild-scoped
+# connection opens the guild's shard as main with the catalog attached, so unqualified table names
+# resolve to the right file; a cross-guild connection opens the catalog with every shard attached
+# behind read-only UNION ALL temp views named after SHARD_TABLES.
+SHARD_TABLES = ('snapshots', 'demographics', 'member_events', 'membership_sets', 'role_histograms')
+
+def shard_paths(db):
+    """Absolute shard file paths in shard order ([] when the DB is not sharded)"""
+    return [os.path.join(SHARD_DIR, path) for (path,) in db.execute('SELECT path FROM main.shards ORDER BY shard')]
+
+def shard_for(guild_id, count):
+    return int(guild_id) % count
+
+def is_shard_local(table):
+    """Whether a table lives in shard files: SHARD_TABLES, their monthly snapshot partitions and the full-text index backing demographics"""
+    return table in SHARD_TABLES or table.startswith(('snapshots_p', 'demographics_fts'))
+
+def prepare_shard(path):
+    """Create or migrate a shard file: the catalog's migrations, then drop every table that is not shard-local"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')  # only takes effect while the file is empty
+        run_schema_migrations(conn)
+        align_partitions(conn)
+        tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+        for (table,) in tables:
+            if not is_shard_local(table):
+                conn.execute(f'DROP TABLE IF EXISTS {table}')
+    finally:
+        conn.close()
+
+def attach_shards(db, paths):
+    """Attach every shard as shard_<n> and shadow SHARD_TABLES with UNION ALL temp views over them"""
+    for n, path in enumerate(paths):
+        db.execute(f'ATTACH DATABASE ? AS shard_{n}', (path,))
+    for table in SHARD_TABLES:
+        union_view(db, table, [f'shard_{n}' for n in range(len(paths))])
+
+def connect_db(guild_id=None):
+    """
+    Connection for guild_id's data (its shard as main, catalog attached) or, without a guild_id,
+    for cross-guild reads (catalog as main, every shard attached). Unsharded DBs always get a plain
+    connection to DB_PATH.
+    """
+    db = sqlite3.connect(DB_PATH)
+    db.row_factory = sqlite3.Row
+    paths = shard_paths(db)
+    if paths and guild_id is not None and str(guild_id).isdigit():
+        db.close()
+        db = sqlite3.connect(paths[shard_for(guild_id, len(paths))])
+        db.row_factory = sqlite3.Row
+        db.execute('ATTACH DATABASE ? AS catalog', (DB_PATH,))
+    elif paths:
+        attach_shards(db, paths)
+        return db
+    if partition_names(db):
+        union_view(db, 'snapshots', ['main'])
+    return db
+
+def shard_schemas(db):
+    """Attached shard schema names on a cross-guild connection ([] on any other connection)"""
+    return [row[1] for row in db.execute('PRAGMA database_list') if row[1].startswith('shard_')]
+
+# --- Monthly snapshot partitions ---
+# Optional (enabled from the bot): closed months of snapshots live in snapshots_pYYYYMM tables next
+# to the live snapshots table (in the catalog, or in each shard), and retention drops them whole. A
+# partition's bounds come from its name. On a partitioned connection snapshots is a read-only temp view
+# over the live table and every partition; time-bounded queries use snapshot_tables() to skip months.
+PARTITION_GLOB = 'snapshots_p[0-9][0-9][0-9][0-9][0-9][0-9]'
+
+def partition_bounds(name):
+    """[start_ms, end_ms) of a partition's month"""
+    year, month = int(name[-6:-2]), int(name[-2:])
+    start = datetime(year, month, 1, tzinfo=timezone.utc)
+    end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    return to_epoch_ms(start), to_epoch_ms(end)
+
+def partition_names(db, schema='main'):
+    """A schema's snapshot partitions, oldest month first"""
+    return [row[0] for row in db.execute(
+        f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (PARTITION_GLOB,)
+    )]
+
+def snapshot_tables(db, schema='main', start_ms=None, end_ms=None):
+    """Qualified names of schema's live snapshots table and of the partitions overlapping [start_ms, end_ms)"""
+    tables = [f'{schema}.snapshots']
+    for name in partition_names(db, schema):
+        low, high = partition_bounds(name)
+        if (start_ms is None or high > start_ms) and (end_ms is None or low < end_ms):
+            tables.append(f'{schema}.{name}')
+    return tables
+
+def all_snapshot_tables(db, start_ms=None, end_ms=None):
+    """snapshot_tables() of every schema on db: each attached shard, or main"""
+    return [table for schema in shard_schemas(db) or ['main'] for table in snapshot_tables(db, schema, start_ms, end_ms)]
+
+def union_view(db, table, schemas):
+    """Shadow table with a temp view over every schema's copy of it (for snapshots, live table plus partitions)"""
+    db.execute(f'DROP VIEW IF EXISTS temp.{table}')
+    columns = ', '.join(row[1] for row in db.execute(f'PRAGMA {schemas[0]}.table_xinfo({table})'))
+    sources = [
+        source for schema in schemas
+        for source in (snapshot_tables(db, schema) if table == 'snapshots' else [f'{schema}.{table}'])
+    ]
+    union = ' UNION ALL '.join(f'SELECT {columns} FROM {source}' for source in sources)
+    db.execute(f'CREATE TEMP VIEW {table} AS {union}')
+
+def align_partitions(db):
+    """Give existing partitions the columns later migrations added to the live snapshots table"""
+    columns = [(row[1], row[2]) for row in db.execute('PRAGMA table_info(snapshots)') if not row[5]]
+    for name in partition_names(db):
+        add_missing_columns(db, name, columns)
+
+def get_db(guild_id=None):
+    """Request-scoped connection from connect_db, one per guild_id (None: cross-guild)"""
+    conns = g.setdefault('db_conns', {})
+    key = str(guild_id) if guild_id else None
+    if key not in conns:
+        ensure_schema()
+        conns[key] = connect_db(key)
+    return conns[key]
 
 @app.teardown_appcontext
 def close_db(exception=None):
-    db_conn = g.pop('db_conn', None)
-    if db_conn is not None:
+    for db_conn in g.pop('db_conns', {}).values():
         db_conn.close()
 
 def validate_and_repair_database():
-    """Comprehensive database validation and repair function"""
+    """
+    Comprehensive database validation and repair function.
+    Applies pending migrations, then compares the live schema against a reference DB built from
+    SCHEMA_MIGRATIONS and recreates any table, column, index, view or trigger that has gone missing.
+    """
     print(" Validating database schema...")
     
-    # Ensure the database directory exists
-    os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+    issues_found = []
+    fixes_applied = []
+    
+    try:
+        applied, filled = ensure_schema(force=True)
+        fixes_applied.extend(f"Applied migration {step}" for step in applied)
+        if filled:
+            fixes_applied.append(f"Backfilled epoch-ms columns for {filled} rows")
+    except Exception as e:
+        issues_found.append(f"Schema migration failed: {e}")
     
     db = get_db()
     cursor = db.cursor()
     
-    # Define expected schema
-    expected_schema = {
-        'server_config': {
-            'columns': [
-                ('guild_id', 'TEXT', 'PRIMARY KEY'),
-                ('guild_name', 'TEXT', ''),
-                ('auto_snapshot', 'BOOLEAN', 'DEFAULT 0'),
-                ('last_auto_snapshot', 'TEXT', ''),
-                ('first_snapshot_date', 'TEXT', ''),
-                ('chart_style', 'TEXT', 'DEFAULT \'emoji\''),
-                ('snapshot_retention_days', 'INTEGER', 'DEFAULT 90'),
-                ('auto_snapshot_interval_hours', 'INTEGER', 'DEFAULT 20'),
-                ('last_snapshot', 'TEXT', '')
-            ]
-        },
-        'snapshots': {
-            'columns': [
-                ('id', 'INTEGER', 'PRIMARY KEY AUTOINCREMENT'),
-                ('guild_id', 'TEXT', 'NOT NULL'),
-                ('guild_name', 'TEXT', ''),
-                ('timestamp', 'TEXT', 'NOT NULL'),
-                ('member_count', 'INTEGER', ''),
-                ('channel_count', 'INTEGER', ''),
-                ('text_channels', 'INTEGER', ''),
-                ('voice_channels', 'INTEGER', ''),
-                ('categories', 'INTEGER', ''),
-                ('role_count', 'INTEGER', ''),
-                ('bots', 'INTEGER', ''),
-                ('boosters', 'INTEGER', ''),
-                ('is_auto', 'BOOLEAN', 'DEFAULT 0')
-            ]
-        },
-        'demographics': {
-            'columns': [
-                ('guild_id', 'TEXT', 'NOT NULL'),
-                ('member_id', 'TEXT', 'NOT NULL'),
-                ('name', 'TEXT', ''),
-                ('account_created', 'TEXT', ''),
-                ('joined_at', 'TEXT', ''),
-                ('timestamp', 'TEXT', ''),
-                ('PRIMARY KEY', '(guild_id, member_id)', '')
-            ]
-        },
-        'demographics_servers': {
-            'columns': [
-                ('guild_id', 'TEXT', 'PRIMARY KEY')
-            ]
-        }
-    }
-    
-    issues_found = []
-    fixes_applied = []
+    # Reference schema: a fresh in-memory DB taken through every migration
+    reference = sqlite3.connect(':memory:', isolation_level=None)
+    run_schema_migrations(reference)
+    expected_objects = reference.execute(
+        "SELECT type, name, tbl_name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid"
+    ).fetchall()
     
-    # Check if all tables exist
-    cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-    existing_tables = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT name FROM sqlite_master")
+    existing_objects = {row[0] for row in cursor.fetchall()}
     
-    for table_name, table_info in expected_schema.items():
-        if table_name not in existing_tables:
-            issues_found.append(f"Missing table: {table_name}")
-            # Create the missing table
-            columns_def = []
-            for col_name, col_type, col_constraints in table_info['columns']:
-                if col_name == 'PRIMARY KEY':
-                    columns_def.append(f"PRIMARY KEY {col_type}")
-                else:
-                    column_def = f"{col_name} {col_type}"
-                    if col_constraints:
-                        column_def += f" {col_constraints}"
-                    columns_def.append(column_def)
-            
-            create_sql = f"CREATE TABLE {table_name} ({', '.join(columns_def)})"
+    for obj_type, name, table_name, create_sql in expected_objects:
+        if name not in existing_objects:
+            issues_found.append(f"Missing {obj_type}: {name}")
             try:
                 cursor.execute(create_sql)
-                fixes_applied.append(f"Created table: {table_name}")
+                fixes_applied.append(f"Created {obj_type}: {name}")
+                existing_objects.update(row[0] for row in cursor.execute("SELECT name FROM sqlite_master").fetchall())
             except Exception as e:
-                issues_found.append(f"Failed to create table {table_name}: {e}")
-    
-    # Check columns in each table
-    for table_name, table_info in expected_schema.items():
-        if table_name in existing_tables:
-            cursor.execute(f"PRAGMA table_info({table_name})")
-            existing_columns = {row[1]: row[2] for row in cursor.fetchall()}
-            
-            for col_name, col_type, col_constraints in table_info['columns']:
-                if col_name == 'PRIMARY KEY':
-                    continue  # Skip primary key constraints for now
-                
-                if col_name not in existing_columns:
-                    issues_found.append(f"Missing column: {table_name}.{col_name}")
-                    # Add the missing column
-                    try:
-                        add_column_sql = f"ALTER TABLE {table_name} ADD COLUMN {col_name} {col_type}"
-                        if col_constraints and 'DEFAULT' in col_constraints:
-                            add_column_sql += f" {col_constraints}"
-                        cursor.execute(add_column_sql)
-                        fixes_applied.append(f"Added column: {table_name}.{col_name}")
-                    except Exception as e:
-                        issues_found.append(f"Failed to add column {table_name}.{col_name}: {e}")
+                issues_found.append(f"Failed to create {obj_type} {name}: {e}")
+            continue
+        
+        if obj_type == 'table':
+            # Check columns
+            cursor.execute(f"PRAGMA table_info({name})")
+            existing_columns = {row[1] for row in cursor.fetchall()}
+            for _, col_name, col_type, _, default, _ in reference.execute(f"PRAGMA table_info({name})").fetchall():
+                if col_name in existing_columns:
+                    continue
+                issues_found.append(f"Missing column: {name}.{col_name}")
+                try:
+                    add_column_sql = f"ALTER TABLE {name} ADD COLUMN {col_name} {col_type}"
+                    if default is not None:
+                        add_column_sql += f" DEFAULT {default}"
+                    cursor.execute(add_column_sql)
+                    fixes_applied.append(f"Added column: {name}.{col_name}")
+                except Exception as e:
+                    issues_found.append(f"Failed to add column {name}.{col_name}: {e}")
+        elif obj_type == 'index':
+            # Check the index covers the expected columns
+            expected_columns = [row[2] for row in sorted(reference.execute(f"PRAGMA index_info({name})").fetchall())]
+            actual_columns = [row[2] for row in sorted(cursor.execute(f"PRAGMA index_info({name})").fetchall())]
+            if actual_columns == expected_columns:
+                continue
+            issues_found.append(f"Index {name} covers {actual_columns}, expected {expected_columns}")
+            try:
+                cursor.execute(f"DROP INDEX {name}")
+                cursor.execute(create_sql)
+                fixes_applied.append(f"Rebuilt index: {name}")
+            except Exception as e:
+                issues_found.append(f"Failed to rebuild index {name}: {e}")
+    reference.close()
     
     # Check for any foreign key constraints that might be missing
     # (This is a simplified check - SQLite doesn't enforce foreign keys by default)
@@ -159,7 +833,7 @@ def validate_and_repair_database():
 
 def init_database():
     """Initialize the database with the required schema"""
-    # Use the new validation and repair function
+    # Use the new validation and repair function (also runs the migrations)
     validate_and_repair_database()
 
 def get_global_webhook_url():
@@ -520,43 +1194,45 @@ def lander_page():
 
 @app.route('/api/total_snapshots')
 def total_snapshots():
-    db = get_db()
     guild_id = request.args.get('guild_id')
+    db = get_db(guild_id)
+    # A run or rollup row stands for sample_count snapshots
     if guild_id:
-        count = db.execute("SELECT COUNT(*) as count FROM snapshots WHERE guild_id = ?", (guild_id,)).fetchone()
+        count = db.execute("SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) as count FROM snapshots WHERE guild_id = ?", (guild_id,)).fetchone()
     else:
-        count = db.execute("SELECT COUNT(*) as count FROM snapshots").fetchone()
+        count = db.execute("SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) as count FROM snapshots").fetchone()
     return jsonify({'count': count['count']})
 
 @app.route('/api/snapshots_24h')
 def snapshots_24h():
-    db = get_db()
     import datetime
     guild_id = request.args.get('guild_id')
+    db = get_db(guild_id)
     now = datetime.datetime.now(datetime.timezone.utc)
     hours = [(now - datetime.timedelta(hours=i)).replace(minute=0, second=0, microsecond=0) for i in range(23, -1, -1)]
     hour_labels = [h.strftime('%H:00') for h in hours]
+    # Only the live table and the partitions overlapping the window can hold these rows
+    tables = all_snapshot_tables(db, to_epoch_ms(hours[0]), to_epoch_ms(now))
     counts = []
     for h in hours:
         next_h = h + datetime.timedelta(hours=1)
-        if guild_id:
-            c = db.execute("SELECT COUNT(*) FROM snapshots WHERE guild_id = ? AND timestamp >= ? AND timestamp < ?", (guild_id, h.isoformat(), next_h.isoformat())).fetchone()[0]
-        else:
-            c = db.execute("SELECT COUNT(*) FROM snapshots WHERE timestamp >= ? AND timestamp < ?", (h.isoformat(), next_h.isoformat())).fetchone()[0]
+        c = 0
+        for table in tables:
+            if guild_id:
+                c += db.execute(f"SELECT COUNT(*) FROM {table} WHERE guild_id = ? AND timestamp_ms >= ? AND timestamp_ms < ?", (guild_id, to_epoch_ms(h), to_epoch_ms(next_h))).fetchone()[0]
+            else:
+                c += db.execute(f"SELECT COUNT(*) FROM {table} WHERE timestamp_ms >= ? AND timestamp_ms < ?", (to_epoch_ms(h), to_epoch_ms(next_h))).fetchone()[0]
         counts.append(c)
     return jsonify({'hours': hour_labels, 'counts': counts})
 
 @app.route('/api/members_over_time')
 def members_over_time():
-    db = get_db()
     import datetime
     days = request.args.get('days', default=None, type=int)
     guild_id = request.args.get('guild_id')
+    db = get_db(guild_id)
     # Use snapshot member_count per day (last snapshot of each day)
-    if guild_id:
-        rows = db.execute("SELECT timestamp, member_count FROM snapshots WHERE guild_id = ? ORDER BY timestamp", (guild_id,)).fetchall()
-    else:
-        rows = db.execute("SELECT timestamp, member_count FROM snapshots ORDER BY timestamp", ()).fetchall()
+    rows = snapshot_history(db, guild_id)
     # Group by day, take the last snapshot of each day
     from collections import defaultdict
     day_map = defaultdict(list)
@@ -584,8 +1260,8 @@ def members_over_time():
 
 @app.route('/api/user_count')
 def user_count():
-    db = get_db()
     guild_id = request.args.get('guild_id')
+    db = get_db(guild_id)
     if guild_id:
         count = db.execute("SELECT COUNT(DISTINCT member_id) as count FROM demographics WHERE guild_id = ?", (guild_id,)).fetchone()
     else:
@@ -594,38 +1270,79 @@ def user_count():
 
 @app.route('/api/membership_count')
 def membership_count():
-    db = get_db()
     guild_id = request.args.get('guild_id')
+    db = get_db(guild_id)
     if guild_id:
         count = db.execute("SELECT COUNT(*) as count FROM demographics WHERE guild_id = ?", (guild_id,)).fetchone()
     else:
         count = db.execute("SELECT COUNT(*) as count FROM demographics").fetchone()
     return jsonify({'count': count['count']})
 
+CHURN_MAX_DAYS = {'day': 365, 'hour': 31}  # caps the series at 366 daily or 745 hourly points
+
+@app.route('/api/churn')
+def churn():
+    """
+    Joins, leaves and net change per UTC day (or hour, with bucket=hour) over the last `days` days,
+    read from the member_events log the bot appends to on every member fetch
+    """
+    guild_id = request.args.get('guild_id')
+    bucket = request.args.get('bucket', 'day')
+    if bucket not in ('day', 'hour'):
+        return jsonify({'error': 'bucket must be day or hour'}), 400
+    days = request.args.get('days', default=30, type=int)
+    if not 1 <= days <= CHURN_MAX_DAYS[bucket]:
+        return jsonify({'error': f'days must be between 1 and {CHURN_MAX_DAYS[bucket]} for bucket={bucket}'}), 400
+    bucket_ms = 86400000 if bucket == 'day' else 3600000
+    now_ms = to_epoch_ms(datetime.now(timezone.utc))
+    first_bucket = (now_ms - days * 86400000) // bucket_ms
+    db = get_db(guild_id)
+    where = 'timestamp_ms >= ?'
+    params = [bucket_ms, first_bucket * bucket_ms]
+    if guild_id:
+        where = 'guild_id = ? AND ' + where
+        params.insert(1, guild_id)
+    rows = db.execute(
+        f"SELECT timestamp_ms / ? AS bucket, SUM(kind = 1), SUM(kind = -1) FROM member_events WHERE {where} GROUP BY bucket",
+        params
+    ).fetchall()
+    counts = {row[0]: (row[1], row[2]) for row in rows}
+    labels, joins, leaves = [], [], []
+    for n in range(first_bucket, now_ms // bucket_ms + 1):
+        label = from_epoch_ms(n * bucket_ms)
+        labels.append(label[:10] if bucket == 'day' else f"{label[:10]} {label[11:13]}:00")
+        joined, left = counts.get(n, (0, 0))
+        joins.append(joined)
+        leaves.append(left)
+    return jsonify({
+        'bucket': bucket,
+        'labels': labels,
+        'joins': joins,
+        'leaves': leaves,
+        'net': [joined - left for joined, left in zip(joins, leaves)],
+    })
+
 @app.route('/api/servers')
 def list_servers():
     db = get_db()
-    # For each unique guild_id, get the most recent snapshot's guild_name
-    servers = db.execute('''
-        SELECT s.guild_id, s.guild_name
-        FROM snapshots s
-        INNER JOIN (
-            SELECT guild_id, MAX(timestamp) as max_ts
-            FROM snapshots
-            GROUP BY guild_id
-        ) latest
-        ON s.guild_id = latest.guild_id AND s.timestamp = latest.max_ts
-    ''').fetchall()
-    return jsonify([{'id': row['guild_id'], 'name': row['guild_name'] or str(row['guild_id'])} for row in servers])
+    # guilds carries each server's name as of its most recent snapshot
+    servers = db.execute('SELECT guild_id, name FROM guilds ORDER BY guild_id').fetchall()
+    return jsonify([{'id': snowflake_str(row['guild_id']), 'name': row['name'] or str(row['guild_id'])} for row in servers])
 
-@app.route('/api/server/<guild_id>/snapshots')
-def server_snapshots(guild_id):
+@app.route('/api/server/<guild_id>/names')
+def server_name_history(guild_id):
     db = get_db()
-    group = request.args.get('group', 'snapshot')
     rows = db.execute(
-        'SELECT timestamp, member_count FROM snapshots WHERE guild_id=? ORDER BY timestamp',
-        (guild_id,)
+        'SELECT name, changed_at_ms FROM guild_name_history WHERE guild_id = ? ORDER BY changed_at_ms', (guild_id,)
     ).fetchall()
+    return jsonify([{'name': row['name'], 'changed_at': from_epoch_ms(row['changed_at_ms'])} for row in rows])
+
+@app.route('/api/server/<guild_id>/snapshots')
+def server_snapshots(guild_id):
+    db = get_db(guild_id)
+    group = request.args.get('group', 'snapshot')
+    # Compacted rows hold their bucket's last member_count plus its min/max
+    rows = snapshot_history(db, guild_id)
     import datetime
     from collections import defaultdict
     if group == 'snapshot':
@@ -636,23 +1353,32 @@ def server_snapshots(guild_id):
         day_map = defaultdict(list)
         for row in rows:
             day = row['timestamp'][:10]
-            day_map[day].append(row['member_count'])
+            day_map[day].append(row)
         result = []
-        prev = None
         for day in sorted(day_map.keys()):
-            count = day_map[day][-1]  # last snapshot of the day
-            result.append({'timestamp': day, 'member_count': count})
+            day_rows = day_map[day]
+            result.append({
+                'timestamp': day,
+                'member_count': day_rows[-1]['member_count'],  # last snapshot of the day
+                'min': min(row['member_min'] for row in day_rows),
+                'max': max(row['member_max'] for row in day_rows),
+            })
     elif group == 'week':
         week_map = defaultdict(list)
         for row in rows:
             dt = datetime.datetime.fromisoformat(row['timestamp'])
             year, week, _ = dt.isocalendar()
             key = f'{year}-W{week:02d}'
-            week_map[key].append(row['member_count'])
+            week_map[key].append(row)
         result = []
         for week in sorted(week_map.keys()):
-            count = week_map[week][-1]  # last snapshot of the week
-            result.append({'timestamp': week, 'member_count': count})
+            week_rows = week_map[week]
+            result.append({
+                'timestamp': week,
+                'member_count': week_rows[-1]['member_count'],  # last snapshot of the week
+                'min': min(row['member_min'] for row in week_rows),
+                'max': max(row['member_max'] for row in week_rows),
+            })
     else:
         result = [
             {'timestamp': row['timestamp'], 'member_count': row['member_count']} for row in rows
@@ -661,11 +1387,13 @@ def server_snapshots(guild_id):
 
 @app.route('/api/server/<guild_id>/demographics')
 def server_demographics(guild_id):
-    db = get_db()
-    rows = db.execute(
-        'SELECT member_id, name, account_created, joined_at FROM demographics WHERE guild_id=?',
-        (guild_id,)
-    ).fetchall()
+    db = get_db(guild_id)
+    def top(order_by, where='1=1'):
+        # Primary-key (member_id order is account age) or idx_demographics_guild_joined_ms range, 3 rows
+        return db.execute(
+            f'SELECT member_id, name, account_created, joined_at FROM demographics WHERE guild_id=? AND {where} ORDER BY {order_by} LIMIT 3',
+            (guild_id,)
+        ).fetchall()
     def format_utc(dtstr):
         if not dtstr:
             return ''
@@ -674,37 +1402,22 @@ def server_demographics(guild_id):
             return dt.strftime('%Y-%m-%d %H:%M UTC')
         except Exception:
             return dtstr
-    members = [
-        {
-            'member_id': row['member_id'],
-            'name': row['name'],
-            'account_created_raw': row['account_created'],
-            'joined_at_raw': row['joined_at'],
-        }
-        for row in rows
-    ]
-    # Filter out nulls for sorting
-    acc_sorted = [m for m in members if m['account_created_raw']]
-    join_sorted = [m for m in members if m['joined_at_raw']]
-    oldest_acc = sorted(acc_sorted, key=lambda m: m['account_created_raw'])[:3]
-    newest_acc = sorted(acc_sorted, key=lambda m: m['account_created_raw'], reverse=True)[:3]
-    longest_mem = sorted(join_sorted, key=lambda m: m['joined_at_raw'])[:3]
-    newest_mem = sorted(join_sorted, key=lambda m: m['joined_at_raw'], reverse=True)[:3]
-    def display_list(lst, key):
+    def display_list(rows, key):
         return [
             {
-                'member_id': m['member_id'],
-                'name': m['name'],
-                key: format_utc(m[key + '_raw'])
+                'member_id': snowflake_str(row['member_id']),
+                'name': row['name'],
+                key: format_utc(row[key])
             }
-            for m in lst
+            for row in rows
         ]
+    total = db.execute('SELECT COUNT(*) FROM demographics WHERE guild_id=?', (guild_id,)).fetchone()[0]
     return jsonify({
-        'total': len(members),
-        'oldest_accounts': display_list(oldest_acc, 'account_created'),
-        'newest_accounts': display_list(newest_acc, 'account_created'),
-        'longest_members': display_list(longest_mem, 'joined_at'),
-        'newest_members': display_list(newest_mem, 'joined_at')
+        'total': total,
+        'oldest_accounts': display_list(top('member_id'), 'account_created'),
+        'newest_accounts': display_list(top('member_id DESC'), 'account_created'),
+        'longest_members': display_list(top('joined_at_ms', 'joined_at_ms IS NOT NULL'), 'joined_at'),
+        'newest_members': display_list(top('joined_at_ms DESC', 'joined_at_ms IS NOT NULL'), 'joined_at')
     })
 
 @app.route('/database')
@@ -922,7 +1635,7 @@ def database_page():
                         <h3>Search Results</h3>
                         <div>
                             <button id="downloadBtn" onclick="downloadCSV()">Download CSV</button>
-                            <button id="downloadJsonBtn" onclick="downloadJSON()" style="margin-left:8px;">Download JSON</button>
+                            <button id="downloadJsonBtn" onclick="downloadJSON()" style="margin-left:8px;">Download NDJSON</button>
                         </div>
                     </div>
                     <div id="searchStats" class="search-stats" style="display:none;"></div>
@@ -943,7 +1656,8 @@ def database_page():
         <script>
             let lastQuery = '';
             let currentSearchResults = [];
-            let currentOffset = 0;
+            let nextCursor = null;
+            let currentTotal = 0;
             let currentLimit = 250;
             let hasMoreResults = false;
             let isLoading = false;
@@ -1009,7 +1723,7 @@ def database_page():
                 searchTimeout = setTimeout(doSearch, 250);
             }
 
-            async function doSearch(offset = 0) {
+            async function doSearch(after = '') {
                 const q = document.getElementById('searchBox').value.trim();
                 if (!q && !selectedServer) {
                     document.getElementById('results').innerHTML = "<span style='color:#888'>Search results will appear here.</span>";
@@ -1019,16 +1733,17 @@ def database_page():
                 }
                 isLoading = true;
                 document.getElementById('searchSpinner').classList.add('active');
-                let url = `/api/search_user?limit=${currentLimit}&offset=${offset}`;
+                let url = `/api/search_user?limit=${currentLimit}&after=${encodeURIComponent(after)}`;
                 if (q) url += `&q=${encodeURIComponent(q)}`;
                 if (selectedServer) url += `&guild_id=${encodeURIComponent(selectedServer)}`;
                 const res = await fetch(url);
                 const data = await res.json();
-                currentSearchResults = (offset === 0) ? data.results : currentSearchResults.concat(data.results);
+                currentSearchResults = (after === '') ? data.results : currentSearchResults.concat(data.results);
                 hasMoreResults = data.has_more;
-                currentOffset = data.offset + data.limit;
+                nextCursor = data.next;
+                if (data.total !== null) currentTotal = data.total;
                 renderResults();
-                renderStats(data.total, currentSearchResults.length, hasMoreResults);
+                renderStats(currentTotal, currentSearchResults.length, hasMoreResults);
                 document.getElementById('searchSpinner').classList.remove('active');
                 isLoading = false;
             }
@@ -1041,7 +1756,7 @@ def database_page():
                 }
                 let html = `<table><thead><tr><th>Name</th><th>Member ID</th><th>Account Created</th><th>Joined At</th><th>Server</th></tr></thead><tbody>`;
                 results.forEach(row => {
-                    html += `<tr class='user-row' style='cursor:pointer;' onclick='showUserHistory("${row.member_id}", "${row.name}")'>` +
+                    html += `<tr class='user-row' style='cursor:pointer;' onclick='showUserHistory("${row.member_id}", "${row.name}")' onmouseenter='previewMember(this, "${row.member_id}")'>` +
                         `<td>${row.name}</td>` +
                         `<td>${row.member_id}</td>` +
                         `<td>${row.account_created}</td>` +
@@ -1051,7 +1766,7 @@ def database_page():
                 });
                 html += `</tbody></table>`;
                 if (hasMoreResults) {
-                    html += `<button class='load-more-btn' onclick='doSearch(${currentOffset})'>Load More</button>`;
+                    html += `<button class='load-more-btn' onclick='doSearch(nextCursor)'>Load More</button>`;
                 }
                 document.getElementById('results').innerHTML = html;
             }
@@ -1062,53 +1777,66 @@ def database_page():
                 stats.style.display = '';
             }
 
-            function downloadCSV() {
+            // Exports stream every matching row from the server, not just the pages loaded here
+            function exportSearch(format) {
                 if (!currentSearchResults.length) return;
-                let csv = 'Name,Member ID,Account Created,Joined At,Server\n';
-                currentSearchResults.forEach(row => {
-                    csv += `"${row.name}","${row.member_id}","${row.account_created}","${row.joined_at}","${row.guild_id}"\n`;
-                });
-                const blob = new Blob([csv], {type: 'text/csv'});
-                const url = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = 'user_search_results.csv';
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                URL.revokeObjectURL(url);
+                const q = document.getElementById('searchBox').value.trim();
+                let url = `/api/export/demographics?format=${format}`;
+                if (q) url += `&q=${encodeURIComponent(q)}`;
+                if (selectedServer) url += `&guild_id=${encodeURIComponent(selectedServer)}`;
+                window.location.href = url;
+            }
+
+            function downloadCSV() {
+                exportSearch('csv');
             }
 
             function downloadJSON() {
-                if (!currentSearchResults.length) return;
-                const blob = new Blob([JSON.stringify(currentSearchResults, null, 2)], {type: 'application/json'});
-                const url = URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = 'user_search_results.json';
-                document.body.appendChild(a);
-                a.click();
-                document.body.removeChild(a);
-                URL.revokeObjectURL(url);
+                exportSearch('ndjson');
+            }
+
+            // Member profiles by member_id, shared by the hover preview and the history modal
+            const memberProfiles = new Map();
+
+            function fetchMemberProfile(member_id) {
+                if (!memberProfiles.has(member_id)) {
+                    memberProfiles.set(member_id, fetch(`/api/member/${encodeURIComponent(member_id)}`).then(res => res.ok ? res.json() : null));
+                }
+                return memberProfiles.get(member_id);
+            }
+
+            async function previewMember(tr, member_id) {
+                if (tr.title) return;
+                const data = await fetchMemberProfile(member_id);
+                if (!data) return;
+                const present = data.guilds.filter(row => !row.left_at).length;
+                tr.title = `${data.name || member_id}: in ${present} of ${data.guilds.length} tracked server(s), ` +
+                    `${data.names.length} known name(s), account created ${data.account_created.slice(0, 10)}`;
             }
 
             async function showUserHistory(member_id, name) {
                 document.getElementById('userHistoryModal').style.display = 'flex';
                 document.getElementById('userHistoryTitle').textContent = `History for ${name} (${member_id})`;
                 document.getElementById('userHistoryContent').innerHTML = '<div class="loading">Loading...</div>';
-                const res = await fetch(`/api/user_history?member_id=${encodeURIComponent(member_id)}`);
-                const data = await res.json();
-                if (!data.length) {
+                const data = await fetchMemberProfile(member_id);
+                if (!data) {
                     document.getElementById('userHistoryContent').innerHTML = '<span style="color:#888">No history found for this user.</span>';
                     return;
                 }
-                let html = `<table style='width:100%;'><thead><tr><th>Server</th><th>Name</th><th>Account Created</th><th>Joined At</th></tr></thead><tbody>`;
-                data.forEach(row => {
+                let html = `<div style='color:#888;margin-bottom:8px;'>Account created ${data.account_created}</div>`;
+                html += `<table style='width:100%;'><thead><tr><th>Name</th><th>Since</th></tr></thead><tbody>`;
+                data.names.forEach(row => {
+                    html += `<tr><td>${row.name}</td><td>${row.since}</td></tr>`;
+                });
+                html += `</tbody></table><br>`;
+                html += `<table style='width:100%;'><thead><tr><th>Server</th><th>Joined At</th><th>First Seen</th><th>Last Seen</th><th>Left</th></tr></thead><tbody>`;
+                data.guilds.forEach(row => {
                     html += `<tr>` +
-                        `<td>${row.guild_id}</td>` +
-                        `<td>${row.name}</td>` +
-                        `<td>${row.account_created}</td>` +
+                        `<td>${row.guild_name || row.guild_id}</td>` +
                         `<td>${row.joined_at}</td>` +
+                        `<td>${row.first_seen}</td>` +
+                        `<td>${row.last_seen}</td>` +
+                        `<td>${row.left_at || ''}</td>` +
                         `</tr>`;
                 });
                 html += `</tbody></table>`;
@@ -1128,38 +1856,155 @@ def database_page():
     </html>
     """)
 
+def like_escape(text):
+    """Escape LIKE wildcards so text matches literally (use with ESCAPE '\\')"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+TRIGRAM_MIN_QUERY = 3  # the trigram tokenizer cannot match shorter strings
+
+def member_search_sql(q, guild_id, after_key=None, schema=None):
+    """
+    (FROM ... WHERE clause, params, sort key expressions, sort key params) for a member name search
+    over schema's demographics (default: unqualified, i.e. whatever demographics resolves to).
+    Queries of TRIGRAM_MIN_QUERY+ characters are substring matches through demographics_fts, sorted
+    exact name first, then prefix matches, then the rest; shorter queries are case-insensitive name
+    prefix matches walked in idx_demographics_name_key (or idx_demographics_guild_name) order. The sort key always ends in
+    (name, guild_id, member_id), so it is unique per row and doubles as the keyset cursor:
+    after_key (a previous row's sort key values) restricts the results to rows sorting after it.
+    """
+    prefix = f'{schema}.' if schema else ''
+    where = []
+    params = []
+    key = ['d.name COLLATE NOCASE', 'd.guild_id', 'd.member_id']
+    key_params = []
+    name_range = None  # (lower, upper) NOCASE bounds that seek idx_demographics_name_key
+    if q and len(q) >= TRIGRAM_MIN_QUERY:
+        source = f'{prefix}demographics d JOIN {prefix}demographics_fts ON demographics_fts.rowid = d.rowid'
+        where.append('demographics_fts MATCH ?')
+        params.append('"' + q.replace('"', '""') + '"')
+        key.insert(0, "CASE WHEN d.name = ? COLLATE NOCASE THEN 0 WHEN d.name LIKE ? ESCAPE '\\' THEN 1 ELSE 2 END")
+        key_params = [q, like_escape(q) + '%']
+        # Unary + keeps the planner driving from the FTS match instead of scanning the guild's rows
+        guild_column = '+d.guild_id'
+    else:
+        source = f'{prefix}demographics d'
+        name_range = (None, None)
+        if q:
+            # Prefix as a range on idx_demographics_name_key (NOCASE folds to lower case)
+            lower = q.lower()
+            name_range = (lower, lower[:-1] + chr(ord(lower[-1]) + 1))
+        guild_column = 'd.guild_id'
+    if guild_id:
+        # Explicit cast: the unary + form has no column affinity to convert a text id
+        where.append(f'{guild_column} = CAST(? AS INTEGER)')
+        params.append(guild_id)
+    if after_key is not None:
+        if len(after_key) != len(key):
+            raise ValueError('Invalid cursor')
+        where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+        params.extend(key_params + list(after_key))
+        if name_range:
+            # A row value led by a COLLATE expression does not seek, so the cursor name becomes the lower bound
+            name_range = (after_key[0], name_range[1])
+    if name_range:
+        for bound, op in zip(name_range, ('>=', '<')):
+            if bound is not None:
+                where.append(f'd.name {op} ? COLLATE NOCASE')
+                params.append(bound)
+    where_clause = ' AND '.join(where) if where else '1=1'
+    return f'{source} WHERE {where_clause}', params, key, key_params
+
+NOCASE_FOLD = str.maketrans('ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz')
+
+def member_search_key(q):
+    """
+    Python equivalent of member_search_sql's ORDER BY for result rows (needs name, guild_id and
+    member_id), for merging per-shard results. NOCASE and LIKE only fold ASCII letters.
+    """
+    folded_q = q.translate(NOCASE_FOLD) if q else ''
+    tiered = len(folded_q) >= TRIGRAM_MIN_QUERY
+    def key(row):
+        name = row['name']
+        folded = name.translate(NOCASE_FOLD) if name is not None else ''
+        values = (name is not None, folded, row['guild_id'], row['member_id'])
+        if tiered:
+            tier = 0 if folded == folded_q else 1 if folded.startswith(folded_q) else 2
+            return (tier,) + values
+        return values
+    return key
+
+def encode_search_cursor(values):
+    """Opaque cursor token for a search sort key"""
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+def decode_search_cursor(token):
+    """Sort key values from a cursor token; ValueError if it is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f'Invalid cursor: {e}')
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
 @app.route('/api/search_user')
 def search_user():
     q = request.args.get('q', '').strip()
     guild_id = request.args.get('guild_id', '').strip()
     limit = int(request.args.get('limit', 250))  # Default 250 results per page
     offset = int(request.args.get('offset', 0))  # Default start from beginning
+    # Keyset mode: pass after= (empty for the first page), then the previous response's next token
+    after = request.args.get('after')
     
-    db = get_db()
+    db = get_db(guild_id)
+    # On a sharded DB without a guild filter, run the search on every shard and merge the sorted pages
+    schemas = shard_schemas(db) or [None]
     
-    # Build WHERE clause
-    where = []
-    params = []
-    if q:
-        where.append('name LIKE ?')
-        params.append('%' + q + '%')
-    if guild_id:
-        where.append('guild_id = ?')
-        params.append(guild_id)
-    where_clause = ' AND '.join(where) if where else '1=1'
+    try:
+        after_key = decode_search_cursor(after) if after else None
+        # Build FROM/WHERE and the sort key (full-text index for substring queries)
+        searches = [member_search_sql(q, guild_id, after_key, schema) for schema in schemas]
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    key_count = len(searches[0][2])
     
-    # Get total count first
-    count_result = db.execute(
-        f"SELECT COUNT(*) as count FROM demographics WHERE {where_clause}",
-        params
-    ).fetchone()
-    total_count = count_result['count']
+    def select(key):
+        return 'SELECT d.member_id, d.name, d.account_created, d.joined_at, d.guild_id, ' + \
+            ', '.join(f'{expr} AS sort_key_{i}' for i, expr in enumerate(key))
+    order_by = ', '.join(f'sort_key_{i}' for i in range(key_count))
     
-    # Get paginated results
-    rows = db.execute(
-        f"SELECT member_id, name, account_created, joined_at, guild_id FROM demographics WHERE {where_clause} ORDER BY name LIMIT ? OFFSET ?",
-        params + [limit, offset]
-    ).fetchall()
+    def fetch(row_limit, row_offset=0):
+        """Rows [row_offset, row_offset + row_limit) in sort key order, across shards"""
+        if len(searches) == 1:
+            from_clause, params, key, key_params = searches[0]
+            return db.execute(
+                f"{select(key)} FROM {from_clause} ORDER BY {order_by} LIMIT ? OFFSET ?",
+                key_params + params + [row_limit, row_offset]
+            ).fetchall()
+        pages = [db.execute(
+            f"{select(key)} FROM {from_clause} ORDER BY {order_by} LIMIT ?",
+            key_params + params + [row_offset + row_limit]
+        ).fetchall() for from_clause, params, key, key_params in searches]
+        return list(islice(heapq.merge(*pages, key=member_search_key(q)), row_offset, row_offset + row_limit))
+    
+    def count():
+        return sum(db.execute(f"SELECT COUNT(*) FROM {from_clause}", params).fetchone()[0] for from_clause, params, _, _ in searches)
+    
+    if after is not None:
+        # One row past the page tells us whether there is more; the total is only counted for the first page
+        rows = fetch(limit + 1)
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        total_count = None if after_key else count()
+        next_cursor = encode_search_cursor([rows[-1][f'sort_key_{i}'] for i in range(key_count)]) if has_more else None
+    else:
+        # Get total count first
+        total_count = count()
+        
+        # Get paginated results
+        rows = fetch(limit, offset)
+        has_more = (offset + limit) < total_count
+        next_cursor = None
     
     def format_timestamp(ts):
         if not ts:
@@ -1172,19 +2017,18 @@ def search_user():
         return ts
     
     results = [{
-        'member_id': row['member_id'],
+        'member_id': snowflake_str(row['member_id']),
         'name': row['name'],
         'account_created': format_timestamp(row['account_created']),
         'joined_at': format_timestamp(row['joined_at']),
-        'guild_id': row['guild_id']
+        'guild_id': snowflake_str(row['guild_id'])
     } for row in rows]
     
-    has_more = (offset + limit) < total_count
-    
     return jsonify({
         'results': results,
         'total': total_count,
         'has_more': has_more,
+        'next': next_cursor,
         'offset': offset,
         'limit': limit
     })
@@ -1193,20 +2037,7 @@ def search_user():
 def search_user_all():
     q = request.args.get('q', '').strip()
     guild_id = request.args.get('guild_id', '').strip()
-    db = get_db()
-    where = []
-    params = []
-    if q:
-        where.append('name LIKE ?')
-        params.append('%' + q + '%')
-    if guild_id:
-        where.append('guild_id = ?')
-        params.append(guild_id)
-    where_clause = ' AND '.join(where) if where else '1=1'
-    rows = db.execute(
-        f"SELECT member_id, name, account_created, joined_at, guild_id FROM demographics WHERE {where_clause} ORDER BY name",
-        params
-    ).fetchall()
+    ensure_schema()
     def format_timestamp(ts):
         if not ts:
             return ''
@@ -1216,14 +2047,162 @@ def search_user_all():
                 ts = ts.split('+')[0]
             return ts
         return ts
-    results = [{
-        'member_id': row['member_id'],
-        'name': row['name'],
-        'account_created': format_timestamp(row['account_created']),
-        'joined_at': format_timestamp(row['joined_at']),
-        'guild_id': row['guild_id']
-    } for row in rows]
-    return jsonify(results)
+    def to_result(row):
+        return {
+            'member_id': snowflake_str(row['member_id']),
+            'name': row['name'],
+            'account_created': format_timestamp(row['account_created']),
+            'joined_at': format_timestamp(row['joined_at']),
+            'guild_id': snowflake_str(row['guild_id'])
+        }
+    def query(schema):
+        from_clause, params, key, key_params = member_search_sql(q, guild_id, schema=schema)
+        return (f"SELECT d.member_id, d.name, d.account_created, d.joined_at, d.guild_id FROM {from_clause} ORDER BY {', '.join(key)}",
+                params + key_params)
+    # Same JSON array as before, streamed from the cursor instead of built in memory
+    return export_response(query, 'json', row_fn=to_result, guild_id=guild_id, merge_key=member_search_key(q))
+
+# --- Streaming exports ---
+EXPORT_BATCH_ROWS = 1000  # rows fetched, encoded and sent per chunk
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson', 'json': 'application/json'}
+# epoch-ms column rendered as ISO 8601 UTC in exports
+ISO_FROM_MS_SQL = "strftime('%Y-%m-%dT%H:%M:%fZ', {} / 1000.0, 'unixepoch')"
+
+def stream_rows(query, fmt, compress=False, row_fn=row_to_json, guild_id=None, merge_key=None):
+    """
+    Yield a query's rows as CSV, NDJSON or a JSON array, EXPORT_BATCH_ROWS at a time and optionally
+    gzip-compressed (each chunk sync-flushed so bytes go out as they are produced). Reads through its
+    own connection, since the response outlives the request's get_db() connection.
+    query(schema) returns (sql, params) reading from schema's tables (None: unqualified). On a sharded
+    DB without a guild_id it runs once per shard and the cursors are merged on merge_key(row).
+    """
+    conn = connect_db(guild_id or None)
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if compress else None  # wbits 31: gzip container
+    def encode(text):
+        data = text.encode('utf-8')
+        return gz.compress(data) + gz.flush(zlib.Z_SYNC_FLUSH) if gz else data
+    try:
+        schemas = shard_schemas(conn)
+        if schemas:
+            cursors = [conn.execute(*query(schema)) for schema in schemas]
+            cursor = heapq.merge(*cursors, key=merge_key)
+        else:
+            cursors = [conn.execute(*query(None))]
+            cursor = cursors[0]
+        columns = [column[0] for column in cursors[0].description]
+        first = True
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if fmt == 'csv':
+            writer.writerow(columns)
+        elif fmt == 'json':
+            buffer.write('[')
+        while True:
+            rows = list(islice(cursor, EXPORT_BATCH_ROWS))
+            for row in rows:
+                if fmt == 'csv':
+                    writer.writerow(row_fn(row).values())
+                elif fmt == 'ndjson':
+                    buffer.write(json.dumps(row_fn(row)) + '\n')
+                else:
+                    buffer.write(('' if first else ',') + json.dumps(row_fn(row)))
+                first = False
+            if not rows and fmt == 'json':
+                buffer.write(']')
+            text = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if text:
+                yield encode(text)
+            if not rows:
+                break
+        if gz:
+            yield gz.flush()
+    finally:
+        conn.close()
+
+def export_response(query, fmt, filename=None, compress=False, row_fn=row_to_json, guild_id=None, merge_key=None):
+    """Streaming Response for stream_rows; with a filename it downloads as an attachment"""
+    headers = {}
+    if filename:
+        headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}{".gz" if compress else ""}"'
+    mimetype = 'application/gzip' if compress else EXPORT_MIMETYPES[fmt]
+    return Response(stream_rows(query, fmt, compress, row_fn, guild_id, merge_key), mimetype=mimetype, headers=headers)
+
+def export_args():
+    """(format, gzip, start_ms, end_ms) from the export query string; ValueError if one is invalid"""
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        raise ValueError("format must be 'csv' or 'ndjson'")
+    bounds = []
+    for name in ('start', 'end'):
+        value = request.args.get(name, '').strip()
+        try:
+            bounds.append(to_epoch_ms(datetime.fromisoformat(value.replace('Z', '+00:00'))) if value else None)
+        except ValueError:
+            raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+    return fmt, request.args.get('gzip', '') in ('1', 'true'), bounds[0], bounds[1]
+
+@app.route('/api/export/demographics')
+def export_demographics():
+    """Stream members matching q/guild_id, joined within [start, end), as CSV or NDJSON (gzip=1 to compress)"""
+    try:
+        fmt, compress, start_ms, end_ms = export_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    q = request.args.get('q', '').strip()
+    guild_id = request.args.get('guild_id', '').strip()
+    ensure_schema()
+    def query(schema):
+        from_clause, params, key, key_params = member_search_sql(q, guild_id, schema=schema)
+        if start_ms is not None:
+            from_clause += ' AND d.joined_at_ms >= ?'
+            params.append(start_ms)
+        if end_ms is not None:
+            from_clause += ' AND d.joined_at_ms < ?'
+            params.append(end_ms)
+        sql = (
+            "SELECT d.guild_id, d.member_id, d.name, d.account_created, d.joined_at, "
+            f"{ISO_FROM_MS_SQL.format('d.first_seen_ms')} AS first_seen, {ISO_FROM_MS_SQL.format('d.last_seen_ms')} AS last_seen "
+            f"FROM {from_clause} ORDER BY {', '.join(key)}"
+        )
+        return sql, params + key_params
+    return export_response(query, fmt, f"demographics_{guild_id or 'all'}", compress, guild_id=guild_id, merge_key=member_search_key(q))
+
+@app.route('/api/export/snapshots')
+def export_snapshots():
+    """Stream snapshots for guild_id (or all servers) taken within [start, end) as CSV or NDJSON (gzip=1 to compress)"""
+    try:
+        fmt, compress, start_ms, end_ms = export_args()
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    guild_id = request.args.get('guild_id', '').strip()
+    ensure_schema()
+    where = []
+    params = []
+    if guild_id:
+        where.append('guild_id = ?')
+        params.append(guild_id)
+    if start_ms is not None:
+        where.append('timestamp_ms >= ?')
+        params.append(start_ms)
+    if end_ms is not None:
+        where.append('timestamp_ms < ?')
+        params.append(end_ms)
+    where_clause = ' AND '.join(where) if where else '1=1'
+    columns = (
+        "guild_id, guild_name, timestamp, member_count, channel_count, text_channels, voice_channels, "
+        "categories, role_count, bots, boosters, is_auto, rollup_level, member_count_min, member_count_max, sample_count, valid_to_ms"
+    )
+    # Each schema's live table plus only the monthly partitions overlapping [start, end)
+    db = get_db(guild_id)
+    tables = {schema: snapshot_tables(db, schema or 'main', start_ms, end_ms) for schema in shard_schemas(db) or [None]}
+    def query(schema):
+        union = ' UNION ALL '.join(f"SELECT {columns}, timestamp_ms FROM {table} WHERE {where_clause}" for table in tables[schema])
+        return f"SELECT {columns} FROM ({union}) ORDER BY guild_id, timestamp_ms", params * len(tables[schema])
+    # Each guild lives in exactly one shard, so merging on guild_id keeps every guild's rows in order
+    return export_response(query, fmt, f"snapshots_{guild_id or 'all'}", compress, guild_id=guild_id,
+                           merge_key=lambda row: row['guild_id'])
 
 @app.route('/config')
 def config_page():
@@ -1356,6 +2335,11 @@ def config_page():
                 border-radius: 4px;
                 width: 80px;
             }
+            .retention-preview {
+                font-size: 0.8em;
+                color: #888;
+                margin-top: 4px;
+            }
             .notification {
                 position: fixed;
                 top: 20px;
@@ -1582,9 +2566,11 @@ def config_page():
                                 onchange="updateConfig('${config.guild_id}', 'auto_snapshot_interval_hours', this.value)">
                         </td>
                         <td>
-                            <input type="number" class="number-input" value="${config.snapshot_retention_days || 90}" 
-                                min="1" max="365" 
+                            <input type="number" class="number-input" value="${config.snapshot_retention_days ?? 90}" 
+                                min="0" max="365" title="0 keeps snapshots forever" 
+                                oninput="previewRetention('${config.guild_id}', this.value)"
                                 onchange="updateConfig('${config.guild_id}', 'snapshot_retention_days', this.value)">
+                            <div class="retention-preview"></div>
                         </td>
                         <td>${formatTimestamp(config.first_snapshot_date)}</td>
                         <td>${formatTimeSince(config.last_auto_snapshot)}</td>
@@ -1595,6 +2581,28 @@ def config_page():
                         </td>
                     </tr>
                 `).join('');
+                configs.forEach(config => previewRetention(config.guild_id, config.snapshot_retention_days ?? 90));
+            }
+            
+            const retentionPreviewTimers = {};
+            function previewRetention(guildId, days) {
+                clearTimeout(retentionPreviewTimers[guildId]);
+                retentionPreviewTimers[guildId] = setTimeout(async () => {
+                    const el = document.querySelector(`tr[data-guild-id="${guildId}"] .retention-preview`);
+                    if (!el) return;
+                    try {
+                        const res = await fetch(`/api/retention_preview/${guildId}?days=${encodeURIComponent(days)}`);
+                        const data = await res.json();
+                        if (!res.ok) throw new Error(data.error || `HTTP ${res.status}`);
+                        el.textContent = data.days === 0
+                            ? 'kept forever'
+                            : data.rows_removed
+                            ? `prunes ${data.rows_removed.toLocaleString()} of ${data.rows_total.toLocaleString()} snapshots`
+                            : 'nothing to prune';
+                    } catch (e) {
+                        el.textContent = '';
+                    }
+                }, 300);
             }
             
             async function updateConfig(guildId, field, value) {
@@ -1633,7 +2641,7 @@ def config_page():
                     } else if (field === 'auto_snapshot_interval_hours') {
                         fieldName = `Snapshot interval set to ${value} hours`;
                     } else if (field === 'snapshot_retention_days') {
-                        fieldName = `Retention set to ${value} days`;
+                        fieldName = Number(value) === 0 ? 'Retention disabled, snapshots kept forever' : `Retention set to ${value} days`;
                     }
                     
                     showNotification(fieldName);
@@ -1842,15 +2850,15 @@ def debug_configs():
         all_configs = db.execute('SELECT * FROM server_config').fetchall()
         
         # Check snapshots table for guild names
-        snapshots = db.execute('SELECT guild_id, guild_name, timestamp FROM snapshots ORDER BY guild_id, timestamp DESC').fetchall()
+        snapshots = db.execute('SELECT guild_id, guild_name, timestamp FROM snapshots ORDER BY guild_id, timestamp_ms DESC').fetchall()
         
         # Check which servers have configs but no first_snapshot_date
         configs_without_date = db.execute('SELECT guild_id FROM server_config WHERE first_snapshot_date IS NULL').fetchall()
         
         return jsonify({
-            'all_configs': [dict(row) for row in all_configs],
-            'snapshots': [dict(row) for row in snapshots],
-            'configs_without_date': [row['guild_id'] for row in configs_without_date],
+            'all_configs': [row_to_json(row) for row in all_configs],
+            'snapshots': [row_to_json(row) for row in snapshots],
+            'configs_without_date': [snowflake_str(row['guild_id']) for row in configs_without_date],
             'total_configs': len(all_configs),
             'total_snapshots': len(snapshots)
         })
@@ -2126,21 +3134,23 @@ def trigger_fetch_members(guild_id):
 
 @app.route('/api/server/<guild_id>/stats')
 def server_stats(guild_id):
-    db = get_db()
+    db = get_db(guild_id)
     import datetime
-    # Get all snapshots for this server
-    rows = db.execute('SELECT timestamp, member_count, boosters FROM snapshots WHERE guild_id=? ORDER BY timestamp', (guild_id,)).fetchall()
+    # Get all snapshots for this server, archived and live
+    rows = snapshot_history(db, guild_id)
     if not rows:
         return jsonify({})
     member_counts = [row['member_count'] for row in rows]
-    booster_counts = [row['boosters'] if 'boosters' in row.keys() else None for row in rows]
+    # Compacted rows keep their bucket's peak, so use it rather than the bucket's last value
+    member_peaks = [row['member_max'] for row in rows]
+    booster_counts = [row['boosters'] for row in rows]
     timestamps = [row['timestamp'] for row in rows]
-    peak = max(member_counts)
-    peak_idx = member_counts.index(peak)
+    peak = max(member_peaks)
+    peak_idx = member_peaks.index(peak)
     peak_date = timestamps[peak_idx][:16].replace('T', ' ')
     current = member_counts[-1]
     current_boosters = booster_counts[-1] if booster_counts[-1] is not None else 0
-    first = member_counts[0]
+    first = rows[0]['member_first']
     last_snapshot = timestamps[-1][:16].replace('T', ' ')
     # Time since last snapshot
     last_dt = datetime.datetime.fromisoformat(timestamps[-1])
@@ -2203,31 +3213,240 @@ def send_webhook_log(message, embed=None):
     except Exception:
         return False
 
+def load_structure(db, guild_id, at_ms=None):
+    """
+    (timestamp_ms, structure) of the channel/role structure the bot recorded for a guild that was in
+    effect at at_ms (default: the latest), or (None, None). structure is {'channels': [...], 'roles': [...]}.
+    """
+    sql = 'SELECT s.timestamp_ms, b.body FROM guild_structures s JOIN structure_blobs b ON b.hash = s.hash WHERE s.guild_id = ?'
+    params = [guild_id]
+    if at_ms is not None:
+        sql += ' AND s.timestamp_ms <= ?'
+        params.append(at_ms)
+    row = db.execute(sql + ' ORDER BY s.timestamp_ms DESC LIMIT 1', params).fetchone()
+    if row is None:
+        return None, None
+    return row[0], json.loads(zlib.decompress(row[1]))
+
+def structure_item_json(item):
+    """A structure channel/role with its snowflake ids as strings"""
+    data = dict(item)
+    for key in ('id', 'category_id'):
+        if key in data:
+            data[key] = snowflake_str(data[key])
+    return data
+
+def diff_structure_items(old, new):
+    """{'added', 'removed', 'changed'} between two lists of channels or roles, matched by id"""
+    old_by_id = {item['id']: item for item in old}
+    new_by_id = {item['id']: item for item in new}
+    changed = []
+    for item_id, item in new_by_id.items():
+        before = old_by_id.get(item_id)
+        if before is None or before == item:
+            continue
+        changed.append({
+            'id': snowflake_str(item_id),
+            'name': item['name'],
+            'changes': {
+                key: {'from': before.get(key), 'to': item.get(key)}
+                for key in sorted(before.keys() | item.keys()) if before.get(key) != item.get(key)
+            },
+        })
+    return {
+        'added': [structure_item_json(item) for item_id, item in new_by_id.items() if item_id not in old_by_id],
+        'removed': [structure_item_json(item) for item_id, item in old_by_id.items() if item_id not in new_by_id],
+        'changed': changed,
+    }
+
+def iso_time_arg(name):
+    """Epoch ms of an ISO 8601 query argument (None if absent); ValueError if it is invalid"""
+    value = request.args.get(name, '').strip()
+    try:
+        return to_epoch_ms(datetime.fromisoformat(value.replace('Z', '+00:00'))) if value else None
+    except ValueError:
+        raise ValueError(f"{name} must be an ISO 8601 date or datetime")
+
 @app.route('/api/server/<guild_id>/channels')
 def server_channels(guild_id):
-    db = get_db()
-    # Try to get the latest snapshot for this server
-    row = db.execute(
-        'SELECT timestamp FROM snapshots WHERE guild_id = ? ORDER BY timestamp DESC LIMIT 1',
-        (guild_id,)
-    ).fetchone()
-    if not row:
+    """
+    Channels ({id, name, type, category_id, position}) of the guild's latest recorded structure, or the
+    one in effect at ?at=; text channels only unless type= names another type or is 'all'
+    """
+    try:
+        at_ms = iso_time_arg('at')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    channel_type = request.args.get('type', 'text')
+    _, structure = load_structure(get_db(), guild_id, at_ms)
+    if structure is None:
         return jsonify([])
-    # Try to load channel info from JSON if it exists
-    import os, json
-    server_dir = os.path.join(os.path.dirname(__file__), 'server_member_tracking', str(guild_id))
-    channels_path = os.path.join(server_dir, 'channels.json')
-    channels = []
-    if os.path.exists(channels_path):
-        try:
-            with open(channels_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                # Expecting a list of {id, name, type}
-                channels = [ch for ch in data if ch.get('type') == 'text']
-        except Exception:
-            pass
-    # If no channels.json, fallback to empty list
-    return jsonify([{'id': ch['id'], 'name': ch['name']} for ch in channels])
+    channels = [ch for ch in structure['channels'] if channel_type == 'all' or ch['type'] == channel_type]
+    channels.sort(key=lambda ch: (ch['position'], ch['id']))
+    return jsonify([
+        {'id': snowflake_str(ch['id']), 'name': ch['name'], 'type': ch['type'],
+         'category_id': snowflake_str(ch['category_id']), 'position': ch['position']}
+        for ch in channels
+    ])
+
+@app.route('/api/server/<guild_id>/structure_diff')
+def server_structure_diff(guild_id):
+    """
+    Channels and roles added, removed and changed between the guild's structure at ?from= and at ?to=
+    (default: the latest structure against the one it replaced), plus when each recorded version started
+    """
+    try:
+        from_ms = iso_time_arg('from')
+        to_ms = iso_time_arg('to')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db()
+    new_ms, new = load_structure(db, guild_id, to_ms)
+    if new is None:
+        return jsonify({'error': 'no structure recorded for this server'}), 404
+    if from_ms is None:
+        # The version before the one in effect at `to`
+        old_ms, old = load_structure(db, guild_id, new_ms - 1)
+    else:
+        old_ms, old = load_structure(db, guild_id, from_ms)
+    old = old or {'channels': [], 'roles': []}
+    versions = db.execute('SELECT timestamp_ms FROM guild_structures WHERE guild_id = ? ORDER BY timestamp_ms', (guild_id,)).fetchall()
+    return jsonify({
+        'from': from_epoch_ms(old_ms),
+        'to': from_epoch_ms(new_ms),
+        'channels': diff_structure_items(old['channels'], new['channels']),
+        'roles': diff_structure_items(old['roles'], new['roles']),
+        'versions': [from_epoch_ms(row[0]) for row in versions],
+    })
+
+ROLE_HISTOGRAM_PAIR = struct.Struct('<qq')  # role_id, members; the bot's encode_role_counts layout
+
+@app.route('/api/server/<guild_id>/roles')
+def server_role_growth(guild_id):
+    """
+    Members per role at each snapshot of the last ?days= days (default: all), for the ?top= (10) roles
+    largest in the latest snapshot. Role names come from the latest recorded structure.
+    """
+    days = request.args.get('days', default=None, type=int)
+    top = request.args.get('top', default=10, type=int)
+    db = get_db(guild_id)
+    sql = 'SELECT timestamp_ms, histogram FROM role_histograms WHERE guild_id = ?'
+    params = [guild_id]
+    if days is not None:
+        sql += ' AND timestamp_ms >= ?'
+        params.append(to_epoch_ms(datetime.now(timezone.utc) - timedelta(days=days)))
+    rows = db.execute(sql + ' ORDER BY timestamp_ms', params).fetchall()
+    histograms = [dict(ROLE_HISTOGRAM_PAIR.iter_unpack(row['histogram'])) for row in rows]
+    if not histograms:
+        return jsonify({'labels': [], 'roles': []})
+    _, structure = load_structure(db, guild_id)
+    names = {role['id']: role['name'] for role in structure['roles']} if structure else {}
+    latest = histograms[-1]
+    role_ids = sorted(latest, key=lambda role_id: -latest[role_id])[:top]
+    return jsonify({
+        'labels': [from_epoch_ms(row['timestamp_ms']) for row in rows],
+        'roles': [{
+            'id': snowflake_str(role_id),
+            'name': names.get(role_id, str(role_id)),
+            'counts': [histogram.get(role_id, 0) for histogram in histograms],
+        } for role_id in role_ids],
+    })
+
+def load_membership(db, guild_id, at_ms=None, before_ms=None):
+    """
+    (timestamp_ms, member_count, bitmap) of the membership set of the guild's member fetch in effect at
+    at_ms (default: the latest), or of the last fetch before before_ms; (None, 0, 0) if there is none.
+    bitmap is an int with bit n set for each member's member_ids.dense_id n.
+    """
+    sql = 'SELECT timestamp_ms, member_count, bitmap FROM membership_sets WHERE guild_id = ?'
+    params = [guild_id]
+    if at_ms is not None:
+        sql += ' AND timestamp_ms <= ?'
+        params.append(at_ms)
+    if before_ms is not None:
+        sql += ' AND timestamp_ms < ?'
+        params.append(before_ms)
+    row = db.execute(sql + ' ORDER BY timestamp_ms DESC LIMIT 1', params).fetchone()
+    if row is None:
+        return None, 0, 0
+    return row[0], row[1], int.from_bytes(zlib.decompress(row[2]), 'little')
+
+def bitmap_member_ids(db, bitmap, limit=None):
+    """Member ids (as strings, ascending by dense id) of up to limit set bits of a membership bitmap"""
+    dense_ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        while byte and (limit is None or len(dense_ids) < limit):
+            low = byte & -byte
+            dense_ids.append(index * 8 + low.bit_length() - 1)
+            byte ^= low
+    member_ids = {}
+    for start in range(0, len(dense_ids), 500):
+        chunk = dense_ids[start:start + 500]
+        member_ids.update(db.execute(
+            f"SELECT dense_id, member_id FROM member_ids WHERE dense_id IN ({', '.join('?' * len(chunk))})", chunk
+        ).fetchall())
+    return [snowflake_str(member_ids[dense_id]) for dense_id in dense_ids if dense_id in member_ids]
+
+@app.route('/api/membership')
+def membership():
+    """Member ids of a guild as of its member fetch in effect at ?at= (default: the latest fetch)"""
+    guild_id = request.args.get('guild_id', '').strip()
+    if not guild_id:
+        return jsonify({'error': 'Missing guild_id'}), 400
+    try:
+        at_ms = iso_time_arg('at')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db(guild_id)
+    fetched_ms, count, bitmap = load_membership(db, guild_id, at_ms)
+    if fetched_ms is None:
+        return jsonify({'error': 'no member fetch recorded for this server at that time'}), 404
+    return jsonify({
+        'guild_id': guild_id,
+        'fetched_at': from_epoch_ms(fetched_ms),
+        'count': count,
+        'member_ids': bitmap_member_ids(db, bitmap),
+    })
+
+@app.route('/api/membership/compare')
+def membership_compare():
+    """
+    Intersection and differences of two membership sets: guild_id at ?at= (a) and other_guild_id (default:
+    the same guild) at ?other_at= (b), each the member fetch in effect then (default: the latest). For a
+    single guild with no at, a is the fetch before b. Counts are exact; id lists stop at ?limit= (1000).
+    """
+    guild_id = request.args.get('guild_id', '').strip()
+    if not guild_id:
+        return jsonify({'error': 'Missing guild_id'}), 400
+    other_guild_id = request.args.get('other_guild_id', '').strip() or guild_id
+    limit = request.args.get('limit', default=1000, type=int)
+    try:
+        at_ms = iso_time_arg('at')
+        other_at_ms = iso_time_arg('other_at')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    db = get_db(guild_id if other_guild_id == guild_id else None)
+    b_ms, b_count, b = load_membership(db, other_guild_id, other_at_ms)
+    if other_guild_id == guild_id and at_ms is None and b_ms is not None:
+        a_ms, a_count, a = load_membership(db, guild_id, before_ms=b_ms)
+    else:
+        a_ms, a_count, a = load_membership(db, guild_id, at_ms)
+    if a_ms is None or b_ms is None:
+        return jsonify({'error': 'no member fetch recorded for one of the servers at that time'}), 404
+    shared, only_a, only_b = a & b, a & ~b, b & ~a
+    union = (a | b).bit_count()
+    return jsonify({
+        'a': {'guild_id': guild_id, 'fetched_at': from_epoch_ms(a_ms), 'count': a_count},
+        'b': {'guild_id': other_guild_id, 'fetched_at': from_epoch_ms(b_ms), 'count': b_count},
+        'shared': shared.bit_count(),
+        'only_a': only_a.bit_count(),
+        'only_b': only_b.bit_count(),
+        'jaccard': shared.bit_count() / union if union else None,
+        'shared_ids': bitmap_member_ids(db, shared, limit),
+        'only_a_ids': bitmap_member_ids(db, only_a, limit),
+        'only_b_ids': bitmap_member_ids(db, only_b, limit),
+    })
 
 @app.route('/api/24hr_stats')
 def stats_24hr():
@@ -2235,18 +3454,38 @@ def stats_24hr():
     import datetime
     now = datetime.datetime.now(datetime.timezone.utc)
     day_ago = now - datetime.timedelta(hours=24)
-    # Snapshots in last 24h
-    snap_24h = db.execute("SELECT COUNT(*) as count FROM snapshots WHERE timestamp >= ?", (day_ago.isoformat(),)).fetchone()[0]
-    snap_total = db.execute("SELECT COUNT(*) as count FROM snapshots").fetchone()[0]
-    snap_24h_ago = db.execute("SELECT COUNT(*) as count FROM snapshots WHERE timestamp < ?", (day_ago.isoformat(),)).fetchone()[0]
+    day_ago_ms = to_epoch_ms(day_ago)
+    # Snapshots in last 24h (a run or rollup row stands for sample_count snapshots; older archive segments only know their rows)
+    snap_24h = sum(
+        db.execute(f"SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM {table} WHERE timestamp_ms >= ?", (day_ago_ms,)).fetchone()[0]
+        for table in all_snapshot_tables(db, day_ago_ms)
+    )
+    snap_archived = db.execute("SELECT COALESCE(SUM(COALESCE(sample_count, row_count)), 0) FROM snapshot_archive").fetchone()[0]
+    snap_total = db.execute("SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM snapshots").fetchone()[0] + snap_archived
+    snap_24h_ago = db.execute("SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM snapshots WHERE timestamp_ms < ?", (day_ago_ms,)).fetchone()[0] + snap_archived
+    # A run that started before the cut and runs past it (at most each guild's last row before the cut)
+    # took only its earlier samples before it
+    straddling = [
+        row for table in all_snapshot_tables(db, end_ms=day_ago_ms)
+        for row in db.execute(
+            f'SELECT timestamp_ms, valid_to_ms, COALESCE(sample_count, 1) FROM {table} WHERE valid_to_ms >= ? AND id IN '
+            f'(SELECT (SELECT id FROM {table} WHERE guild_id = guilds.guild_id AND timestamp_ms < ? ORDER BY timestamp_ms DESC LIMIT 1) FROM guilds)',
+            (day_ago_ms, day_ago_ms)
+        )
+    ]
+    snap_run_24h = sum(samples - run_samples_before(start, end, samples, day_ago_ms) for start, end, samples in straddling)
+    snap_24h += snap_run_24h
+    snap_24h_ago -= snap_run_24h
     # Tracked servers (with at least one snapshot)
-    servers_total = db.execute("SELECT COUNT(DISTINCT guild_id) as count FROM snapshots").fetchone()[0]
-    servers_24h = db.execute("SELECT COUNT(DISTINCT guild_id) as count FROM snapshots WHERE timestamp >= ?", (day_ago.isoformat(),)).fetchone()[0]
-    servers_24h_ago = db.execute("SELECT COUNT(DISTINCT guild_id) as count FROM snapshots WHERE timestamp < ?", (day_ago.isoformat(),)).fetchone()[0]
+    servers_total = db.execute("SELECT COUNT(*) as count FROM guilds").fetchone()[0]
+    servers_24h = db.execute("SELECT COUNT(*) as count FROM guilds WHERE last_snapshot_ms >= ?", (day_ago_ms,)).fetchone()[0]
+    servers_24h_ago = db.execute("SELECT COUNT(*) as count FROM guilds WHERE first_snapshot_ms < ?", (day_ago_ms,)).fetchone()[0]
     # Total memberships (all entries in demographics)
     memberships_total = db.execute("SELECT COUNT(*) as count FROM demographics").fetchone()[0]
-    memberships_24h = db.execute("SELECT COUNT(*) as count FROM demographics WHERE joined_at >= ? OR account_created >= ?", (day_ago.isoformat(), day_ago.isoformat())).fetchone()[0]
-    memberships_24h_ago = db.execute("SELECT COUNT(*) as count FROM demographics WHERE (joined_at < ? OR (account_created < ? AND (joined_at IS NULL OR joined_at = '')))", (day_ago.isoformat(), day_ago.isoformat())).fetchone()[0]
+    # Account creation is compared as a member_id range (see snowflake_floor)
+    created_floor = snowflake_floor(day_ago_ms)
+    memberships_24h = db.execute("SELECT COUNT(*) as count FROM demographics WHERE joined_at_ms >= ? OR member_id >= ?", (day_ago_ms, created_floor)).fetchone()[0]
+    memberships_24h_ago = db.execute("SELECT COUNT(*) as count FROM demographics WHERE (joined_at_ms < ? OR (member_id < ? AND joined_at_ms IS NULL))", (day_ago_ms, created_floor)).fetchone()[0]
     return jsonify({
         'snapshots': {
             'total': snap_total,
@@ -2507,6 +3746,21 @@ def dashboard():
                     <canvas id="membersOverTimeChart"></canvas>
                 </div>
             </div>
+            <div class="dashboard-row" id="roleGrowthSection" style="margin-top:0;display:none;">
+                <div class="full-width-chart">
+                    <div style="margin-bottom: 10px;">
+                        <label for="roleDaysSelect" style="color:#90caf9;">Show last</label>
+                        <select id="roleDaysSelect">
+                            <option value="7">7 days</option>
+                            <option value="30" selected>30 days</option>
+                            <option value="90">90 days</option>
+                            <option value="all">All</option>
+                        </select>
+                    </div>
+                    <div class="chart-title">Role Growth (Top 10 Roles)</div>
+                    <canvas id="roleGrowthChart"></canvas>
+                </div>
+            </div>
             <div id="demographicsSection" style="display:none; margin-top:32px;">
                 <div class="demographics-collapsible" style="background:#23272a;color:#e0e0e0;border-radius:8px;padding:20px 28px;margin-bottom:18px;box-shadow:0 2px 8px #000a;">
                     <div style="cursor:pointer;font-weight:bold;font-size:1.1em;color:#90caf9;" onclick="toggleDemographics()">
@@ -2688,6 +3942,54 @@ def dashboard():
             // Initial load
             loadMembersOverTimeChart(7);
 
+            let roleGrowthChartInstance = null;
+            const ROLE_COLORS = ['#90caf9', '#f48fb1', '#a5d6a7', '#ffcc80', '#ce93d8', '#80deea', '#ef9a9a', '#e6ee9c', '#b0bec5', '#ffab91'];
+            async function loadRoleGrowthChart(days = 30) {
+                if (!selectedGuildId) return;
+                document.getElementById('roleGrowthSection').style.display = '';
+                let url = `/api/server/${selectedGuildId}/roles`;
+                if (days !== 'all') url += `?days=${days}`;
+                const res = await fetch(url);
+                const data = await res.json();
+                const ctx = document.getElementById('roleGrowthChart').getContext('2d');
+                if (roleGrowthChartInstance) roleGrowthChartInstance.destroy();
+                if (!data.labels || data.labels.length === 0) {
+                    ctx.clearRect(0, 0, ctx.canvas.width, ctx.canvas.height);
+                    ctx.font = '16px Segoe UI, Arial, sans-serif';
+                    ctx.fillStyle = '#90caf9';
+                    ctx.fillText('No role data yet: role counts are recorded with each new snapshot.', 20, 40);
+                    return;
+                }
+                roleGrowthChartInstance = new Chart(ctx, {
+                    type: 'line',
+                    data: {
+                        labels: data.labels.map(label => label.slice(0, 16).replace('T', ' ')),
+                        datasets: data.roles.map((role, i) => ({
+                            label: role.name,
+                            data: role.counts,
+                            borderColor: ROLE_COLORS[i % ROLE_COLORS.length],
+                            backgroundColor: 'transparent',
+                            fill: false,
+                            tension: 0.3
+                        }))
+                    },
+                    options: {
+                        plugins: { legend: { display: true, labels: { color: '#e0e0e0' } }, tooltip: { enabled: true } },
+                        responsive: true,
+                        maintainAspectRatio: false,
+                        scales: {
+                            x: { title: { display: true, text: 'Snapshot', color: '#90caf9' }, ticks: { color: '#e0e0e0' }, grid: { color: '#333' } },
+                            y: { title: { display: true, text: 'Members', color: '#90caf9' }, ticks: { color: '#e0e0e0' }, grid: { color: '#333' }, beginAtZero: true }
+                        },
+                        interaction: { mode: 'nearest', intersect: false },
+                        hover: { mode: 'nearest', intersect: false }
+                    }
+                });
+            }
+            document.getElementById('roleDaysSelect').addEventListener('change', function() {
+                loadRoleGrowthChart(this.value === 'all' ? 'all' : parseInt(this.value, 10));
+            });
+
             function toggleDemographics() {
                 const content = document.getElementById('demographicsContent');
                 const icon = document.getElementById('demoCollapseIcon');
@@ -2764,6 +4066,7 @@ def dashboard():
             if (selectedGuildId) {
                 loadDemographics();
                 loadSnapshotLog();
+                loadRoleGrowthChart(30);
             }
             // Adjust member chart height to match snapshots taken chart
             document.addEventListener('DOMContentLoaded', function() {
@@ -2878,76 +4181,83 @@ def user_history():
         return jsonify({'error': 'Missing member_id'}), 400
     db = get_db()
     # Get all demographics rows for this member
-    rows = db.execute('SELECT * FROM demographics WHERE member_id = ? ORDER BY joined_at', (member_id,)).fetchall()
+    rows = db.execute('SELECT * FROM demographics WHERE member_id = ? ORDER BY joined_at_ms', (member_id,)).fetchall()
     # Get all snapshots this member was present in (if you track this)
-    # For now, just return demographics rows
-    return jsonify([dict(row) for row in rows])
+    # For now, just return demographics rows; the name timeline is in /api/member/<member_id>
+    return jsonify([row_to_json(row) for row in rows])
+
+@app.route('/api/member/<member_id>')
+def member_profile(member_id):
+    """
+    One member across every tracked guild: account creation (from the snowflake), current name, name
+    history and, per guild, join date, first/last seen and when they left (null while present).
+    One idx_demographics_member_profile range scan (a few rows per member) plus a rowid lookup per guild
+    for the seen/left columns and primary-key lookups, so it is cheap enough for hover previews.
+    """
+    try:
+        member_id = int(member_id)
+    except ValueError:
+        return jsonify({'error': 'member_id must be a snowflake'}), 400
+    db = get_db()
+    rows = db.execute(
+        'SELECT d.guild_id, g.name AS guild_name, d.joined_at_ms, d.first_seen_ms, d.last_seen_ms, d.left_ms '
+        'FROM demographics d LEFT JOIN guilds g ON g.guild_id = d.guild_id WHERE d.member_id = ? ORDER BY d.joined_at_ms',
+        (member_id,)
+    ).fetchall()
+    names = db.execute('SELECT since_ms, name FROM member_names WHERE member_id = ? ORDER BY since_ms', (member_id,)).fetchall()
+    if not rows and not names:
+        return jsonify({'error': 'member not found'}), 404
+    return jsonify({
+        'member_id': snowflake_str(member_id),
+        'account_created': from_epoch_ms((member_id >> 22) + DISCORD_EPOCH_MS),
+        'name': names[-1]['name'] if names else None,
+        'names': [{'since': from_epoch_ms(row['since_ms']), 'name': row['name']} for row in names],
+        'guilds': [{
+            'guild_id': snowflake_str(row['guild_id']),
+            'guild_name': row['guild_name'],
+            'joined_at': from_epoch_ms(row['joined_at_ms']),
+            'first_seen': from_epoch_ms(row['first_seen_ms']),
+            'last_seen': from_epoch_ms(row['last_seen_ms']),
+            'left_at': from_epoch_ms(row['left_ms']),
+        } for row in rows],
+    })
 
 @app.route('/api/server_configs')
 def get_server_configs():
     try:
         db = get_db()
-        # Ensure all servers with snapshots have config entries
-        servers_with_snapshots = db.execute('''
-            SELECT DISTINCT guild_id, guild_name 
-            FROM snapshots 
-            WHERE guild_name IS NOT NULL
-        ''').fetchall()
-        for server in servers_with_snapshots:
-            existing = db.execute('SELECT guild_id FROM server_config WHERE guild_id = ?', (server['guild_id'],)).fetchone()
-            if not existing:
-                db.execute('''
-                    INSERT INTO server_config (guild_id, auto_snapshot, last_auto_snapshot, 
-                                            first_snapshot_date, chart_style, snapshot_retention_days, 
-                                            auto_snapshot_interval_hours)
-                    VALUES (?, 0, NULL, NULL, 'emoji', 90, 20)
-                ''', (server['guild_id'],))
-        # Get first snapshot date for each server
-        first_snapshots = db.execute('''
-            SELECT guild_id, MIN(timestamp) as first_snapshot
-            FROM snapshots 
-            GROUP BY guild_id
-        ''').fetchall()
-        for snapshot in first_snapshots:
-            db.execute('''
-                UPDATE server_config 
-                SET first_snapshot_date = ? 
-                WHERE guild_id = ? AND first_snapshot_date IS NULL
-            ''', (snapshot['first_snapshot'], snapshot['guild_id']))
+        # Ensure all servers with snapshots have config entries, seeded with their first snapshot date
+        db.execute('''
+            INSERT OR IGNORE INTO server_config (guild_id, auto_snapshot, last_auto_snapshot, 
+                                                 first_snapshot_date, chart_style, snapshot_retention_days, 
+                                                 auto_snapshot_interval_hours)
+            SELECT guild_id, 0, NULL, first_snapshot, 'emoji', 90, 20 FROM guilds
+        ''')
+        db.execute('''
+            UPDATE server_config 
+            SET first_snapshot_date = (SELECT first_snapshot FROM guilds WHERE guilds.guild_id = server_config.guild_id) 
+            WHERE first_snapshot_date IS NULL
+        ''')
         db.commit()
-        # Now get all configs with first_snapshot_date
+        # Now get all configs with first_snapshot_date, plus name and latest snapshot from guilds
         configs = db.execute('''
-            SELECT guild_id, auto_snapshot, last_auto_snapshot, 
-                first_snapshot_date, snapshot_retention_days, 
-                auto_snapshot_interval_hours
-            FROM server_config 
-            WHERE first_snapshot_date IS NOT NULL
-            ORDER BY guild_id
+            SELECT sc.guild_id, sc.auto_snapshot, sc.last_auto_snapshot, 
+                sc.first_snapshot_date, sc.snapshot_retention_days, 
+                sc.auto_snapshot_interval_hours, g.name, g.last_snapshot
+            FROM server_config sc
+            LEFT JOIN guilds g ON g.guild_id = sc.guild_id
+            WHERE sc.first_snapshot_date IS NOT NULL
+            ORDER BY sc.guild_id
         ''').fetchall()
         
-        # Get the most recent snapshot for each server
-        latest_snapshots = db.execute('''
-            SELECT guild_id, MAX(timestamp) as last_snapshot
-            FROM snapshots 
-            GROUP BY guild_id
-        ''').fetchall()
-        
-        # Create a lookup for latest snapshots
-        latest_snapshot_lookup = {row['guild_id']: row['last_snapshot'] for row in latest_snapshots}
-        
-        # Get server names
-        server_names = {}
-        for row in db.execute('SELECT guild_id, guild_name FROM snapshots WHERE guild_name IS NOT NULL GROUP BY guild_id').fetchall():
-            server_names[row['guild_id']] = row['guild_name']
-        
         result = []
         for row in configs:
             result.append({
-                'guild_id': row['guild_id'],
-                'guild_name': server_names.get(row['guild_id'], f"Server {row['guild_id']}"),
+                'guild_id': snowflake_str(row['guild_id']),
+                'guild_name': row['name'] or f"Server {row['guild_id']}",
                 'auto_snapshot': bool(row['auto_snapshot']),
                 'last_auto_snapshot': row['last_auto_snapshot'],
-                'last_snapshot': latest_snapshot_lookup.get(row['guild_id']),
+                'last_snapshot': row['last_snapshot'],
                 'first_snapshot_date': row['first_snapshot_date'],
                 'snapshot_retention_days': row['snapshot_retention_days'],
                 'auto_snapshot_interval_hours': row['auto_snapshot_interval_hours']
@@ -2957,6 +4267,43 @@ def get_server_configs():
         print(f"Error in get_server_configs: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/retention_preview/<guild_id>')
+def retention_preview(guild_id):
+    """
+    How many snapshots the retention worker would prune for a server at ?days= (default: its current setting).
+    A run or rollup row counts its samples, and a run is only pruned once it ends before the cutoff;
+    archive segments count whole, as the worker drops them once their last run ends before the cutoff.
+    """
+    db = get_db(guild_id)
+    days = request.args.get('days', type=int)
+    if days is None:
+        row = db.execute('SELECT snapshot_retention_days FROM server_config WHERE guild_id = ?', (guild_id,)).fetchone()
+        days = row['snapshot_retention_days'] if row and row['snapshot_retention_days'] is not None else DEFAULT_RETENTION_DAYS
+    if days < 0:
+        return jsonify({'error': 'days must not be negative'}), 400
+    archive_sql = 'SELECT COALESCE(SUM(COALESCE(sample_count, row_count)), 0) FROM snapshot_archive WHERE guild_id = ?'
+    rows_total = (
+        db.execute('SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM snapshots WHERE guild_id = ?', (guild_id,)).fetchone()[0]
+        + db.execute(archive_sql, (guild_id,)).fetchone()[0]
+    )
+    if days == 0:
+        # 0 keeps snapshots forever
+        return jsonify({'guild_id': str(guild_id), 'days': 0, 'cutoff': None, 'rows_total': rows_total, 'rows_removed': 0})
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    cutoff_ms = to_epoch_ms(cutoff)
+    rows_removed = db.execute(
+        'SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM snapshots '
+        'WHERE guild_id = ? AND timestamp_ms < ? AND COALESCE(valid_to_ms, timestamp_ms) < ?',
+        (guild_id, cutoff_ms, cutoff_ms)
+    ).fetchone()[0] + db.execute(archive_sql + ' AND last_ms < ?', (guild_id, cutoff_ms)).fetchone()[0]
+    return jsonify({
+        'guild_id': str(guild_id),
+        'days': days,
+        'cutoff': cutoff.isoformat(),
+        'rows_total': rows_total,
+        'rows_removed': rows_removed,
+    })
+
 @app.route('/api/update_config', methods=['POST'])
 def update_server_config():
     """Update server configuration settings"""
@@ -2986,7 +4333,8 @@ def update_server_config():
         elif field in ['auto_snapshot_interval_hours', 'snapshot_retention_days']:
             try:
                 value = int(value)
-                if value <= 0:
+                # A retention of 0 keeps snapshots forever
+                if value < 0 or (value == 0 and field != 'snapshot_retention_days'):
                     return jsonify({'error': f'{field} must be positive'}), 400
             except (ValueError, TypeError):
                 return jsonify({'error': f'{field} must be a number'}), 400
@@ -3233,7 +4581,7 @@ def snapshot_all():
         api_url = os.environ.get('NIGHTY_API_BASE_URL', 'http://127.0.0.1:5500') + '/take_snapshot'
         servers = db.execute('SELECT DISTINCT guild_id FROM server_config').fetchall()
         if not servers:
-            servers = db.execute('SELECT DISTINCT guild_id FROM snapshots').fetchall()
+            servers = db.execute('SELECT guild_id FROM guilds').fetchall()
         count = 0
         errors = []
         failed_servers = []
@@ -3284,23 +4632,22 @@ def tracked_members_over_time():
         date_list = [(today - datetime.timedelta(days=i)).isoformat() for i in range(days-1, -1, -1)]
     else:
         # Use all days from earliest to today
-        rows = db.execute("SELECT timestamp FROM demographics").fetchall()
-        timestamps = [row['timestamp'][:10] for row in rows if row['timestamp'] and len(row['timestamp']) >= 10]
-        if timestamps:
-            first_day = min(timestamps)
+        first_ms = db.execute("SELECT MIN(first_seen_ms) FROM demographics").fetchone()[0]
+        if first_ms is not None:
+            d = datetime.datetime.fromtimestamp(first_ms / 1000, datetime.timezone.utc).date()
         else:
-            first_day = today.isoformat()
-        d = datetime.date.fromisoformat(first_day)
+            d = today
         date_list = []
         while d <= today:
             date_list.append(d.isoformat())
             d += datetime.timedelta(days=1)
 
-    # For each day, count users with timestamp <= that day
+    # For each day, count users first seen before the end of that day (UTC)
     result_counts = []
     for d in date_list:
+        day_end = datetime.datetime.combine(datetime.date.fromisoformat(d) + datetime.timedelta(days=1), datetime.time(), datetime.timezone.utc)
         count = db.execute(
-            "SELECT COUNT(*) FROM demographics WHERE substr(timestamp, 1, 10) <= ?", (d,)
+            "SELECT COUNT(*) FROM demographics WHERE first_seen_ms < ?", (to_epoch_ms(day_end),)
         ).fetchone()[0]
         result_counts.append(count)
 
@@ -3317,7 +4664,7 @@ def fetch_all_members():
         api_url = os.environ.get('NIGHTY_API_BASE_URL', 'http://127.0.0.1:5500') + '/fetch_members'
         servers = db.execute('SELECT DISTINCT guild_id FROM server_config').fetchall()
         if not servers:
-            servers = db.execute('SELECT DISTINCT guild_id FROM snapshots').fetchall()
+            servers = db.execute('SELECT guild_id FROM guilds').fetchall()
         count = 0
         errors = []
         failed_servers = []
@@ -3410,16 +4757,28 @@ def tracked_members_over_time_hourly():
     # List of 24 datetimes, one for each hour (on the hour)
     hours = [(now - datetime.timedelta(hours=i)).replace(minute=0, second=0, microsecond=0) for i in range(23, -1, -1)]
     hour_labels = [h.strftime('%Y-%m-%d %H:00') for h in hours]
+    first_ms, last_ms = to_epoch_ms(hours[0]), to_epoch_ms(hours[-1])
+    # A run row's snapshots are spread over [timestamp_ms, valid_to_ms] as expand_runs spreads them, so
+    # only rows reaching the newest row to start by the first hour (an index seek per shard and
+    # partition) can hold an hour's latest snapshot
+    rows = []
+    for table in all_snapshot_tables(db, end_ms=last_ms + 1):
+        start = db.execute(
+            f"SELECT timestamp_ms FROM {table} WHERE timestamp_ms <= ? ORDER BY timestamp_ms DESC LIMIT 1", (first_ms,)
+        ).fetchone()
+        rows += db.execute(
+            f"SELECT timestamp_ms, COALESCE(valid_to_ms, timestamp_ms), COALESCE(sample_count, 1), member_count FROM {table} "
+            "WHERE timestamp_ms <= ? AND COALESCE(valid_to_ms, timestamp_ms) >= ?",
+            (last_ms, start[0] if start else first_ms)
+        ).fetchall()
     counts = []
     prev_count = 0
     for h in hours:
-        # Find the latest snapshot at or before this hour
-        row = db.execute(
-            "SELECT member_count FROM snapshots WHERE timestamp <= ? ORDER BY timestamp DESC LIMIT 1",
-            (h.isoformat(),)
-        ).fetchone()
-        if row is not None:
-            prev_count = row[0]
+        # The latest snapshot at or before this hour, runs included
+        hour_ms = to_epoch_ms(h)
+        in_effect = [row for row in rows if row[0] <= hour_ms]
+        if in_effect:
+            prev_count = max(in_effect, key=lambda row: last_run_sample_ms(row[0], row[1], row[2], hour_ms))[3]
         counts.append(prev_count)
     return jsonify({'hours': hour_labels, 'counts': counts})
 
@@ -0,0 +1,152 @@
+"""
+Query-plan report for the dashboard and bot hot queries.
+
+Builds a synthetic analytics DB, then prints EXPLAIN QUERY PLAN output and
+timings for each hot query before and after the SCHEMA_INDEXES from
+analytics_dashboard.py are created. With --compare-keys it also builds a
+second DB with the pre-v4 TEXT snowflake keys and compares file size and
+demographics lookup timings against INTEGER keys.
+
+Usage:
+    python benchmarks/query_plans.py [--guilds 200] [--snapshots 5000] [--members 2000] [--compare-keys]
+"""
+import argparse
+import ast
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DASHBOARD_PATH = os.path.join(ROOT, "analytics_dashboard.py")
+
+
+def load_schema_indexes():
+    """Read SCHEMA_INDEXES from the dashboard source without importing Flask"""
+    with open(DASHBOARD_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(getattr(t, "id", None) == "SCHEMA_INDEXES" for t in node.targets):
+            return ast.literal_eval(node.value)
+    raise RuntimeError("SCHEMA_INDEXES not found in analytics_dashboard.py")
+
+
+def epoch_ms(dt):
+    return int(dt.timestamp() * 1000)
+
+
+def build_db(path, guilds, snapshots_per_guild, members_per_guild, key_type="INTEGER"):
+    conn = sqlite3.connect(path)
+    c = conn.cursor()
+    key = int if key_type == "INTEGER" else str
+    c.execute(f"""CREATE TABLE snapshots (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, guild_id {key_type}, guild_name TEXT, timestamp TEXT, timestamp_ms INTEGER,
+        member_count INTEGER, channel_count INTEGER, text_channels INTEGER, voice_channels INTEGER,
+        categories INTEGER, role_count INTEGER, bots INTEGER, boosters INTEGER, is_auto INTEGER)""")
+    c.execute(f"""CREATE TABLE demographics (
+        guild_id {key_type}, member_id {key_type}, name TEXT, account_created TEXT, joined_at TEXT, timestamp TEXT,
+        account_created_ms INTEGER, joined_at_ms INTEGER, timestamp_ms INTEGER,
+        PRIMARY KEY (guild_id, member_id))""")
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    rng = random.Random(1234)
+    for g in range(guilds):
+        guild_id = key(100000000000000000 + g)
+        rows = []
+        for i in range(snapshots_per_guild):
+            ts = start + timedelta(minutes=rng.randint(0, 365 * 24 * 60))
+            rows.append((guild_id, f"guild {g}", ts.isoformat(), epoch_ms(ts), 1000 + i, 50, 40, 8, 2, 30, 5, 3, 1))
+        c.executemany("INSERT INTO snapshots (guild_id, guild_name, timestamp, timestamp_ms, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?)", rows)
+        rows = []
+        for m in range(members_per_guild):
+            created = start - timedelta(days=rng.randint(0, 3000))
+            joined = start + timedelta(days=rng.randint(0, 365))
+            rows.append((guild_id, key(rng.randint(10 ** 17, 10 ** 18)), f"user{m}", created.isoformat(), joined.isoformat(), joined.isoformat(),
+                         epoch_ms(created), epoch_ms(joined), epoch_ms(joined)))
+        c.executemany("INSERT OR IGNORE INTO demographics VALUES (?,?,?,?,?,?,?,?,?)", rows)
+    conn.commit()
+    return conn
+
+
+def hot_queries(guild_id, day_ago_ms, member_id):
+    return [
+        ("server_snapshots", "SELECT timestamp, member_count FROM snapshots WHERE guild_id=? ORDER BY timestamp_ms", (guild_id,)),
+        ("server_stats", "SELECT timestamp, member_count, boosters FROM snapshots WHERE guild_id=? ORDER BY timestamp_ms", (guild_id,)),
+        ("total_snapshots", "SELECT COUNT(*) FROM snapshots WHERE guild_id = ?", (guild_id,)),
+        ("members (bot)", "SELECT timestamp, member_count FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms DESC LIMIT 7", (guild_id,)),
+        ("24hr_stats snapshots", "SELECT COUNT(*) FROM snapshots WHERE timestamp_ms >= ?", (day_ago_ms,)),
+        ("hourly latest", "SELECT member_count FROM snapshots WHERE timestamp_ms <= ? ORDER BY timestamp_ms DESC LIMIT 1", (day_ago_ms,)),
+        ("tracked members/day", "SELECT COUNT(*) FROM demographics WHERE timestamp_ms < ?", (day_ago_ms,)),
+        ("user_history", "SELECT * FROM demographics WHERE member_id = ? ORDER BY joined_at_ms", (member_id,)),
+        ("newest joins", "SELECT name FROM demographics WHERE guild_id = ? ORDER BY joined_at_ms DESC LIMIT 3", (guild_id,)),
+        ("oldest accounts", "SELECT name FROM demographics WHERE guild_id = ? ORDER BY member_id LIMIT 3", (guild_id,)),
+    ]
+
+
+def report(conn, queries, label, repeat):
+    print(f"\n=== {label} ===")
+    for name, sql, params in queries:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        start = time.perf_counter()
+        for _ in range(repeat):
+            conn.execute(sql, params).fetchall()
+        elapsed_ms = (time.perf_counter() - start) * 1000 / repeat
+        print(f"{name:<22} {elapsed_ms:9.3f} ms  | " + "; ".join(row[3] for row in plan))
+
+
+def db_size(conn):
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+def compare_keys(tmp, args):
+    """Compare TEXT vs INTEGER snowflake keys on size and demographics lookups"""
+    print("\n=== snowflake keys: TEXT vs INTEGER ===")
+    for key_type in ("TEXT", "INTEGER"):
+        conn = build_db(os.path.join(tmp, f"keys_{key_type.lower()}.db"), args.guilds, 1, args.members, key_type)
+        for index_name, table, columns in load_schema_indexes():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+        conn.execute("VACUUM")
+        pairs = conn.execute("SELECT guild_id, member_id FROM demographics ORDER BY random() LIMIT 2000").fetchall()
+        start = time.perf_counter()
+        for guild_id, member_id in pairs:
+            conn.execute("SELECT name FROM demographics WHERE guild_id = ? AND member_id = ?", (guild_id, member_id)).fetchone()
+        pk_us = (time.perf_counter() - start) * 1e6 / len(pairs)
+        start = time.perf_counter()
+        for _, member_id in pairs:
+            conn.execute("SELECT guild_id FROM demographics WHERE member_id = ?", (member_id,)).fetchall()
+        member_us = (time.perf_counter() - start) * 1e6 / len(pairs)
+        print(f"{key_type:<8} db {db_size(conn) / 1024 / 1024:8.2f} MiB  | pk lookup {pk_us:7.2f} us  | member_id lookup {member_us:7.2f} us")
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--guilds", type=int, default=200)
+    parser.add_argument("--snapshots", type=int, default=2000, help="snapshots per guild")
+    parser.add_argument("--members", type=int, default=1000, help="members per guild")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare-keys", action="store_true", help="also compare TEXT vs INTEGER snowflake keys")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build_db(os.path.join(tmp, "bench.db"), args.guilds, args.snapshots, args.members)
+        guild_id = 100000000000000000 + args.guilds // 2
+        member_id = conn.execute("SELECT member_id FROM demographics WHERE guild_id = ? LIMIT 1", (guild_id,)).fetchone()[0]
+        day_ago_ms = epoch_ms(datetime.now(timezone.utc) - timedelta(hours=24))
+        queries = hot_queries(guild_id, day_ago_ms, member_id)
+        print(f"snapshots: {args.guilds * args.snapshots:,}  demographics: {args.guilds * args.members:,}")
+        report(conn, queries, "before (no secondary indexes)", args.repeat)
+        for index_name, table, columns in load_schema_indexes():
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+        conn.execute("ANALYZE")
+        report(conn, queries, "after (SCHEMA_INDEXES)", args.repeat)
+        conn.close()
+        if args.compare_keys:
+            compare_keys(tmp, args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Cost of the per-role histogram added to the snapshot member pass.
+
+Builds a synthetic member list shaped like discord.py members (a bot flag and a raw role id
+array) and times the old bot-count-only pass against count_members from server analytics.py,
+which counts bots and members per role in the same loop, plus encoding the histogram. Times are
+reported per 100k members.
+
+Usage:
+    python benchmarks/role_histogram.py [--members 100000] [--roles 50] [--max-member-roles 6] [--repeat 5]
+"""
+import argparse
+import ast
+import os
+import random
+import sys
+import time
+from array import array
+from collections import Counter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BOT_PATH = os.path.join(ROOT, "server analytics.py")
+
+
+def load_bot_functions(*names):
+    """Compile the named (nested) functions out of the bot source without importing discord"""
+    with open(BOT_PATH, "r", encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    found = [node for node in ast.walk(tree) if isinstance(node, ast.FunctionDef) and node.name in names]
+    if len(found) != len(names):
+        raise RuntimeError(f"{names} not all found in server analytics.py")
+    namespace = {"Counter": Counter, "array": array, "sys": sys}
+    exec(compile(ast.Module(body=found, type_ignores=[]), BOT_PATH, "exec"), namespace)
+    return [namespace[name] for name in names]
+
+
+class Member:
+    """The two member attributes the snapshot pass reads"""
+    __slots__ = ("bot", "_roles")
+
+    def __init__(self, bot, roles):
+        self.bot = bot
+        self._roles = roles
+
+
+def build_members(count, roles, max_member_roles, rng):
+    role_ids = [1100000000000000000 + n for n in range(roles)]
+    members = []
+    for _ in range(count):
+        # discord.py keeps a member's role ids in an array('Q') (SnowflakeList)
+        members.append(Member(rng.random() < 0.02, array("Q", sorted(rng.sample(role_ids, rng.randint(0, max_member_roles))))))
+    return members
+
+
+def best_ms(func, repeat):
+    """Fastest of repeat runs, in ms"""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--members", type=int, default=100000)
+    parser.add_argument("--roles", type=int, default=50, help="roles in the guild")
+    parser.add_argument("--max-member-roles", type=int, default=6, help="most roles a member holds")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    count_members, encode_role_counts = load_bot_functions("count_members", "encode_role_counts")
+    members = build_members(args.members, args.roles, args.max_member_roles, random.Random(1234))
+    per_100k = 100000 / args.members
+
+    bots_only = best_ms(lambda: len([m for m in members if m.bot]), args.repeat)
+    single_pass = best_ms(lambda: count_members(members), args.repeat)
+    _, role_counts = count_members(members)
+    encode = best_ms(lambda: encode_role_counts(role_counts), args.repeat)
+    histogram = encode_role_counts(role_counts)
+
+    print(f"members: {args.members:,}  roles: {args.roles}  role assignments: {sum(role_counts.values()):,}")
+    print(f"bot count only (before)       {bots_only * per_100k:9.2f} ms / 100k members")
+    print(f"bots + role histogram (after) {single_pass * per_100k:9.2f} ms / 100k members")
+    print(f"added by the histogram        {(single_pass - bots_only) * per_100k:9.2f} ms / 100k members")
+    print(f"encode histogram              {encode:9.3f} ms  ({len(histogram):,} bytes per snapshot)")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,9 +10,9 @@
 <p>analytics members - Show member count history graph
 <p>analytics trend - Show member growth trend analysis
 <p>analytics compare <days> - Compare server stats between two time periods
-<p>analytics export - Export analytics data to a text file
+<p>analytics export [csv|ndjson] [gz] [all] [demographics] - Export analytics data to files
 <p>analytics auto <on/off> - Toggle automatic daily snapshots
-<p>analytics retention [days] - Set snapshot data retention period
+<p>analytics retention [days|on|off] - Set snapshot data retention period, and whether it is enforced
 <p>analytics interval [hours] - Set auto-snapshot interval
 <p>a <subcommand> - Shorthand for analytics command (same functionality)
 <p>a ss - Short command for taking a snapshot
@@ -39,9 +39,9 @@ def server_analytics():
     <p>analytics members    - Show member count history graph
     <p>analytics trend      - Show member growth trend analysis
     <p>analytics compare [days] - Compare server stats between two time periods
-    <p>analytics export     - Export analytics data to a text file
+    <p>analytics export [csv|ndjson] [gz] [all] [demographics] - Export analytics data to files
     <p>analytics auto [on/off] - Manage automatic snapshots
-    <p>analytics retention [days] - Set data retention period
+    <p>analytics retention [days|on/off] - Set data retention period / enforce it
     <p>analytics interval [hours] - Set auto snapshot interval
     <p>a ss                 - Quick snapshot
     <p>a timezone <zone>    - Set timezone
@@ -68,13 +68,22 @@ def server_analytics():
     import sqlite3
     import os
     import json
+    import csv
+    import gzip
+    import hashlib
+    import zlib
+    import struct
+    import sys
+    from array import array
     import asyncio
     from datetime import datetime, timedelta, timezone
     import random
     import math
     from pathlib import Path
     import re
-    from collections import defaultdict
+    from collections import Counter, defaultdict
+    from itertools import accumulate, chain, groupby, islice
+    from concurrent.futures import ThreadPoolExecutor
     import time
     import discord
     import aiohttp
@@ -89,6 +98,11 @@ def server_analytics():
     
     AUTO_SNAPSHOT_CONFIG_KEY = "server_analytics_auto_snapshot"
     LAST_AUTO_SNAPSHOT_KEY = "server_analytics_last_auto"
+    RETENTION_CONFIG_KEY = "server_analytics_retention"
+    COMPACTION_CONFIG_KEY = "server_analytics_compaction"
+    ARCHIVE_CONFIG_KEY = "server_analytics_archive"
+    PARTITION_CONFIG_KEY = "server_analytics_partition"
+    RUN_LENGTH_CONFIG_KEY = "server_analytics_run_length"
     
     # Timezone configuration
     TIMEZONE_CONFIG_KEY = "server_analytics_timezone"
@@ -189,14 +203,10 @@ def server_analytics():
         return f"{formatted_time} {timezone}"
     
     # Server configuration management
-    def load_server_config(guild_id):
+    async def load_server_config(guild_id):
         """Load server-specific configuration from database"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT auto_snapshot, last_auto_snapshot, first_snapshot_date, chart_style, snapshot_retention_days, auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (str(guild_id),))
-            row = c.fetchone()
-            conn.close()
+            row = await db_fetchone("SELECT auto_snapshot, last_auto_snapshot, first_snapshot_date, chart_style, snapshot_retention_days, auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (int(guild_id),))
             
             if row:
                 return {
@@ -204,7 +214,7 @@ def server_analytics():
                     "last_auto_snapshot": row[1],
                     "first_snapshot_date": row[2],
                     "chart_style": row[3] or "emoji",
-                    "snapshot_retention_days": row[4] or DATA_RETENTION_DAYS,
+                    "snapshot_retention_days": row[4] if row[4] is not None else DATA_RETENTION_DAYS,  # 0 keeps everything
                     "auto_snapshot_interval_hours": row[5] or DEFAULT_AUTO_SNAPSHOT_INTERVAL_HOURS,
                 }
             else:
@@ -228,12 +238,9 @@ def server_analytics():
                 "auto_snapshot_interval_hours": DEFAULT_AUTO_SNAPSHOT_INTERVAL_HOURS,
             }
         
-    def update_server_config(guild_id, key, value):
+    async def update_server_config(guild_id, key, value):
         """Update a specific server configuration value in database"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            
             # Map config keys to database columns
             column_map = {
                 "auto_snapshot": "auto_snapshot",
@@ -246,36 +253,26 @@ def server_analytics():
             
             if key in column_map:
                 column = column_map[key]
-                c.execute(f"UPDATE server_config SET {column} = ? WHERE guild_id = ?", (value, str(guild_id)))
-                conn.commit()
+                await db_execute(f"UPDATE server_config SET {column} = ? WHERE guild_id = ?", (value, int(guild_id)))
             
-            conn.close()
-            return load_server_config(guild_id)
+            return await load_server_config(guild_id)
         except Exception as e:
             print(f"Error updating server config for {guild_id}: {e}", type_="ERROR")
-            return load_server_config(guild_id)
+            return await load_server_config(guild_id)
         
-    def is_auto_snapshot_enabled(guild_id):
+    async def is_auto_snapshot_enabled(guild_id):
         """Check if automatic snapshots are enabled for this server"""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT auto_snapshot FROM server_config WHERE guild_id = ?", (str(guild_id),))
-            row = c.fetchone()
-            conn.close()
+            row = await db_fetchone("SELECT auto_snapshot FROM server_config WHERE guild_id = ?", (int(guild_id),))
             return bool(row[0]) if row and row[0] is not None else False
         except Exception as e:
             print(f"Error checking auto_snapshot status for {guild_id}: {e}", type_="ERROR")
             return False
         
-    def should_take_auto_snapshot(guild_id):
+    async def should_take_auto_snapshot(guild_id):
         """Return True if enough time has passed for an automatic snapshot."""
         try:
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT last_auto_snapshot, auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (str(guild_id),))
-            row = c.fetchone()
-            conn.close()
+            row = await db_fetchone("SELECT last_auto_snapshot, auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (int(guild_id),))
             
             if not row or row[0] is None:
                 return True
@@ -299,7 +296,7 @@ def server_analytics():
     # Initialize data structures if they don't exist
     def initialize_data(guild_id):
         """Initialize database schema if needed"""
-        create_schema()
+        ensure_schema()
 
     # Load data from JSON files
     def load_data(file_path):
@@ -316,9 +313,6 @@ def server_analytics():
 
     # Take a server snapshot
     async def take_snapshot(guild, is_auto=False):
-        # Ensure database schema exists
-        create_schema()
-        
         # Get channel and role counts
         voice_channels = 0
         text_channels = 0
@@ -338,48 +332,187 @@ def server_analytics():
         channel_count = len(guild.channels)
         role_count = len(guild.roles)
         
-        # Fetch all members to get accurate bot count
+        # Fetch all members to get accurate bot and per-role counts
         try:
             members_list = await guild.fetch_members()
-            bots = len([m for m in members_list if m.bot])
         except Exception as e:
             print(f"Error fetching members for bot count in {guild.name}: {e}", type_="ERROR")
             # Fallback to cached members if fetch fails
-            bots = len([m for m in guild.members if m.bot])
+            members_list = guild.members
+        bots, role_counts = count_members(members_list)
         
         boosters = getattr(guild, 'premium_subscription_count', 0)
+        structure = guild_structure(guild)
         
-        # Insert into SQLite database
-        conn = sqlite3.connect(DB_PATH)
+        # Insert into SQLite database (on the DB thread)
+        await run_db(write_snapshot_rows, guild, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto, structure, role_counts, guild_id=guild.id)
+        
+        # Add to tracked servers for demographics
+        add_tracked_server(guild.id)
+        
+        return {
+            "timestamp": timestamp.isoformat(),
+            "member_count": member_count,
+            "channel_count": channel_count,
+            "role_count": role_count,
+            "categories": categories,
+            "text_channels": text_channels,
+            "voice_channels": voice_channels,
+            "bots": bots,
+            "boosters": boosters,
+            "is_auto": is_auto
+        }
+
+    def record_guild_snapshot(conn, guild_id, guild_name, timestamp, member_count, channel_count, role_count, bots, boosters):
+        """Fold a snapshot into the guilds dimension and, if the name changed, guild_name_history"""
+        timestamp_ms = to_epoch_ms(timestamp)
+        conn.execute("""
+            INSERT INTO guilds (guild_id, name, first_snapshot, first_snapshot_ms, last_snapshot, last_snapshot_ms, member_count, channel_count, role_count, bots, boosters)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (guild_id) DO UPDATE SET
+                name = COALESCE(excluded.name, guilds.name),
+                last_snapshot = excluded.last_snapshot,
+                last_snapshot_ms = excluded.last_snapshot_ms,
+                member_count = excluded.member_count,
+                channel_count = excluded.channel_count,
+                role_count = excluded.role_count,
+                bots = excluded.bots,
+                boosters = excluded.boosters
+            WHERE guilds.last_snapshot_ms IS NULL OR excluded.last_snapshot_ms >= guilds.last_snapshot_ms
+        """, (guild_id, guild_name, timestamp.isoformat(), timestamp_ms, timestamp.isoformat(), timestamp_ms,
+              member_count, channel_count, role_count, bots, boosters))
+        # Snapshots can arrive out of order (imports), so the first snapshot may move back too
+        conn.execute(
+            "UPDATE guilds SET first_snapshot = ?, first_snapshot_ms = ? WHERE guild_id = ? AND first_snapshot_ms > ?",
+            (timestamp.isoformat(), timestamp_ms, guild_id, timestamp_ms)
+        )
+        if guild_name is not None:
+            # Record a change only when the name differs from the one in effect at this snapshot
+            conn.execute("""
+                INSERT OR IGNORE INTO guild_name_history (guild_id, name, changed_at_ms)
+                SELECT ?, ?, ?
+                WHERE ? IS NOT (SELECT name FROM guild_name_history WHERE guild_id = ? AND changed_at_ms <= ? ORDER BY changed_at_ms DESC LIMIT 1)
+            """, (guild_id, guild_name, timestamp_ms, guild_name, guild_id, timestamp_ms))
+
+    def guild_structure(guild):
+        """
+        The guild's channels and roles as canonical JSON bytes (sorted keys, items ordered by id), so the
+        same structure always encodes, and hashes, the same. None if it could not be read.
+        """
+        try:
+            channels = []
+            for channel in guild.channels:
+                overwrites = {}
+                for target, overwrite in getattr(channel, "overwrites", {}).items():
+                    allow, deny = overwrite.pair()
+                    overwrites[str(target.id)] = [allow.value, deny.value]
+                channels.append({
+                    "id": channel.id,
+                    "name": channel.name,
+                    "type": str(channel.type).lower(),
+                    "position": channel.position,
+                    "category_id": getattr(channel, "category_id", None),
+                    "topic": getattr(channel, "topic", None),
+                    "nsfw": getattr(channel, "nsfw", False),
+                    "overwrites": overwrites,
+                })
+            roles = [{
+                "id": role.id,
+                "name": role.name,
+                "color": role.color.value,
+                "position": role.position,
+                "permissions": role.permissions.value,
+                "hoist": role.hoist,
+                "mentionable": role.mentionable,
+                "managed": role.managed,
+            } for role in guild.roles]
+        except Exception as e:
+            print(f"Error reading channel/role structure of {guild.name}: {e}", type_="ERROR")
+            return None
+        structure = {
+            "channels": sorted(channels, key=lambda item: item["id"]),
+            "roles": sorted(roles, key=lambda item: item["id"]),
+        }
+        return json.dumps(structure, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+    def record_structure(conn, guild_id, timestamp_ms, structure):
+        """
+        Log a guild's structure (guild_structure bytes) at timestamp_ms if its hash differs from the one
+        in effect then; the zlib-compressed blob is stored once per distinct hash (DB thread)
+        """
+        digest = hashlib.sha256(structure).hexdigest()
+        latest = conn.execute(
+            "SELECT hash FROM guild_structures WHERE guild_id = ? AND timestamp_ms <= ? ORDER BY timestamp_ms DESC LIMIT 1",
+            (guild_id, timestamp_ms)
+        ).fetchone()
+        if latest is not None and latest[0] == digest:
+            return
+        conn.execute("INSERT OR IGNORE INTO structure_blobs (hash, body) VALUES (?, ?)", (digest, zlib.compress(structure, 9)))
+        conn.execute("INSERT OR IGNORE INTO guild_structures (guild_id, timestamp_ms, hash) VALUES (?, ?, ?)", (guild_id, timestamp_ms, digest))
+
+    def count_members(members):
+        """
+        (bots, Counter of role_id -> members holding it) in one pass over a member list. Reads each
+        member's raw role id array (Member._roles, without @everyone) instead of Member.roles, which
+        builds and sorts Role objects for every member. The ids are gathered into one array and counted
+        once, which is several times faster than a Counter.update per member.
+        """
+        bots = 0
+        role_ids = array("Q")
+        for member in members:
+            if member.bot:
+                bots += 1
+            # _roles is a private discord.py attribute; kept for speed, with the public (slower)
+            # Member.roles as the fallback should a library version drop or rename it
+            raw_roles = getattr(member, "_roles", None)
+            if raw_roles is None:
+                raw_roles = [role.id for role in member.roles if not role.is_default()]
+            role_ids.extend(raw_roles)
+        return bots, Counter(role_ids)
+
+    def encode_role_counts(role_counts):
+        """A role histogram as little-endian int64 (role_id, count) pairs sorted by role_id"""
+        packed = array("q", [value for role_id in sorted(role_counts) for value in (role_id, role_counts[role_id])])
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return packed.tobytes()
+
+    def insert_snapshot_row(conn, guild, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto, structure=None, role_counts=None):
+        """
+        Insert a snapshot row (or, with run-length snapshots on, extend the guild's identical latest row),
+        update the guilds dimension, log a changed structure (guild_structure bytes) and store the role
+        histogram (count_members' Counter) in the same transaction (DB thread)
+        """
+        values = (guild.name, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, int(is_auto))
+        if not (is_run_length_enabled() and extend_snapshot_run(conn, guild.id, to_epoch_ms(timestamp), values)):
+            conn.execute("""
+                INSERT INTO main.snapshots (guild_id, guild_name, timestamp, timestamp_ms, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (guild.id, guild.name, timestamp.isoformat(), to_epoch_ms(timestamp)) + values[1:])
+        record_guild_snapshot(conn, guild.id, guild.name, timestamp, member_count, channel_count, role_count, bots, boosters)
+        if structure is not None:
+            record_structure(conn, guild.id, to_epoch_ms(timestamp), structure)
+        if role_counts is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO main.role_histograms (guild_id, timestamp_ms, histogram) VALUES (?, ?, ?)",
+                (guild.id, to_epoch_ms(timestamp), encode_role_counts(role_counts))
+            )
+
+    def write_snapshot_rows(conn, guild, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto, structure=None, role_counts=None):
+        """Insert a snapshot row and refresh the guild's server_config row (DB thread)"""
         c = conn.cursor()
         
-        # Insert snapshot
-        c.execute("""
-            INSERT INTO snapshots (guild_id, guild_name, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            str(guild.id),
-            guild.name,
-            timestamp.isoformat(),
-            member_count,
-            channel_count,
-            text_channels,
-            voice_channels,
-            categories,
-            role_count,
-            bots,
-            boosters,
-            int(is_auto)
-        ))
+        # Insert snapshot (and its guilds row, structure and role histogram)
+        insert_snapshot_row(conn, guild, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto, structure, role_counts)
         
         # Get current config, including first_snapshot_date
-        c.execute("SELECT auto_snapshot, chart_style, snapshot_retention_days, auto_snapshot_interval_hours, first_snapshot_date FROM server_config WHERE guild_id = ?", (str(guild.id),))
+        c.execute("SELECT auto_snapshot, chart_style, snapshot_retention_days, auto_snapshot_interval_hours, first_snapshot_date FROM server_config WHERE guild_id = ?", (guild.id,))
         config_row = c.fetchone()
         
         if config_row:
             current_auto_snapshot = config_row[0] if config_row[0] is not None else 0
             current_chart_style = config_row[1] if config_row[1] else "emoji"
-            current_retention_days = config_row[2] if config_row[2] else DATA_RETENTION_DAYS
+            current_retention_days = config_row[2] if config_row[2] is not None else DATA_RETENTION_DAYS  # 0 keeps everything
             current_interval_hours = config_row[3] if config_row[3] else DEFAULT_AUTO_SNAPSHOT_INTERVAL_HOURS
             current_first_snapshot_date = config_row[4]
         else:
@@ -397,7 +530,7 @@ def server_analytics():
             INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot, last_auto_snapshot, first_snapshot_date, chart_style, snapshot_retention_days, auto_snapshot_interval_hours)
             VALUES (?, ?, ?, ?, ?, ?, ?)
         """, (
-            str(guild.id),
+            guild.id,
             current_auto_snapshot,  # Preserve current auto_snapshot setting
             timestamp.isoformat() if is_auto else None,
             first_snapshot_date_to_set,  # Only set if not already set
@@ -405,25 +538,6 @@ def server_analytics():
             current_retention_days,
             current_interval_hours
         ))
-        
-        conn.commit()
-        conn.close()
-        
-        # Add to tracked servers for demographics
-        add_tracked_server(guild.id)
-        
-        return {
-            "timestamp": timestamp.isoformat(),
-            "member_count": member_count,
-            "channel_count": channel_count,
-            "role_count": role_count,
-            "categories": categories,
-            "text_channels": text_channels,
-            "voice_channels": voice_channels,
-            "bots": bots,
-            "boosters": boosters,
-            "is_auto": is_auto
-        }
 
     # Handle auto-snapshot functionality
     @bot.listen("on_message")
@@ -437,11 +551,11 @@ def server_analytics():
             return
             
         # Check if auto-snapshots are enabled for this guild
-        if not is_auto_snapshot_enabled(message.guild.id):
+        if not await is_auto_snapshot_enabled(message.guild.id):
             return
             
         # Check if enough time has passed since last auto snapshot
-        if not should_take_auto_snapshot(message.guild.id):
+        if not await should_take_auto_snapshot(message.guild.id):
             return
             
         # Take the snapshot silently
@@ -541,7 +655,6 @@ def server_analytics():
     # Commands
     @bot.command(name="analytics", aliases=["a"], description="Server analytics commands")
     async def analytics_cmd(ctx, *, args: str = ""):
-        create_schema()
         # Store message for later deletion
         cmd_msg = ctx.message
         
@@ -588,10 +701,16 @@ def server_analytics():
 • `<p>analytics members` (mem) - show recent member changes
 • `<p>analytics trend` (tr) - show growth trend analysis
 • `<p>analytics compare [days]` (cmp) - compare with previous period
-• `<p>analytics export` (exp) - export data to text file
+• `<p>analytics export [csv|ndjson] [gz] [all] [demographics]` (exp) - export this server's (or all) snapshots, optionally with demographics
 • `<p>analytics auto [on/off]` - manage automatic snapshots
-• `<p>analytics retention [days]` (ret) - set data retention period
+• `<p>analytics retention [days/on/off]` (ret) - set data retention period (0 keeps snapshots forever); on lets the background worker delete older snapshots
 • `<p>analytics interval [hours]` (int) - set auto snapshot interval
+• `<p>analytics compact [on/off/now]` - downsample old snapshots to hourly/daily rollups
+• `<p>analytics archive [on/off/now]` - move snapshots older than 180 days into compact column files
+• `<p>analytics shard [on/off]` - split snapshots and demographics into per-server shard files
+• `<p>analytics partition [on/off/now]` - keep closed months of snapshots in monthly tables that retention drops whole
+• `<p>analytics runs [on/off/now]` - store unchanged consecutive snapshots as one row spanning their time range
+• `<p>analytics vacuum [now]` - let pruning return freed space to disk (one-off full VACUUM of the database; slow on large files)
 • `<p>a <subcommand>` - shorthand for commands
 • `<p>a ss` - quick snapshot
 • `<p>a timezone <zone>` (tz) - set timezone
@@ -640,38 +759,19 @@ def server_analytics():
             member_count = guild.member_count
             channel_count = len(guild.channels)
             role_count = len(guild.roles)
-            # Fetch all members to get accurate bot count
+            # Fetch all members to get accurate bot and per-role counts
             try:
                 members_list = await guild.fetch_members()
-                bots = len([m for m in members_list if m.bot])
             except Exception as e:
                 print(f"Error fetching members for bot count in {guild.name}: {e}", type_="ERROR")
                 # Fallback to cached members if fetch fails
-                bots = len([m for m in guild.members if m.bot])
+                members_list = guild.members
+            bots, role_counts = count_members(members_list)
             boosters = getattr(guild, 'premium_subscription_count', 0)
             is_auto = False
+            structure = guild_structure(guild)
             # Insert into SQLite
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("""
-                INSERT INTO snapshots (guild_id, guild_name, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                str(guild.id),
-                guild.name,
-                timestamp.isoformat(),
-                member_count,
-                channel_count,
-                text_channels,
-                voice_channels,
-                categories,
-                role_count,
-                bots,
-                boosters,
-                int(is_auto)
-            ))
-            conn.commit()
-            conn.close()
+            await run_db(insert_snapshot_row, guild, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto, structure, role_counts, guild_id=guild.id)
             try:
                 await msg.edit(content=f""" **new snapshot**
                 
@@ -688,10 +788,9 @@ def server_analytics():
             current_private = getConfigData().get("private")
             try:
                 msg = await ctx.send("generating analytics report...")
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute("SELECT COUNT(*) FROM snapshots WHERE guild_id = ?", (str(ctx.guild.id),))
-                snap_count = c.fetchone()[0]
+                snapshots = await run_db(snapshot_history, ctx.guild.id, guild_id=ctx.guild.id)
+                # A run or rollup row counts its samples
+                snap_count = sum(s["sample_count"] for s in snapshots)
 
                 if snap_count < 2:
                     error_msg = "Not enough data to generate a report. "
@@ -706,27 +805,15 @@ def server_analytics():
                         await msg.edit(content=error_msg)
                     else:
                         await ctx.send(error_msg)
-                    conn.close()
                     return
 
-                c.execute("SELECT timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, is_auto FROM snapshots WHERE guild_id = ? ORDER BY timestamp ASC", (str(ctx.guild.id),))
-                rows = c.fetchall()
-                conn.close()
-
                 updateConfigData("private", False)
-                snapshots = [
-                    {
-                        "timestamp": row[0], "member_count": row[1], "channel_count": row[2],
-                        "text_channels": row[3], "voice_channels": row[4], "categories": row[5],
-                        "role_count": row[6], "bots": row[7], "is_auto": bool(row[8])
-                    }
-                    for row in rows
-                ]
                 latest = snapshots[-1]
                 oldest = snapshots[0]
-                growth = latest["member_count"] - oldest["member_count"]
-                growth_rate = (growth / oldest["member_count"]) * 100 if oldest["member_count"] > 0 else 0
-                peak_members = max(s["member_count"] for s in snapshots)
+                # Compacted rows carry their bucket's first and max member counts
+                growth = latest["member_count"] - oldest["member_count_first"]
+                growth_rate = (growth / oldest["member_count_first"]) * 100 if oldest["member_count_first"] > 0 else 0
+                peak_members = max(s["member_count_max"] for s in snapshots)
                 current_members = latest["member_count"]
                 # Calculate difference from peak (current - peak)
                 peak_diff = current_members - peak_members
@@ -765,24 +852,18 @@ def server_analytics():
                 updateConfigData("private", current_private)
             
         elif cmd == "clear":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("DELETE FROM snapshots WHERE guild_id = ?", (str(ctx.guild.id),))
-            conn.commit()
-            conn.close()
+            archived = await run_db(clear_guild_data, ctx.guild.id, guild_id=ctx.guild.id)
+            if archived:
+                await run_in_db_thread(remove_archive_files, archived)
             try:
                 await ctx.send(f"analytics data for {ctx.guild.name} has been cleared.")
             except Exception as e:
                 print(f"Error sending clear message: {str(e)}", type_="ERROR")
             
         elif cmd == "status":
-            # Query snapshot count and config from DB
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT COUNT(*) FROM snapshots WHERE guild_id = ?", (str(ctx.guild.id),))
-            snap_count = c.fetchone()[0]
-            c.execute("SELECT auto_snapshot, last_auto_snapshot, first_snapshot_date, snapshot_retention_days FROM server_config WHERE guild_id = ?", (str(ctx.guild.id),))
-            config_row = c.fetchone()
+            # Query snapshot count (a run or rollup row counts its samples) and config from DB
+            snap_count = (await db_fetchone("SELECT COALESCE(SUM(COALESCE(sample_count, 1)), 0) FROM snapshots WHERE guild_id = ?", (ctx.guild.id,), guild_id=ctx.guild.id))[0]
+            config_row = await db_fetchone("SELECT auto_snapshot, last_auto_snapshot, first_snapshot_date, snapshot_retention_days FROM server_config WHERE guild_id = ?", (ctx.guild.id,))
             if config_row:
                 auto_snapshot, last_auto_snapshot, first_snapshot_date, retention_days = config_row
             else:
@@ -790,10 +871,8 @@ def server_analytics():
 
             # If first_snapshot_date is missing, get it from the earliest snapshot
             if not first_snapshot_date:
-                c.execute("SELECT MIN(timestamp) FROM snapshots WHERE guild_id = ?", (str(ctx.guild.id),))
-                row = c.fetchone()
+                row = await db_fetchone("SELECT timestamp FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms ASC LIMIT 1", (ctx.guild.id,), guild_id=ctx.guild.id)
                 first_snapshot_date = row[0] if row and row[0] else None
-            conn.close()
 
             # Format the first snapshot date for display
             if first_snapshot_date:
@@ -810,29 +889,11 @@ def server_analytics():
             
         elif cmd == "members":
             msg = await ctx.send("generating member graph...")
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, is_auto FROM snapshots WHERE guild_id = ? ORDER BY timestamp DESC LIMIT 7", (str(ctx.guild.id),))
-            rows = c.fetchall()
-            conn.close()
-            if not rows:
+            # Newest first, runs expanded into their snapshots
+            recent_snapshots = (await run_db(snapshot_history, ctx.guild.id, 7, guild_id=ctx.guild.id))[::-1]
+            if not recent_snapshots:
                 await msg.edit(content="no analytics data available yet for this server.")
                 return
-            # Build recent_snapshots list from DB rows (newest first)
-            recent_snapshots = [
-                {
-                    "timestamp": row[0],
-                    "member_count": row[1],
-                    "channel_count": row[2],
-                    "text_channels": row[3],
-                    "voice_channels": row[4],
-                    "categories": row[5],
-                    "role_count": row[6],
-                    "bots": row[7],
-                    "is_auto": bool(row[8])
-                }
-                for row in rows
-            ]
             # Sort by timestamp descending (already is), group by member_count
             grouped_snapshots = []
             if recent_snapshots:
@@ -889,18 +950,12 @@ def server_analytics():
             
         elif cmd == "trend":
             msg = await ctx.send("analyzing growth trends...")
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT timestamp, member_count FROM snapshots WHERE guild_id = ? ORDER BY timestamp ASC", (str(ctx.guild.id),))
-            rows = c.fetchall()
-            conn.close()
-            if len(rows) < 2:
+            # Runs are expanded, so the latest point is where the newest run ends
+            snapshots = await run_db(snapshot_history, ctx.guild.id, guild_id=ctx.guild.id)
+            # A rollup row counts its samples but is still one point to measure from
+            if sum(s["sample_count"] for s in snapshots) < 2 or len(snapshots) < 2:
                 await msg.edit(content="not enough data for trend analysis. please take at least 2 snapshots.")
                 return
-            # Build snapshots list from DB rows
-            snapshots = [
-                {"timestamp": row[0], "member_count": row[1]} for row in rows
-            ]
             # Get trend analysis for different time periods
             short_trend = analyze_growth_trend(snapshots, days=3)
             medium_trend = analyze_growth_trend(snapshots, days=7)
@@ -923,59 +978,65 @@ def server_analytics():
             await compare_periods(ctx, days)
             
         elif cmd == "export":
+            # Options in any order: csv|ndjson, gz, all (every guild), demographics
+            options = f"{subcmd} {subarg}".lower().split()
+            fmt = "ndjson" if "ndjson" in options or "json" in options else "csv"
+            compress = "gz" in options or "gzip" in options
+            guild_id = None if "all" in options else ctx.guild.id
+            tables = ["snapshots"] + (["demographics"] if "demographics" in options or "demo" in options else [])
             msg = await ctx.send("exporting data to file...")
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("SELECT timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots FROM snapshots WHERE guild_id = ? ORDER BY timestamp ASC", (str(ctx.guild.id),))
-            rows = c.fetchall()
-            conn.close()
-            if not rows:
+            scope_sql, scope_params = ("", ()) if guild_id is None else (" WHERE guild_id = ?", (guild_id,))
+            totals = {table: (await db_fetchone(f"SELECT COUNT(*) FROM {table}{scope_sql}", scope_params))[0] for table in tables}
+            if not any(totals.values()):
                 await msg.edit(content="no analytics data available to export.")
                 return
-            export_text = f"# server analytics export - {ctx.guild.name}\n"
-            export_text += f"# generated on {datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')} utc\n"
-            export_text += f"# total snapshots: {len(rows)}\n\n"
-            export_text += "timestamp,member_count,channel_count,text_channels,voice_channels,categories,role_count,bots\n"
-            for row in rows:
-                export_text += f"{row[0]},{row[1]},{row[2]},{row[3]},{row[4]},{row[5]},{row[6]},{row[7]}\n"
             export_dir = Path(getScriptsPath()) / "exports"
             export_dir.mkdir(parents=True, exist_ok=True)
-            filename = f"{ctx.guild.id}_analytics_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.csv"
-            export_path = export_dir / filename
-            with open(export_path, "w", encoding='utf-8') as f:
-                f.write(export_text)
+            stamp = datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')
+            scope = "all" if guild_id is None else guild_id
+            extension = fmt + (".gz" if compress else "")
+            files = []
+            for table in tables:
+                if not totals[table]:
+                    continue
+                filename = f"{scope}_{'analytics' if table == 'snapshots' else table}_{stamp}.{extension}"
+                last_update = time.monotonic()
+
+                async def progress(written, table=table):
+                    nonlocal last_update
+                    if time.monotonic() - last_update >= EXPORT_PROGRESS_SECONDS:
+                        last_update = time.monotonic()
+                        await msg.edit(content=f"exporting {table}... {written:,}/{totals[table]:,} rows")
+
+                written = await export_table(table, export_dir / filename, fmt, compress, guild_id, progress)
+                files.append(f"`{filename}` ({written:,} {table} rows)")
             await msg.delete()
+            file_lines = "\n".join(files)
             await ctx.send(f"""analytics data export complete
 
-file: `{filename}`
-location: `{str(export_path)}`
-snapshots: {len(rows)}
-format: csv (comma-separated values)
+files:
+{file_lines}
+location: `{str(export_dir)}`
+format: {'csv (comma-separated values)' if fmt == 'csv' else 'ndjson (one json object per line)'}{', gzip-compressed' if compress else ''}
 
 *use your file manager to access the exported data*""")
 
         elif cmd == "auto":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            
             # First, get the current auto-snapshot status
-            c.execute("SELECT auto_snapshot FROM server_config WHERE guild_id = ?", (str(ctx.guild.id),))
-            row = c.fetchone()
+            row = await db_fetchone("SELECT auto_snapshot FROM server_config WHERE guild_id = ?", (ctx.guild.id,))
             current_status = bool(row[0]) if row and row[0] is not None else False
             
             if subcmd in ["on", "true", "yes", "enable", "1"]:
                 if current_status:
                     await ctx.send("auto-snapshots are **already** enabled for this server.")
                 else:
-                    c.execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot) VALUES (?, ?)", (str(ctx.guild.id), 1))
-                    conn.commit()
+                    await db_execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot) VALUES (?, ?)", (ctx.guild.id, 1))
                     await ctx.send("auto-snapshots enabled for this server.")
             elif subcmd in ["off", "false", "no", "disable", "0"]:
                 if not current_status:
                     await ctx.send("auto-snapshots are **already** disabled for this server.")
                 else:
-                    c.execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot) VALUES (?, ?)", (str(ctx.guild.id), 0))
-                    conn.commit()
+                    await db_execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot) VALUES (?, ?)", (ctx.guild.id, 0))
                     await ctx.send("auto-snapshots disabled for this server.")
             else:
                 # Show current status without making changes
@@ -988,40 +1049,141 @@ format: csv (comma-separated values)
 • `<p>analytics auto on` - Enable auto-snapshots
 • `<p>analytics auto off` - Disable auto-snapshots
 • `<p>analytics auto` - Show current status (this message)""")
-            conn.close()
 
         elif cmd == "retention":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             if subcmd.isdigit():
                 days = int(subcmd)
-                c.execute("INSERT OR REPLACE INTO server_config (guild_id, snapshot_retention_days) VALUES (?, ?)", (str(ctx.guild.id), days))
-                conn.commit()
-                await ctx.send(f"data retention set to {days} days")
+                await db_execute("INSERT OR REPLACE INTO server_config (guild_id, snapshot_retention_days) VALUES (?, ?)", (ctx.guild.id, days))
+                await ctx.send((f"data retention set to {days} days" if days > 0 else "data retention disabled, snapshots are kept forever")
+                               + ("" if is_retention_enabled() else ". retention is not enforced, use `<p>analytics retention on` to prune older snapshots."))
+            elif subcmd in ["on", "off"]:
+                updateConfigData(RETENTION_CONFIG_KEY, subcmd == "on")
+                await ctx.send("retention enforcement enabled: snapshots older than each server's retention period are deleted every few hours."
+                               if subcmd == "on" else "retention enforcement disabled, snapshots are kept.")
             else:
-                c.execute("SELECT snapshot_retention_days FROM server_config WHERE guild_id = ?", (str(ctx.guild.id),))
-                row = c.fetchone()
+                row = await db_fetchone("SELECT snapshot_retention_days FROM server_config WHERE guild_id = ?", (ctx.guild.id,))
                 current = row[0] if row and row[0] is not None else DATA_RETENTION_DAYS
-                await ctx.send(f"data retention is {current} days")
-            conn.close()
+                status = "enforced" if is_retention_enabled() else "not enforced (`<p>analytics retention on` enables pruning)"
+                await ctx.send(f"data retention is {current} days, {status}")
+
+        elif cmd == "compact":
+            if subcmd in ["on", "off"]:
+                updateConfigData(COMPACTION_CONFIG_KEY, subcmd == "on")
+                await ctx.send(f"snapshot compaction {'enabled' if subcmd == 'on' else 'disabled'}.")
+            elif subcmd == "now":
+                msg = await ctx.send("compacting old snapshots...")
+                removed = await compact_snapshots()
+                if removed:
+                    await run_db(reclaim_free_pages)
+                await msg.edit(content=f"compaction complete: {removed:,} snapshots collapsed into hourly/daily rollups.")
+            else:
+                status = "enabled" if is_compaction_enabled() else "disabled"
+                await ctx.send(f"snapshot compaction is {status}. snapshots older than {COMPACTION_RAW_DAYS} days are kept hourly, older than {COMPACTION_HOURLY_DAYS} days daily.\nuse `<p>analytics compact on|off|now`.")
+
+        elif cmd == "shard":
+            if subcmd == "on":
+                msg = await ctx.send(f"moving snapshots and demographics into {SHARD_COUNT} shard files...")
+                count = await run_db(enable_sharding)
+                if count:
+                    if is_partitioning_enabled():
+                        await seal_partitions()
+                    await run_db(reclaim_free_pages)
+                    await msg.edit(content=f"sharding enabled: {count} shard files in `{SHARD_DIR}`.")
+                else:
+                    await msg.edit(content="the database is already sharded.")
+            elif subcmd == "off":
+                msg = await ctx.send("moving shard data back into the main database...")
+                paths = await run_db(disable_sharding)
+                await run_in_db_thread(remove_shard_files, paths)
+                await msg.edit(content=f"sharding disabled: {len(paths)} shard files merged back." if paths else "the database is not sharded.")
+                if paths and is_partitioning_enabled():
+                    await seal_partitions()
+            else:
+                paths = await run_db(shard_paths)
+                if paths:
+                    sizes = await run_in_db_thread(lambda: [os.path.getsize(path) for path in paths])
+                    await ctx.send(f"the database is sharded into {len(paths)} files ({sum(sizes) / 1024 / 1024:,.1f} MiB, largest {max(sizes) / 1024 / 1024:,.1f} MiB).\nuse `<p>analytics shard on|off`.")
+                else:
+                    await ctx.send(f"the database is not sharded. `<p>analytics shard on` splits snapshots and demographics into {SHARD_COUNT} files by server.")
+
+        elif cmd == "archive":
+            if subcmd in ["on", "off"]:
+                updateConfigData(ARCHIVE_CONFIG_KEY, subcmd == "on")
+                await ctx.send(f"snapshot archiving {'enabled' if subcmd == 'on' else 'disabled'}.")
+            elif subcmd == "now":
+                msg = await ctx.send("archiving old snapshots...")
+                archived = await archive_snapshots()
+                if archived:
+                    await run_db(reclaim_free_pages)
+                await msg.edit(content=f"archive complete: {archived:,} snapshots moved to archive segments.")
+            else:
+                status = "enabled" if is_archive_enabled() else "disabled"
+                row = await db_fetchone("SELECT COUNT(*), COALESCE(SUM(COALESCE(sample_count, row_count)), 0), COALESCE(SUM(bytes), 0) FROM snapshot_archive")
+                await ctx.send(f"snapshot archiving is {status}. snapshots older than {ARCHIVE_AFTER_DAYS} days move to compressed column files "
+                               f"({row[0]:,} segments, {row[1]:,} snapshots, {row[2] / 1024:,.1f} KiB).\nuse `<p>analytics archive on|off|now`.")
+
+        elif cmd == "runs":
+            if subcmd in ["on", "off"]:
+                updateConfigData(RUN_LENGTH_CONFIG_KEY, subcmd == "on")
+                await ctx.send(f"run-length snapshots {'enabled' if subcmd == 'on' else 'disabled'}." + (" use `<p>analytics runs now` to collapse existing history." if subcmd == "on" else ""))
+            elif subcmd == "now":
+                msg = await ctx.send("collapsing unchanged snapshots into runs...")
+                removed = await collapse_snapshot_runs()
+                if removed:
+                    await run_db(reclaim_free_pages)
+                await msg.edit(content=f"run collapse complete: {removed:,} identical snapshots merged into the runs they repeat.")
+            else:
+                status = "enabled" if is_run_length_enabled() else "disabled"
+                row = await db_fetchone("SELECT COUNT(*), COALESCE(SUM(sample_count), 0) FROM snapshots WHERE valid_to_ms IS NOT NULL")
+                await ctx.send(f"run-length snapshots are {status}. a snapshot identical to the previous one extends it instead of adding a row "
+                               f"({row[0]:,} runs standing for {row[1]:,} snapshots).\nuse `<p>analytics runs on|off|now`.")
+
+        elif cmd == "vacuum":
+            if subcmd == "now":
+                msg = await ctx.send("running a full VACUUM, analytics writes wait until it finishes...")
+                switched = await run_db(enable_incremental_vacuum)
+                await msg.edit(content="vacuum complete: freed space is now returned to disk after pruning." if switched else "the database already uses incremental vacuum, nothing to do.")
+            else:
+                mode, size = await run_db(lambda conn: (conn.execute("PRAGMA auto_vacuum").fetchone()[0], os.path.getsize(DB_PATH)))
+                if mode == 2:
+                    await ctx.send("the database uses incremental vacuum: pruning, compaction and archiving return freed space to disk.")
+                else:
+                    await ctx.send(f"the database does not use incremental vacuum, so space freed by pruning is reused but never returned to disk.\n"
+                                   f"`<p>analytics vacuum now` switches it over with one full VACUUM: it rewrites the whole {size / 1024 / 1024:,.1f} MiB file, "
+                                   f"needs as much free disk space again and blocks analytics writes until it finishes.")
+
+        elif cmd == "partition":
+            if subcmd == "on" or subcmd == "now":
+                updateConfigData(PARTITION_CONFIG_KEY, True)
+                msg = await ctx.send("moving closed months of snapshots into monthly partitions...")
+                moved = await seal_partitions()
+                await msg.edit(content=f"snapshot partitioning enabled: {moved:,} snapshots moved into monthly partitions.")
+            elif subcmd == "off":
+                updateConfigData(PARTITION_CONFIG_KEY, False)
+                msg = await ctx.send("merging monthly partitions back into the snapshots table...")
+                merged = await run_db(merge_partitions)
+                if merged:
+                    await run_db(reclaim_free_pages)
+                await msg.edit(content=f"snapshot partitioning disabled: {merged} partitions merged back.")
+            else:
+                status = "enabled" if is_partitioning_enabled() else "disabled"
+                names = await run_db(lambda conn: sorted({name for schema in shard_schemas(conn) or ["main"] for name in partition_names(conn, schema)}))
+                months = f"{names[0][-6:-2]}-{names[0][-2:]} to {names[-1][-6:-2]}-{names[-1][-2:]}" if names else "none yet"
+                await ctx.send(f"snapshot partitioning is {status}. closed months move into monthly tables and retention drops them whole "
+                               f"({len(names)} months: {months}).\nuse `<p>analytics partition on|off|now`.")
 
         elif cmd == "interval":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             if subcmd:
                 try:
                     hours = float(subcmd)
-                    c.execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot_interval_hours) VALUES (?, ?)", (str(ctx.guild.id), hours))
-                    conn.commit()
+                    await db_execute("INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot_interval_hours) VALUES (?, ?)", (ctx.guild.id, hours))
                     await ctx.send(f"automatic snapshot interval set to {hours} hours")
                 except ValueError:
                     await ctx.send("invalid subcommand. use `<p>analytics help` for a list of commands.")
             else:
-                c.execute("SELECT auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (str(ctx.guild.id),))
-                row = c.fetchone()
+                row = await db_fetchone("SELECT auto_snapshot_interval_hours FROM server_config WHERE guild_id = ?", (ctx.guild.id,))
                 current = row[0] if row and row[0] is not None else DEFAULT_AUTO_SNAPSHOT_INTERVAL_HOURS
                 await ctx.send(f"automatic snapshot interval is {current} hours")
-            conn.close()
         
         # --- TIMEZONE SUBCOMMAND HANDLING ---
         elif cmd == "timezone":
@@ -1032,25 +1194,18 @@ format: csv (comma-separated values)
             if zone not in TIMEZONE_OFFSETS:
                 await ctx.send(f"invalid timezone. supported: {', '.join(TIMEZONE_OFFSETS.keys())}")
                 return
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            c.execute("INSERT OR REPLACE INTO server_config (guild_id, timezone) VALUES (?, ?)", (str(ctx.guild.id), zone))
-            conn.commit()
-            conn.close()
+            await db_execute("INSERT OR REPLACE INTO server_config (guild_id, timezone) VALUES (?, ?)", (ctx.guild.id, zone))
             await ctx.send(f"timezone set to `{zone}`. all times will now display in this timezone.")
 
         elif cmd == "demographics":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
             if not subcmd:
                 # Show summary for current server
-                c.execute("SELECT name, account_created, joined_at FROM demographics WHERE guild_id = ?", (str(ctx.guild.id),))
-                members = [dict(name=row[0], account_created=row[1], joined_at=row[2]) for row in c.fetchall()]
+                rows = await db_fetchall("SELECT name, account_created, joined_at FROM demographics WHERE guild_id = ?", (ctx.guild.id,), guild_id=ctx.guild.id)
+                members = [dict(name=row[0], account_created=row[1], joined_at=row[2]) for row in rows]
                 print(f"[DEBUG] Read {len(members)} members from SQL for guild {ctx.guild.id}", type_="INFO")
                 if not members:
                     msg = await ctx.send("no demographics data found. fetching all members for initial demographics...")
                     try:
-                        fetched = 0
                         # Try to find an accessible text channel
                         text_channel = None
                         for ch in ctx.guild.channels:
@@ -1059,25 +1214,18 @@ format: csv (comma-separated values)
                                 break
                         if not text_channel:
                             await msg.edit(content="No accessible text channel found. Please specify a channel ID with `<p>analytics demographics fetch <channel_id>`.")
-                            conn.close()
                             return
                         members_list = await text_channel.guild.fetch_members()
                         print(f"[DEBUG] fetch_members() returned {len(members_list)} members", type_="INFO")
-                        for member in members_list:
-                            c.execute("INSERT OR REPLACE INTO demographics (guild_id, member_id, name, account_created, joined_at, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (
-                                str(ctx.guild.id), str(member.id), str(member), member.created_at.isoformat() if member.created_at else None, member.joined_at.isoformat() if member.joined_at else None, datetime.now(timezone.utc).isoformat()
-                            ))
-                            fetched += 1
-                        conn.commit()
-                        print(f"[DEBUG] Inserted {fetched} members into SQL for guild {ctx.guild.id}", type_="INFO")
+                        written, fetched = await run_db(ingest_members, ctx.guild.id, members_list, ctx.guild.member_count, guild_id=ctx.guild.id)
+                        print(f"[DEBUG] Upserted {fetched} members ({written} new or changed) into SQL for guild {ctx.guild.id}", type_="INFO")
                         await msg.edit(content=f"initial demographics data populated/updated for {fetched} members. showing summary...")
-                        c.execute("SELECT name, account_created, joined_at FROM demographics WHERE guild_id = ?", (str(ctx.guild.id),))
-                        members = [dict(name=row[0], account_created=row[1], joined_at=row[2]) for row in c.fetchall()]
+                        rows = await db_fetchall("SELECT name, account_created, joined_at FROM demographics WHERE guild_id = ?", (ctx.guild.id,), guild_id=ctx.guild.id)
+                        members = [dict(name=row[0], account_created=row[1], joined_at=row[2]) for row in rows]
                         print(f"[DEBUG] After insert, {len(members)} members in SQL for guild {ctx.guild.id}", type_="INFO")
                     except Exception as e:
                         print(f"[DEBUG] Exception during demographics fetch/insert: {e}", type_="ERROR")
                         await msg.edit(content=f"Failed to fetch members: {e}\nIf this is a channel error, try `<p>analytics demographics fetch <channel_id>`.")
-                        conn.close()
                         return
                 if members:
                     oldest_acc = min(members, key=lambda m: m["account_created"] or "9999")
@@ -1088,19 +1236,16 @@ format: csv (comma-separated values)
                     await ctx.send(msg)
                 else:
                     print(f"[DEBUG] No members found in SQL after fetch/insert for guild {ctx.guild.id}", type_="ERROR")
-                conn.close()
             elif subcmd == "fetch":
                 # Optionally allow a channel ID: <p>analytics demographics fetch <channel_id>
                 channel_id = subarg.strip() if subarg else None
                 msg = await ctx.send("fetching all members for demographics...")
                 try:
-                    fetched = 0
                     text_channel = None
                     if channel_id:
                         text_channel = ctx.guild.get_channel(int(channel_id))
                         if not text_channel or str(text_channel.type).lower() != "text" or not text_channel.permissions_for(ctx.guild.me).read_messages:
                             await msg.edit(content="Invalid or inaccessible channel ID. Please specify a valid text channel ID.")
-                            conn.close()
                             return
                     else:
                         for ch in ctx.guild.channels:
@@ -1109,126 +1254,117 @@ format: csv (comma-separated values)
                                 break
                     if not text_channel:
                         await msg.edit(content="No accessible text channel found. Please specify a channel ID with `<p>analytics demographics fetch <channel_id>`.")
-                        conn.close()
                         return
                     members_list = await text_channel.guild.fetch_members()
-                    for member in members_list:
-                        c.execute("INSERT OR REPLACE INTO demographics (guild_id, member_id, name, account_created, joined_at, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (
-                            str(ctx.guild.id), str(member.id), str(member), member.created_at.isoformat() if member.created_at else None, member.joined_at.isoformat() if member.joined_at else None, datetime.now(timezone.utc).isoformat()
-                        ))
-                        fetched += 1
-                    conn.commit()
-                    c.execute("SELECT COUNT(*) FROM demographics WHERE guild_id = ?", (str(ctx.guild.id),))
-                    total = c.fetchone()[0]
-                    await msg.edit(content=f"Fetched/updated demographics for {fetched} members. Total tracked: {total}.")
+                    written, fetched = await run_db(ingest_members, ctx.guild.id, members_list, ctx.guild.member_count, guild_id=ctx.guild.id)
+                    total = (await db_fetchone("SELECT COUNT(*) FROM demographics WHERE guild_id = ?", (ctx.guild.id,), guild_id=ctx.guild.id))[0]
+                    await msg.edit(content=f"Fetched demographics for {fetched} members ({written} new or changed). Total tracked: {total}.")
                 except Exception as e:
                     await msg.edit(content=f"Failed to fetch members: {e}\nIf this is a channel error, try `<p>analytics demographics fetch <channel_id>`.")
-                conn.close()
             elif subcmd == "list":
-                c.execute("SELECT guild_id FROM demographics_servers")
-                servers = [row[0] for row in c.fetchall()]
+                servers = [row[0] for row in await db_fetchall("SELECT guild_id FROM demographics_servers")]
                 if not servers:
                     await ctx.send("no servers are currently tracked for demographics.")
                 else:
-                    await ctx.send("tracked servers:\n" + "\n".join(servers))
-                conn.close()
+                    await ctx.send("tracked servers:\n" + "\n".join(str(server) for server in servers))
             elif subcmd == "remove" and subarg:
                 server_id = subarg.strip()
-                c.execute("DELETE FROM demographics_servers WHERE guild_id = ?", (server_id,))
-                conn.commit()
+                if not server_id.isdigit():
+                    await ctx.send("usage: <p>analytics demographics remove <server_id>")
+                    return
+                await db_execute("DELETE FROM demographics_servers WHERE guild_id = ?", (int(server_id),))
                 await ctx.send(f"server `{server_id}` removed from demographics tracking.")
-                conn.close()
             else:
                 await ctx.send("usage: <p>analytics demographics [fetch|list|remove <server_id>]")
 
         elif cmd == "migrate":
             os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+            if os.path.isfile(DB_PATH) and await run_db(shard_paths):
+                await ctx.send("the database is sharded; run `<p>analytics shard off` before importing JSON data.")
+                return
             msg = await ctx.send("starting migration to sqlite db...")
             try:
-                create_schema()
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                # --- Ensure 'timestamp' column exists in demographics (legacy DBs) ---
-                c.execute("PRAGMA table_info(demographics)")
-                demo_columns = [row[1] for row in c.fetchall()]
-                if 'timestamp' not in demo_columns:
-                    try:
-                        c.execute('ALTER TABLE demographics ADD COLUMN timestamp TEXT')
-                        script_log("Added missing 'timestamp' column to demographics table during migration.", level="INFO")
-                    except Exception as e:
-                        script_log(f"Could not add 'timestamp' column to demographics: {e}", level="ERROR", exc_info=True)
-                # --- Snapshots Migration ---
-                snap_path = os.path.join(server_dir, "member_snapshots.json")
-                if os.path.isfile(snap_path):
-                    try:
-                        with open(snap_path, "r", encoding="utf-8") as f:
-                            data = json.load(f).get("snapshots", [])
-                            migration_stats[server_id]['total'] += len(data)
-                            for i, snap in enumerate(data):
-                                try:
-                                    c.execute("""
-                                        INSERT INTO snapshots (guild_id, guild_name, timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto)
-                                        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                                    """, (
-                                        server_id, snap.get("name"), snap.get("timestamp"), snap.get("member_count"),
-                                        snap.get("channel_count"), snap.get("text_channels"), snap.get("voice_channels"),
-                                        snap.get("categories"), snap.get("role_count"), snap.get("bots"),
-                                        snap.get("boosters", 0), int(snap.get("is_auto", False))
-                                    ))
-                                    migration_stats[server_id]['success'] += 1
-                                except Exception as e:
-                                    migration_stats[server_id]['skipped'] += 1
-                                    err_msg = f"Skipping malformed snapshot record #{i+1} for server {server_id}: {e}"
-                                    migration_stats[server_id]['errors'].append(err_msg)
-                                    script_log(err_msg, level="ERROR", exc_info=True)
-                    except json.JSONDecodeError as e:
-                        err_msg = f"Could not parse snapshots JSON for server {server_id}: {e}"
-                        migration_stats[server_id]['errors'].append(err_msg)
-                        script_log(err_msg, level="ERROR", exc_info=True)
-
-                # --- Demographics Migration ---
-                demo_path = os.path.join(server_dir, "member_demographics.json")
-                if os.path.isfile(demo_path):
-                    try:
-                        with open(demo_path, "r", encoding="utf-8") as f:
-                            demo_data = json.load(f)
-                            for member_id, info in demo_data.items():
-                                try:
-                                    c.execute("INSERT OR REPLACE INTO demographics (guild_id, member_id, name, account_created, joined_at, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (server_id, member_id, info.get("name"), info.get("account_created"), info.get("joined_at"), info.get("timestamp") or info.get("joined_at") or info.get("account_created") or datetime.now(timezone.utc).isoformat()))
-                                except Exception as e:
-                                    script_log(f"Skipping malformed demographics record for member {member_id} in server {server_id}: {e}", level="ERROR", exc_info=True)
-                    except json.JSONDecodeError as e:
-                        script_log(f"Could not parse demographics JSON for server {server_id}: {e}", level="ERROR", exc_info=True)
-
-                # --- Config Migration ---
-                config_path = os.path.join(server_dir, "analytics_config.json")
-                if os.path.isfile(config_path):
-                    try:
-                        with open(config_path, "r", encoding="utf-8") as f:
-                            config = json.load(f)
-                        c.execute("""
-                            INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot, last_auto_snapshot, first_snapshot_date, chart_style, snapshot_retention_days, auto_snapshot_interval_hours)
-                            VALUES (?, ?, ?, ?, ?, ?, ?)
-                        """, (
-                            server_id, int(config.get("auto_snapshot", 0)), config.get("last_auto_snapshot"),
-                            config.get("first_snapshot_date"), config.get("chart_style"), config.get("snapshot_retention_days"),
-                            config.get("auto_snapshot_interval_hours")
-                        ))
-                    except Exception as e:
-                        script_log(f"Could not migrate config for server {server_id}: {e}", level="ERROR", exc_info=True)
+                def import_json_data(conn):
+                    """Copy the legacy JSON files into the DB (DB thread)"""
+                    c = conn.cursor()
+                    # --- Snapshots Migration ---
+                    snap_path = os.path.join(server_dir, "member_snapshots.json")
+                    if os.path.isfile(snap_path):
+                        try:
+                            with open(snap_path, "r", encoding="utf-8") as f:
+                                data = json.load(f).get("snapshots", [])
+                                migration_stats[server_id]['total'] += len(data)
+                                for i, snap in enumerate(data):
+                                    try:
+                                        c.execute("""
+                                            INSERT INTO main.snapshots (guild_id, guild_name, timestamp, timestamp_ms, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots, boosters, is_auto)
+                                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                                        """, (
+                                            server_id, snap.get("name"), snap.get("timestamp"), iso_to_epoch_ms(snap.get("timestamp")), snap.get("member_count"),
+                                            snap.get("channel_count"), snap.get("text_channels"), snap.get("voice_channels"),
+                                            snap.get("categories"), snap.get("role_count"), snap.get("bots"),
+                                            snap.get("boosters", 0), int(snap.get("is_auto", False))
+                                        ))
+                                        migration_stats[server_id]['success'] += 1
+                                    except Exception as e:
+                                        migration_stats[server_id]['skipped'] += 1
+                                        err_msg = f"Skipping malformed snapshot record #{i+1} for server {server_id}: {e}"
+                                        migration_stats[server_id]['errors'].append(err_msg)
+                                        script_log(err_msg, level="ERROR", exc_info=True)
+                        except json.JSONDecodeError as e:
+                            err_msg = f"Could not parse snapshots JSON for server {server_id}: {e}"
+                            migration_stats[server_id]['errors'].append(err_msg)
+                            script_log(err_msg, level="ERROR", exc_info=True)
+
+                    # --- Demographics Migration ---
+                    demo_path = os.path.join(server_dir, "member_demographics.json")
+                    if os.path.isfile(demo_path):
+                        try:
+                            with open(demo_path, "r", encoding="utf-8") as f:
+                                demo_data = json.load(f)
+                                for member_id, info in demo_data.items():
+                                    try:
+                                        seen = info.get("timestamp") or info.get("joined_at") or info.get("account_created") or datetime.now(timezone.utc).isoformat()
+                                        seen_ms = iso_to_epoch_ms(seen)
+                                        c.execute("INSERT INTO demographics (guild_id, member_id, name, joined_at, timestamp, joined_at_ms, timestamp_ms, first_seen_ms, last_seen_ms) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                                                  "ON CONFLICT (guild_id, member_id) DO UPDATE SET name = excluded.name, joined_at = excluded.joined_at, timestamp = excluded.timestamp, "
+                                                  "joined_at_ms = excluded.joined_at_ms, timestamp_ms = excluded.timestamp_ms, last_seen_ms = excluded.last_seen_ms", (server_id, member_id, info.get("name"), info.get("joined_at"), seen, iso_to_epoch_ms(info.get("joined_at")), seen_ms, seen_ms, seen_ms))
+                                    except Exception as e:
+                                        script_log(f"Skipping malformed demographics record for member {member_id} in server {server_id}: {e}", level="ERROR", exc_info=True)
+                        except json.JSONDecodeError as e:
+                            script_log(f"Could not parse demographics JSON for server {server_id}: {e}", level="ERROR", exc_info=True)
+
+                    # --- Config Migration ---
+                    config_path = os.path.join(server_dir, "analytics_config.json")
+                    if os.path.isfile(config_path):
+                        try:
+                            with open(config_path, "r", encoding="utf-8") as f:
+                                config = json.load(f)
+                            c.execute("""
+                                INSERT OR REPLACE INTO server_config (guild_id, auto_snapshot, last_auto_snapshot, first_snapshot_date, chart_style, snapshot_retention_days, auto_snapshot_interval_hours)
+                                VALUES (?, ?, ?, ?, ?, ?, ?)
+                            """, (
+                                server_id, int(config.get("auto_snapshot", 0)), config.get("last_auto_snapshot"),
+                                config.get("first_snapshot_date"), config.get("chart_style"), config.get("snapshot_retention_days"),
+                                config.get("auto_snapshot_interval_hours")
+                            ))
+                        except Exception as e:
+                            script_log(f"Could not migrate config for server {server_id}: {e}", level="ERROR", exc_info=True)
 
-                # --- Demographics Servers List Migration ---
-                if os.path.isfile(DEMO_SERVERS_FILE):
-                    try:
-                        with open(DEMO_SERVERS_FILE, "r", encoding="utf-8") as f:
-                            servers = json.load(f)
-                        for sid in servers:
-                            c.execute("INSERT OR IGNORE INTO demographics_servers (guild_id) VALUES (?)", (sid,))
-                    except Exception as e:
-                        script_log(f"Error migrating demographics_servers.json: {e}", level="ERROR", exc_info=True)
+                    # --- Demographics Servers List Migration ---
+                    if os.path.isfile(DEMO_SERVERS_FILE):
+                        try:
+                            with open(DEMO_SERVERS_FILE, "r", encoding="utf-8") as f:
+                                servers = json.load(f)
+                            for sid in servers:
+                                c.execute("INSERT OR IGNORE INTO demographics_servers (guild_id) VALUES (?)", (sid,))
+                        except Exception as e:
+                            script_log(f"Error migrating demographics_servers.json: {e}", level="ERROR", exc_info=True)
 
-                conn.commit()
-                conn.close()
+                    # --- Guilds Dimension ---
+                    rebuild_guilds(conn)
+
+                await run_db(import_json_data)
                 set_db_migrated()
 
                 # --- Build Final Summary Report ---
@@ -1255,27 +1391,14 @@ format: csv (comma-separated values)
                 script_log("Migration failed critically.", level="ERROR", exc_info=True)
 
         elif cmd == "dbstats":
-            conn = sqlite3.connect(DB_PATH)
-            c = conn.cursor()
-            # Per-guild stats
-            c.execute("SELECT COUNT(*) FROM snapshots WHERE guild_id = ?", (str(ctx.guild.id),))
-            snap_count = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM demographics WHERE guild_id = ?", (str(ctx.guild.id),))
-            demo_count = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM server_config WHERE guild_id = ?", (str(ctx.guild.id),))
-            config_count = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM demographics_servers WHERE guild_id = ?", (str(ctx.guild.id),))
-            demo_servers_count = c.fetchone()[0]
-            # Global stats
-            c.execute("SELECT COUNT(*) FROM snapshots")
-            snap_count_all = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM demographics")
-            demo_count_all = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM server_config")
-            config_count_all = c.fetchone()[0]
-            c.execute("SELECT COUNT(*) FROM demographics_servers")
-            demo_servers_count_all = c.fetchone()[0]
-            conn.close()
+            def read_db_stats(conn):
+                """Per-guild then global row counts for each table (DB thread)"""
+                tables = ("snapshots", "demographics", "server_config", "demographics_servers")
+                per_guild = [conn.execute(f"SELECT COUNT(*) FROM {table} WHERE guild_id = ?", (ctx.guild.id,)).fetchone()[0] for table in tables]
+                global_counts = [conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table in tables]
+                return per_guild + global_counts
+            (snap_count, demo_count, config_count, demo_servers_count,
+             snap_count_all, demo_count_all, config_count_all, demo_servers_count_all) = await run_db(read_db_stats)
             msg = f"""**Database Statistics**
 
 __Current Guild__
@@ -1305,26 +1428,19 @@ __Global__
         elif cmd == "holylogger":
             msg = await ctx.send("starting holylogger - scanning all servers for unmonitored ones...")
             try:
-                # Ensure database schema exists
-                create_schema()
-                
                 # Get all servers the bot is in
                 all_guilds = list(bot.guilds)
                 print(f"[HOLYLOGGER] Found {len(all_guilds)} total servers", type_="INFO")
                 
                 # Get currently monitored servers from database
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                c.execute("SELECT DISTINCT guild_id FROM snapshots")
-                monitored_guilds = {row[0] for row in c.fetchall()}
-                conn.close()
+                monitored_guilds = {row[0] for row in await db_fetchall("SELECT guild_id FROM guilds")}
                 
                 print(f"[HOLYLOGGER] Currently monitoring {len(monitored_guilds)} servers", type_="INFO")
                 
                 # Find unmonitored servers
                 unmonitored_guilds = []
                 for guild in all_guilds:
-                    if str(guild.id) not in monitored_guilds:
+                    if guild.id not in monitored_guilds:
                         unmonitored_guilds.append(guild)
                 
                 print(f"[HOLYLOGGER] Found {len(unmonitored_guilds)} unmonitored servers", type_="INFO")
@@ -1340,10 +1456,10 @@ __Global__
                 processed_guild_ids = set()
                 await msg.edit(content=f"Found {len(unmonitored_guilds)} unmonitored servers. Starting processing with 10-second intervals...")
                 for i, guild in enumerate(unmonitored_guilds, 1):
-                    if str(guild.id) in processed_guild_ids:
+                    if guild.id in processed_guild_ids:
                         print(f"[HOLYLOGGER] Skipping duplicate server {guild.name} (ID: {guild.id})", type_="WARNING")
                         continue
-                    processed_guild_ids.add(str(guild.id))
+                    processed_guild_ids.add(guild.id)
                     try:
                         print(f"[HOLYLOGGER] Processing server {i}/{len(unmonitored_guilds)}: {guild.name} (ID: {guild.id})", type_="INFO")
                         # Take snapshot
@@ -1357,23 +1473,9 @@ __Global__
                             members_list = await guild.fetch_members()
                             print(f"[HOLYLOGGER] Fetched {len(members_list)} members from {guild.name}", type_="INFO")
                             # Insert members into demographics table
-                            conn = sqlite3.connect(DB_PATH)
-                            c = conn.cursor()
-                            fetched_count = 0
-                            for member in members_list:
-                                c.execute("INSERT OR REPLACE INTO demographics (guild_id, member_id, name, account_created, joined_at, timestamp) VALUES (?, ?, ?, ?, ?, ?)", (
-                                    str(guild.id), 
-                                    str(member.id), 
-                                    str(member), 
-                                    member.created_at.isoformat() if member.created_at else None, 
-                                    member.joined_at.isoformat() if member.joined_at else None,
-                                    datetime.now(timezone.utc).isoformat()
-                                ))
-                                fetched_count += 1
-                            conn.commit()
-                            conn.close()
+                            written, fetched_count = await run_db(ingest_members, guild.id, members_list, guild.member_count, guild_id=guild.id)
                             total_members_fetched += fetched_count
-                            print(f"[HOLYLOGGER] Inserted {fetched_count} members into database for {guild.name}", type_="INFO")
+                            print(f"[HOLYLOGGER] Upserted {fetched_count} members ({written} new or changed) for {guild.name}", type_="INFO")
                         except Exception as member_error:
                             print(f"[HOLYLOGGER] Failed to fetch members for {guild.name}: {member_error}", type_="ERROR")
                         processed_count += 1
@@ -1472,25 +1574,27 @@ To proceed, type:
                 return
             msg = await ctx.send("wiping analytics database and all related files...")
             try:
-                # Ensure all SQLite connections are closed before deleting the DB file
-                db_path = os.path.join(getScriptsPath(), "json", "analytics_test.db")
-                try:
-                    sqlite3.connect(db_path).close()
-                except Exception:
-                    pass
-                # Remove the SQLite DB file
-                if os.path.isfile(db_path):
-                    os.remove(db_path)
-                # Remove server_member_tracking directory
-                tracking_dir = os.path.join(getScriptsPath(), "json", "server_member_tracking")
-                if os.path.isdir(tracking_dir):
-                    shutil.rmtree(tracking_dir)
-                # Remove demographics_servers.json
-                demo_servers_file = os.path.join(getScriptsPath(), "json", "demographics_servers.json")
-                if os.path.isfile(demo_servers_file):
-                    os.remove(demo_servers_file)
-                # Recreate empty DB
-                create_schema()
+                def wipe_database():
+                    """Delete the DB and JSON files and recreate an empty DB (DB thread, so no query is mid-flight)"""
+                    db_path = os.path.join(getScriptsPath(), "json", "analytics_test.db")
+                    # Remove the SQLite DB file
+                    if os.path.isfile(db_path):
+                        os.remove(db_path)
+                    # Remove server_member_tracking directory
+                    tracking_dir = os.path.join(getScriptsPath(), "json", "server_member_tracking")
+                    if os.path.isdir(tracking_dir):
+                        shutil.rmtree(tracking_dir)
+                    # Remove the snapshot archive segments and shard files
+                    for data_dir in (ARCHIVE_DIR, SHARD_DIR):
+                        if os.path.isdir(data_dir):
+                            shutil.rmtree(data_dir)
+                    # Remove demographics_servers.json
+                    demo_servers_file = os.path.join(getScriptsPath(), "json", "demographics_servers.json")
+                    if os.path.isfile(demo_servers_file):
+                        os.remove(demo_servers_file)
+                    # Recreate empty DB
+                    ensure_schema(force=True)
+                await run_in_db_thread(wipe_database)
                 await msg.edit(content="Analytics database and all related files have been wiped. The system is now reset. You may need to refresh the dashboard UI.")
             except Exception as e:
                 await msg.edit(content=f"Failed to reset database: {e}")
@@ -1503,11 +1607,7 @@ To proceed, type:
         await ctx.send(f"comparing current period with {days} days ago...")
         
         # Fetch snapshots from the database
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        c.execute("SELECT timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots FROM snapshots WHERE guild_id = ? ORDER BY timestamp ASC", (str(ctx.guild.id),))
-        rows = c.fetchall()
-        conn.close()
+        rows = await db_fetchall("SELECT timestamp, member_count, channel_count, text_channels, voice_channels, categories, role_count, bots FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms ASC", (ctx.guild.id,), guild_id=ctx.guild.id)
 
         snapshots = [
             {
@@ -1665,63 +1765,1501 @@ format: csv (comma-separated values)
     DB_PATH = os.path.join(getScriptsPath(), "json", "analytics_test.db")
     TEST_DATA_DIR = os.path.join(getScriptsPath(), "json", "server_member_tracking")
     DEMO_SERVERS_FILE = os.path.join(getScriptsPath(), "json", "demographics_servers.json")
+    ARCHIVE_DIR = os.path.join(getScriptsPath(), "json", "analytics_archive")
+    SHARD_DIR = os.path.join(getScriptsPath(), "json", "analytics_shards")
+
+    # Secondary indexes created by schema v3 (name, table, columns)
+    SCHEMA_INDEXES = [
+        ("idx_snapshots_guild_ts_ms", "snapshots", "guild_id, timestamp_ms"),
+        ("idx_snapshots_ts_ms", "snapshots", "timestamp_ms"),
+        ("idx_demographics_member", "demographics", "member_id"),
+        ("idx_demographics_guild_joined_ms", "demographics", "guild_id, joined_at_ms"),
+        ("idx_demographics_guild_created_ms", "demographics", "guild_id, account_created_ms"),
+        ("idx_demographics_ts_ms", "demographics", "timestamp_ms"),
+    ]
+    # Indexes superseded by the epoch-ms columns
+    OBSOLETE_INDEXES = [
+        "idx_snapshots_guild_ts",
+        "idx_snapshots_ts",
+        "idx_demographics_guild_joined",
+        "idx_demographics_guild_created",
+    ]
+
+    # Integer epoch-millisecond companions of the ISO text columns: {table: [(ms_column, iso_column), ...]}
+    EPOCH_MS_COLUMNS = {
+        "snapshots": [("timestamp_ms", "timestamp")],
+        "demographics": [
+            ("timestamp_ms", "timestamp"),
+            ("joined_at_ms", "joined_at"),
+            ("account_created_ms", "account_created"),
+        ],
+    }
+    EPOCH_BACKFILL_CHUNK = 5000
+    # Discord snowflake columns, stored as INTEGER since schema v4
+    SNOWFLAKE_COLUMNS = ("guild_id", "member_id")
+    UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    # A snowflake's top 42 bits are its creation time in ms since the Discord epoch, so creation-time
+    # ranges are id ranges: compare member_id against snowflake_floor(ms) to use the primary key.
+    DISCORD_EPOCH_MS = 1420070400000
+    SNOWFLAKE_MS_SQL = "(({} >> 22) + 1420070400000)"
+
+    def snowflake_floor(ms):
+        """Smallest snowflake created at or after epoch ms"""
+        return max(ms - DISCORD_EPOCH_MS, 0) << 22
+
+    def to_epoch_ms(dt):
+        """Convert a datetime to integer epoch milliseconds (naive datetimes are treated as UTC)"""
+        if dt is None:
+            return None
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=timezone.utc)
+        return (dt - UNIX_EPOCH) // timedelta(milliseconds=1)
+
+    def iso_to_epoch_ms(value):
+        """Parse an ISO timestamp string (any offset, 'Z' or naive) into epoch milliseconds, or None"""
+        if not value:
+            return None
+        try:
+            return to_epoch_ms(datetime.fromisoformat(str(value).replace("Z", "+00:00")))
+        except ValueError:
+            return None
 
-    def create_schema():
+    def backfill_epoch_columns(conn, chunk_size=EPOCH_BACKFILL_CHUNK):
+        """
+        Fill NULL epoch-ms columns from their ISO text columns in rowid-ordered chunks,
+        committing after each chunk so the write lock is never held for long.
+        julianday() understands every offset format we have written, so the conversion stays in SQL.
+        """
+        c = conn.cursor()
+        for table, pairs in EPOCH_MS_COLUMNS.items():
+            driver_ms, driver_iso = pairs[0]
+            # Columns generated from the row since v14 need no backfill
+            generated = {row[1] for row in conn.execute(f"PRAGMA table_xinfo({table})") if row[6]}
+            assignments = ", ".join(
+                f"{ms_col} = CAST(ROUND((julianday({iso_col}) - 2440587.5) * 86400000) AS INTEGER)"
+                for ms_col, iso_col in pairs if ms_col not in generated
+            )
+            last_rowid = 0
+            while True:
+                c.execute(
+                    f"SELECT rowid FROM {table} WHERE {driver_ms} IS NULL AND {driver_iso} IS NOT NULL AND rowid > ? ORDER BY rowid LIMIT ?",
+                    (last_rowid, chunk_size),
+                )
+                rowids = [row[0] for row in c.fetchall()]
+                if not rowids:
+                    break
+                c.execute(
+                    f"UPDATE {table} SET {assignments} WHERE rowid BETWEEN ? AND ? AND {driver_ms} IS NULL",
+                    (rowids[0], rowids[-1]),
+                )
+                conn.commit()
+                last_rowid = rowids[-1]
+
+    def add_missing_columns(conn, table, columns):
+        """Add any of the (name, declaration) columns that a legacy table is missing"""
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for name, declaration in columns:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+
+    # Column set of the original (version 1) tables: {table: ([(column, declaration), ...], table_constraint)}
+    BASE_TABLES = {
+        "snapshots": ([
+            ("id", "INTEGER PRIMARY KEY AUTOINCREMENT"),
+            ("guild_id", "TEXT"),
+            ("guild_name", "TEXT"),
+            ("timestamp", "TEXT"),
+            ("member_count", "INTEGER"),
+            ("channel_count", "INTEGER"),
+            ("text_channels", "INTEGER"),
+            ("voice_channels", "INTEGER"),
+            ("categories", "INTEGER"),
+            ("role_count", "INTEGER"),
+            ("bots", "INTEGER"),
+            ("boosters", "INTEGER DEFAULT 0"),
+            ("is_auto", "INTEGER"),
+        ], None),
+        "demographics": ([
+            ("guild_id", "TEXT"),
+            ("member_id", "TEXT"),
+            ("name", "TEXT"),
+            ("account_created", "TEXT"),
+            ("joined_at", "TEXT"),
+            ("timestamp", "TEXT"),
+        ], "PRIMARY KEY (guild_id, member_id)"),
+        "server_config": ([
+            ("guild_id", "TEXT PRIMARY KEY"),
+            ("guild_name", "TEXT"),
+            ("auto_snapshot", "INTEGER DEFAULT 0"),
+            ("last_auto_snapshot", "TEXT"),
+            ("first_snapshot_date", "TEXT"),
+            ("chart_style", "TEXT DEFAULT 'emoji'"),
+            ("snapshot_retention_days", "INTEGER DEFAULT 90"),
+            ("auto_snapshot_interval_hours", "REAL DEFAULT 20"),
+            ("last_snapshot", "TEXT"),
+        ], None),
+        "demographics_servers": ([
+            ("guild_id", "TEXT PRIMARY KEY"),
+        ], None),
+    }
+
+    def migrate_base_tables(conn):
+        """v1: original tables, plus columns older script versions did not create"""
+        for table, (columns, constraint) in BASE_TABLES.items():
+            definitions = [f"{name} {declaration}" for name, declaration in columns]
+            if constraint:
+                definitions.append(constraint)
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({', '.join(definitions)})")
+            add_missing_columns(conn, table, [(name, declaration) for name, declaration in columns if "PRIMARY KEY" not in declaration])
+
+    def migrate_epoch_ms_columns(conn):
+        """v2: integer epoch-ms companions of the ISO text columns (backfilled after migrating)"""
+        for table, pairs in EPOCH_MS_COLUMNS.items():
+            add_missing_columns(conn, table, [(ms_col, "INTEGER") for ms_col, _ in pairs])
+
+    def migrate_secondary_indexes(conn):
+        """v3: secondary indexes for the per-guild and time-range queries"""
+        for index_name in OBSOLETE_INDEXES:
+            conn.execute(f"DROP INDEX IF EXISTS {index_name}")
+        for index_name, table, columns in SCHEMA_INDEXES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+    def rebuild_table(conn, table, columns, constraint=None, where="1=1"):
+        """Recreate a table with new column declarations, copying the shared columns of rows matching where"""
+        old_columns = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        definitions = [f"{name} {declaration}" for name, declaration in columns]
+        if constraint:
+            definitions.append(constraint)
+        shared = ", ".join(name for name, _ in columns if name in old_columns)
+        conn.execute(f"CREATE TABLE {table}_rebuild ({', '.join(definitions)})")
+        conn.execute(f"INSERT INTO {table}_rebuild ({shared}) SELECT {shared} FROM {table} WHERE {where}")
+        conn.execute(f"DROP TABLE {table}")
+        conn.execute(f"ALTER TABLE {table}_rebuild RENAME TO {table}")
+
+    def migrate_integer_snowflakes(conn):
+        """
+        v4: guild_id/member_id become INTEGER columns. INTEGER affinity converts the stored decimal
+        strings on copy, and text parameters still compare correctly against the new columns.
+        """
+        for table, (columns, constraint) in BASE_TABLES.items():
+            columns = [
+                (name, declaration.replace("TEXT", "INTEGER", 1) if name in SNOWFLAKE_COLUMNS else declaration)
+                for name, declaration in columns
+            ]
+            columns += [(ms_col, "INTEGER") for ms_col, _ in EPOCH_MS_COLUMNS.get(table, [])]
+            # server_config/demographics_servers keys become rowid aliases, which reject non-numeric text
+            where = "guild_id NOT GLOB '*[^0-9]*' AND guild_id != ''" if table in ("server_config", "demographics_servers") else "1=1"
+            rebuild_table(conn, table, columns, constraint, where)
+        # Dropping the old tables dropped their indexes
+        migrate_secondary_indexes(conn)
+
+    # Demographics columns and index added by schema v5
+    SEEN_COLUMNS = [("first_seen_ms", "INTEGER"), ("last_seen_ms", "INTEGER")]
+    SEEN_INDEXES = [("idx_demographics_first_seen_ms", "demographics", "first_seen_ms")]
+
+    def migrate_seen_columns(conn):
+        """v5: first_seen_ms/last_seen_ms on demographics, seeded from the last fetch timestamp"""
+        add_missing_columns(conn, "demographics", SEEN_COLUMNS)
+        conn.execute(
+            "UPDATE demographics SET first_seen_ms = COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)), "
+            "last_seen_ms = COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER)) "
+            "WHERE first_seen_ms IS NULL"
+        )
+        for index_name, table, columns in SEEN_INDEXES:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({columns})")
+
+    # Snapshot columns added by schema v6 for tiered compaction. A compacted row is the last raw
+    # snapshot of its bucket (so member_count is the bucket's last value) plus the bucket's
+    # first/min/max member_count and how many raw snapshots it stands for.
+    ROLLUP_COLUMNS = [
+        ("rollup_level", "INTEGER DEFAULT 0"),  # 0 raw, 1 hourly, 2 daily
+        ("member_count_first", "INTEGER"),
+        ("member_count_min", "INTEGER"),
+        ("member_count_max", "INTEGER"),
+        ("sample_count", "INTEGER DEFAULT 1"),
+    ]
+
+    def migrate_rollup_columns(conn):
+        """v6: rollup columns on snapshots for tiered compaction"""
+        add_missing_columns(conn, "snapshots", ROLLUP_COLUMNS)
+
+    # Guild dimension added by schema v7: one row per guild with its current name, first/last snapshot
+    # time and latest counts (kept current by every snapshot insert), plus a change-only name history.
+    GUILD_TABLES = [
+        """CREATE TABLE IF NOT EXISTS guilds (
+            guild_id INTEGER PRIMARY KEY, name TEXT,
+            first_snapshot TEXT, first_snapshot_ms INTEGER, last_snapshot TEXT, last_snapshot_ms INTEGER,
+            member_count INTEGER, channel_count INTEGER, role_count INTEGER, bots INTEGER, boosters INTEGER)""",
+        """CREATE TABLE IF NOT EXISTS guild_name_history (
+            guild_id INTEGER, name TEXT, changed_at_ms INTEGER,
+            PRIMARY KEY (guild_id, changed_at_ms))""",
+    ]
+    SNAPSHOT_TS_MS_SQL = "COALESCE(timestamp_ms, CAST(ROUND((julianday(timestamp) - 2440587.5) * 86400000) AS INTEGER))"
+
+    def rebuild_guilds(conn):
+        """Recompute guilds and guild_name_history from the snapshots table"""
+        conn.execute("DELETE FROM guilds")
+        conn.execute("DELETE FROM guild_name_history")
+        conn.execute(f"""
+            INSERT INTO guilds (guild_id, first_snapshot_ms, last_snapshot_ms)
+            SELECT guild_id, MIN({SNAPSHOT_TS_MS_SQL}), MAX({SNAPSHOT_TS_MS_SQL})
+            FROM snapshots WHERE guild_id IS NOT NULL GROUP BY guild_id
+        """)
+        conn.execute(f"""
+            UPDATE guilds SET
+                first_snapshot = (SELECT timestamp FROM snapshots s WHERE s.guild_id = guilds.guild_id
+                                  ORDER BY {SNAPSHOT_TS_MS_SQL}, id LIMIT 1),
+                name = (SELECT guild_name FROM snapshots s WHERE s.guild_id = guilds.guild_id AND guild_name IS NOT NULL
+                        ORDER BY {SNAPSHOT_TS_MS_SQL} DESC, id DESC LIMIT 1),
+                (last_snapshot, member_count, channel_count, role_count, bots, boosters) = (
+                    SELECT timestamp, member_count, channel_count, role_count, bots, boosters FROM snapshots s
+                    WHERE s.guild_id = guilds.guild_id ORDER BY {SNAPSHOT_TS_MS_SQL} DESC, id DESC LIMIT 1)
+        """)
+        conn.execute(f"""
+            INSERT OR IGNORE INTO guild_name_history (guild_id, name, changed_at_ms)
+            SELECT guild_id, guild_name, ts_ms FROM (
+                SELECT guild_id, guild_name, {SNAPSHOT_TS_MS_SQL} AS ts_ms,
+                       LAG(guild_name) OVER (PARTITION BY guild_id ORDER BY {SNAPSHOT_TS_MS_SQL}, id) AS previous_name
+                FROM snapshots WHERE guild_id IS NOT NULL AND guild_name IS NOT NULL
+            ) WHERE previous_name IS NULL OR previous_name != guild_name
+        """)
+
+    def migrate_guild_tables(conn):
+        """v7: guilds dimension and guild_name_history, backfilled from snapshots"""
+        for statement in GUILD_TABLES:
+            conn.execute(statement)
+        rebuild_guilds(conn)
+
+    # Member name search index added by schema v8: an external-content FTS5 table with the trigram
+    # tokenizer (substring matching), kept in sync with demographics by triggers. Writers must not use
+    # INSERT OR REPLACE on demographics: REPLACE deletes do not fire the delete trigger.
+    NAME_SEARCH_OBJECTS = [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS demographics_fts USING fts5(name, content='demographics', content_rowid='rowid', tokenize='trigram')",
+        """CREATE TRIGGER IF NOT EXISTS demographics_fts_insert AFTER INSERT ON demographics BEGIN
+            INSERT INTO demographics_fts (rowid, name) VALUES (new.rowid, new.name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS demographics_fts_delete AFTER DELETE ON demographics BEGIN
+            INSERT INTO demographics_fts (demographics_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+        END""",
+        """CREATE TRIGGER IF NOT EXISTS demographics_fts_update AFTER UPDATE OF name ON demographics BEGIN
+            INSERT INTO demographics_fts (demographics_fts, rowid, name) VALUES ('delete', old.rowid, old.name);
+            INSERT INTO demographics_fts (rowid, name) VALUES (new.rowid, new.name);
+        END""",
+        "CREATE INDEX IF NOT EXISTS idx_demographics_name_nocase ON demographics (name COLLATE NOCASE)",
+    ]
+
+    def migrate_name_search(conn):
+        """v8: trigram full-text index over demographics.name (built from the existing rows) and a NOCASE name index"""
+        for statement in NAME_SEARCH_OBJECTS:
+            conn.execute(statement)
+        conn.execute("INSERT INTO demographics_fts (demographics_fts) VALUES ('rebuild')")
+
+    def migrate_search_key_index(conn):
+        """v9: replace the NOCASE name index with ones on the member search sort key (all guilds / one guild), for keyset paging"""
+        conn.execute("DROP INDEX IF EXISTS idx_demographics_name_nocase")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_demographics_name_key ON demographics (name COLLATE NOCASE, guild_id, member_id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_demographics_guild_name ON demographics (guild_id, name COLLATE NOCASE, member_id)")
+
+    def migrate_snapshot_archive(conn):
+        """v10: index of the cold snapshot archive segment files (paths relative to ARCHIVE_DIR)"""
+        conn.execute("""CREATE TABLE IF NOT EXISTS snapshot_archive (
+            guild_id INTEGER, first_ms INTEGER, last_ms INTEGER, row_count INTEGER, path TEXT, bytes INTEGER,
+            PRIMARY KEY (guild_id, first_ms))""")
+
+    def migrate_shard_catalog(conn):
+        """v11: shard layout of a sharded DB (no rows unless sharding is enabled; paths relative to SHARD_DIR)"""
+        conn.execute("CREATE TABLE IF NOT EXISTS shards (shard INTEGER PRIMARY KEY, path TEXT)")
+
+    def migrate_member_events(conn):
+        """
+        v12: join/leave event log (kind 1 = join, -1 = leave) and demographics.left_ms. Members missing
+        from their guild's latest fetch are marked as already gone, without logging an event.
         """
-        Ensures all required tables and columns exist in the SQLite database, including the 'boosters' and 'timestamp' columns for new DBs. For a fresh DB, the CREATE TABLE statement includes all columns, so ALTER TABLE is not needed. For legacy DBs, this function will add missing columns as needed.
+        conn.execute("""CREATE TABLE IF NOT EXISTS member_events (
+            guild_id INTEGER, timestamp_ms INTEGER, member_id INTEGER, kind INTEGER,
+            PRIMARY KEY (guild_id, timestamp_ms, member_id)) WITHOUT ROWID""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_member_events_ts_ms ON member_events (timestamp_ms)")
+        add_missing_columns(conn, "demographics", [("left_ms", "INTEGER")])
+        conn.execute("""
+            UPDATE demographics SET left_ms = last_seen_ms
+            FROM (SELECT guild_id, MAX(last_seen_ms) AS latest_ms FROM demographics GROUP BY guild_id) AS latest
+            WHERE demographics.guild_id = latest.guild_id AND demographics.last_seen_ms < latest.latest_ms
+        """)
+
+    def migrate_member_names(conn):
+        """v13: change-only member name history, seeded with each member's most recently fetched name"""
+        conn.execute("""CREATE TABLE IF NOT EXISTS member_names (
+            member_id INTEGER, since_ms INTEGER, name TEXT,
+            PRIMARY KEY (member_id, since_ms)) WITHOUT ROWID""")
+        # timestamp_ms may still await its backfill here; v5 filled last_seen_ms from the ISO timestamp
+        conn.execute("""
+            INSERT OR IGNORE INTO member_names (member_id, since_ms, name)
+            SELECT member_id, COALESCE(first_seen_ms, 0), name
+            FROM (SELECT member_id, first_seen_ms, name, MAX(COALESCE(last_seen_ms, 0)) FROM demographics GROUP BY member_id)
+        """)
+
+    def migrate_snowflake_created(conn):
         """
+        v14: account_created/account_created_ms become virtual columns computed from the member_id
+        snowflake instead of stored copies (their index goes too: member_id ranges replace it)
+        """
+        conn.execute("DROP INDEX IF EXISTS idx_demographics_guild_created_ms")
+        for column in ("account_created_ms", "account_created"):
+            conn.execute(f"ALTER TABLE demographics DROP COLUMN {column}")
+        created_ms = SNOWFLAKE_MS_SQL.format("member_id")
+        conn.execute(f"ALTER TABLE demographics ADD COLUMN account_created_ms INTEGER GENERATED ALWAYS AS ({created_ms}) VIRTUAL")
+        conn.execute(
+            "ALTER TABLE demographics ADD COLUMN account_created TEXT GENERATED ALWAYS AS "
+            f"(strftime('%Y-%m-%dT%H:%M:%f000+00:00', {created_ms} / 1000.0, 'unixepoch')) VIRTUAL"
+        )
+
+    def migrate_snapshot_runs(conn):
+        """v15: valid_to_ms on snapshots, set on rows that stand for a run of identical snapshots"""
+        add_missing_columns(conn, "snapshots", [("valid_to_ms", "INTEGER")])
+
+    def migrate_structure_snapshots(conn):
+        """v16: channel/role structure blobs keyed by content hash, and each guild's change-only log of them"""
+        conn.execute("""CREATE TABLE IF NOT EXISTS structure_blobs (
+            hash TEXT PRIMARY KEY, body BLOB) WITHOUT ROWID""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS guild_structures (
+            guild_id INTEGER, timestamp_ms INTEGER, hash TEXT,
+            PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+    def migrate_member_profile_index(conn):
+        """v17: replace the member_id index with one covering the member profile lookup (every guild of a member, by join time)"""
+        conn.execute("DROP INDEX IF EXISTS idx_demographics_member")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_demographics_member_profile ON demographics (member_id, joined_at_ms, guild_id, first_seen_ms, last_seen_ms, left_ms)")
+
+    def migrate_membership_sets(conn):
+        """v18: dense integer ids for member snowflakes, and a compressed bitmap of those ids per guild member fetch"""
+        conn.execute("CREATE TABLE IF NOT EXISTS member_ids (dense_id INTEGER PRIMARY KEY, member_id INTEGER NOT NULL UNIQUE)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS membership_sets (
+            guild_id INTEGER, timestamp_ms INTEGER, member_count INTEGER, bitmap BLOB,
+            PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+    def migrate_role_histograms(conn):
+        """v19: per-snapshot role histogram (members holding each role), packed as sorted (role_id, count) int64 pairs"""
+        conn.execute("""CREATE TABLE IF NOT EXISTS role_histograms (
+            guild_id INTEGER, timestamp_ms INTEGER, histogram BLOB,
+            PRIMARY KEY (guild_id, timestamp_ms)) WITHOUT ROWID""")
+
+    def migrate_archive_sample_counts(conn):
+        """v20: snapshots each archive segment stands for (a run or rollup row counts its samples); NULL on older segments"""
+        # Catalog-only: shard files dropped snapshot_archive after their first migration pass
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'snapshot_archive'").fetchone():
+            add_missing_columns(conn, "snapshot_archive", [("sample_count", "INTEGER")])
+
+    def migrate_member_profile_key_index(conn):
+        """
+        v21: narrow the member profile index to columns a fetch never rewrites, so advancing last_seen_ms
+        stays an index-free update; the profile reads the seen/left columns by rowid
+        """
+        conn.execute("DROP INDEX IF EXISTS idx_demographics_member_profile")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_demographics_member_profile ON demographics (member_id, joined_at_ms, guild_id)")
+
+    # Ordered schema migrations keyed by PRAGMA user_version.
+    # Keep identical (same versions, same DDL) to SCHEMA_MIGRATIONS in analytics_dashboard.py; append only.
+    # Shard files run them too and then keep only their shard-local tables, so a migration must not
+    # assume any other table exists.
+    SCHEMA_MIGRATIONS = [
+        (1, "base tables", migrate_base_tables),
+        (2, "epoch-ms columns", migrate_epoch_ms_columns),
+        (3, "secondary indexes", migrate_secondary_indexes),
+        (4, "integer snowflake keys", migrate_integer_snowflakes),
+        (5, "demographics first/last seen", migrate_seen_columns),
+        (6, "snapshot rollup columns", migrate_rollup_columns),
+        (7, "guilds dimension", migrate_guild_tables),
+        (8, "member name search index", migrate_name_search),
+        (9, "member search key index", migrate_search_key_index),
+        (10, "snapshot archive segments", migrate_snapshot_archive),
+        (11, "shard catalog", migrate_shard_catalog),
+        (12, "member churn events", migrate_member_events),
+        (13, "member name history", migrate_member_names),
+        (14, "snowflake account creation", migrate_snowflake_created),
+        (15, "snapshot runs", migrate_snapshot_runs),
+        (16, "structure snapshots", migrate_structure_snapshots),
+        (17, "member profile index", migrate_member_profile_index),
+        (18, "membership bitmaps", migrate_membership_sets),
+        (19, "role histograms", migrate_role_histograms),
+        (20, "archive sample counts", migrate_archive_sample_counts),
+        (21, "member profile key index", migrate_member_profile_key_index),
+    ]
+    SCHEMA_READY = set()  # DB paths already migrated by this process
+
+    def run_schema_migrations(conn):
+        """
+        Apply every migration newer than the DB's user_version, in order.
+        Each step runs in its own IMMEDIATE transaction and re-checks the version under the lock,
+        so the bot and the dashboard can race on a fresh DB safely. conn must be in autocommit mode.
+        """
+        for version, description, migrate in SCHEMA_MIGRATIONS:
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if conn.execute("PRAGMA user_version").fetchone()[0] < version:
+                    migrate(conn)
+                    conn.execute(f"PRAGMA user_version = {version}")
+                    print(f"[DB MIGRATION] Applied schema v{version}: {description}", type_="INFO")
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def ensure_schema(force=False):
+        """
+        Bring the database up to the latest schema version. Runs the migrations once per process;
+        later calls are a set lookup, so hot paths can call this freely.
+        """
+        if DB_PATH in SCHEMA_READY and not force:
+            return
         os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
-        conn = sqlite3.connect(DB_PATH)
+        conn = sqlite3.connect(DB_PATH, isolation_level=None)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # only takes effect while the file is empty
+            run_schema_migrations(conn)
+            align_partitions(conn)
+            # Resumable; the timestamp_ms index makes the NULL probe a seek once everything is filled
+            backfill_epoch_columns(conn)
+            for path in shard_paths(conn):
+                prepare_shard(path)
+            SCHEMA_READY.add(DB_PATH)
+        except Exception as e:
+            print(f"[DB MIGRATION] Schema migration failed: {e}", type_="ERROR")
+        finally:
+            conn.close()
+
+    # Rows whose name and join data are unchanged hit the conflict clause and are left untouched
+    DEMOGRAPHICS_UPSERT_SQL = """
+        INSERT INTO demographics (guild_id, member_id, name, joined_at, timestamp, joined_at_ms, timestamp_ms, first_seen_ms, last_seen_ms)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (guild_id, member_id) DO UPDATE SET
+            name = excluded.name,
+            joined_at = excluded.joined_at,
+            timestamp = excluded.timestamp,
+            joined_at_ms = excluded.joined_at_ms,
+            timestamp_ms = excluded.timestamp_ms,
+            last_seen_ms = excluded.last_seen_ms
+        WHERE name IS NOT excluded.name
+           OR joined_at_ms IS NOT excluded.joined_at_ms
+    """
+
+    INGEST_CHUNK_SIZE = 1000  # members per executemany/commit
+    # Share of the guild's reported member_count a fetch must return before absent members count as left;
+    # fetch_members on a user account can return a partial, cache-dependent list
+    FETCH_COMPLETE_RATIO = 0.99
+
+    def set_member_bits(bitmap, dense_ids):
+        """
+        Set the bit of each (dense_id,) row in bitmap, a bytearray grown as needed (bit n is bit n & 7 of
+        byte n >> 3, i.e. a little-endian integer). Returns the number of bits that were not already set.
+        """
+        added = 0
+        for (dense_id,) in dense_ids:
+            index, mask = dense_id >> 3, 1 << (dense_id & 7)
+            if index >= len(bitmap):
+                bitmap.extend(bytes(index + 1 - len(bitmap)))
+            if not bitmap[index] & mask:
+                bitmap[index] |= mask
+                added += 1
+        return added
+
+    def ingest_members(conn, guild_id, members, member_count=None, chunk_size=INGEST_CHUNK_SIZE):
+        """
+        Shared member ingestion writer for every fetch path. Takes any iterable of members and writes
+        it in bounded chunks, one executemany and one commit per chunk, with a single timestamp for
+        the whole batch. New members get first_seen_ms, members whose name or join data changed are
+        rewritten, and everyone else only has last_seen_ms advanced by a set-based UPDATE that
+        touches no index. The fetched id set is diffed against the stored one: seen members with no
+        row or marked as gone are logged as joins. Once the whole fetch is in, and only if it reached
+        FETCH_COMPLETE_RATIO of member_count (the guild's reported size), present members it did not
+        include are marked gone and logged as leaves; a partial fetch logs joins only. A guild's first
+        fetch logs nothing.
+        Names are compared the same way against each member's latest member_names row (one primary-key
+        seek per member), and only differing names are appended. The fetched set is also stored as a
+        membership_sets bitmap over member_ids' dense ids. Returns (rows written, members seen).
+        """
+        now = datetime.now(timezone.utc)
+        now_iso, now_ms = now.isoformat(), to_epoch_ms(now)
         c = conn.cursor()
-        # Create table if not exists (fresh DB)
-        c.execute('''CREATE TABLE IF NOT EXISTS snapshots (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            guild_id TEXT,
-            guild_name TEXT,
-            timestamp TEXT,
-            member_count INTEGER,
-            channel_count INTEGER,
-            text_channels INTEGER,
-            voice_channels INTEGER,
-            categories INTEGER,
-            role_count INTEGER,
-            bots INTEGER,
-            boosters INTEGER,
-            is_auto INTEGER
-        )''')
-        # Check if 'boosters' column exists, add if missing (legacy DB)
-        c.execute("PRAGMA table_info(snapshots)")
-        columns = [row[1] for row in c.fetchall()]
-        if 'boosters' not in columns:
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS seen_members (member_id INTEGER PRIMARY KEY, name TEXT)")
+        started = time.perf_counter()
+        written = seen = joins = renames = present = 0
+        bitmap = bytearray()
+        baseline = c.execute("SELECT 1 FROM demographics WHERE guild_id = ? LIMIT 1", (guild_id,)).fetchone() is None
+        members = iter(members)
+        while True:
+            chunk = list(islice(members, chunk_size))
+            if not chunk:
+                break
+            c.executemany("INSERT OR IGNORE INTO temp.seen_members (member_id, name) VALUES (?, ?)", [(member.id, str(member)) for member in chunk])
+            c.execute("INSERT OR IGNORE INTO member_ids (member_id) SELECT member_id FROM temp.seen_members")
+            present += set_member_bits(bitmap, c.execute(
+                "SELECT m.dense_id FROM temp.seen_members s JOIN member_ids m ON m.member_id = s.member_id"
+            ))
+            renames += c.execute("""
+                INSERT OR IGNORE INTO member_names (member_id, since_ms, name)
+                SELECT s.member_id, ?, s.name FROM temp.seen_members s
+                WHERE s.name IS NOT (SELECT h.name FROM member_names h WHERE h.member_id = s.member_id ORDER BY h.since_ms DESC LIMIT 1)
+            """, (now_ms,)).rowcount
+            if not baseline:
+                joins += c.execute("""
+                    INSERT OR IGNORE INTO member_events (guild_id, timestamp_ms, member_id, kind)
+                    SELECT ?, ?, s.member_id, 1 FROM temp.seen_members s
+                    LEFT JOIN demographics d ON d.guild_id = ? AND d.member_id = s.member_id
+                    WHERE d.member_id IS NULL OR d.left_ms IS NOT NULL
+                """, (guild_id, now_ms, guild_id)).rowcount
+            before = conn.total_changes
+            c.executemany(DEMOGRAPHICS_UPSERT_SQL, [
+                (
+                    guild_id, member.id, str(member),
+                    member.joined_at.isoformat() if member.joined_at else None,
+                    now_iso, to_epoch_ms(member.joined_at), now_ms, now_ms, now_ms
+                )
+                for member in chunk
+            ])
+            written += conn.total_changes - before
+            c.execute(
+                "UPDATE demographics SET last_seen_ms = ?, left_ms = NULL WHERE guild_id = ? "
+                "AND (last_seen_ms IS NULL OR last_seen_ms < ? OR left_ms IS NOT NULL) "
+                "AND member_id IN (SELECT member_id FROM temp.seen_members)",
+                (now_ms, guild_id, now_ms),
+            )
+            c.execute("DELETE FROM temp.seen_members")
+            conn.commit()
+            seen += len(chunk)
+        leaves = 0
+        complete = bool(member_count) and seen >= member_count * FETCH_COMPLETE_RATIO
+        if seen and not complete:
+            print(f"[INGEST] guild {guild_id}: fetch returned {seen} of {member_count or 'unknown'} members, not logging leaves", type_="INFO")
+        if seen:
+            if complete:
+                # Everyone still present but not refreshed by this fetch has left
+                gone = "guild_id = ? AND left_ms IS NULL AND COALESCE(last_seen_ms, 0) < ?"
+                leaves = c.execute(
+                    f"INSERT OR IGNORE INTO member_events (guild_id, timestamp_ms, member_id, kind) SELECT guild_id, ?, member_id, -1 FROM demographics WHERE {gone}",
+                    (now_ms, guild_id, now_ms),
+                ).rowcount
+                c.execute(f"UPDATE demographics SET left_ms = ? WHERE {gone}", (now_ms, guild_id, now_ms))
+            c.execute(
+                "INSERT OR REPLACE INTO membership_sets (guild_id, timestamp_ms, member_count, bitmap) VALUES (?, ?, ?, ?)",
+                (guild_id, now_ms, present, zlib.compress(bytes(bitmap), 9)),
+            )
+            conn.commit()
+        elapsed = time.perf_counter() - started
+        rate = seen / elapsed if elapsed > 0 else 0
+        print(f"[INGEST] guild {guild_id}: {seen} members, {written} new or changed, {joins} joined, {leaves} left, {renames} names recorded, {elapsed:.2f}s ({rate:,.0f} rows/s)", type_="INFO")
+        return written, seen
+
+    # --- Monthly snapshot partitions ---
+    # Optional (analytics partition on): closed months of snapshots move out of the live snapshots table
+    # into snapshots_pYYYYMM tables next to it (in the catalog, or in each shard), so retention can drop
+    # a whole month with DROP TABLE instead of deleting it row by row. A partition's bounds come from its
+    # name. On a partitioned connection the unqualified name snapshots is a read-only temp view over the
+    # live table and every partition; writers use main.snapshots or snapshot_tables(). Rows keep the id the
+    # live table gave them, so ids stay unique across a schema's tables.
+    PARTITION_GLOB = "snapshots_p[0-9][0-9][0-9][0-9][0-9][0-9]"
+    PARTITION_MOVE_ROWS = 20000  # rows moved into a partition per write transaction
+
+    def is_partitioning_enabled():
+        return getConfigData().get(PARTITION_CONFIG_KEY, False)
+
+    def partition_name(timestamp_ms):
+        month = UNIX_EPOCH + timedelta(milliseconds=timestamp_ms)
+        return f"snapshots_p{month.year:04}{month.month:02}"
+
+    def partition_bounds(name):
+        """[start_ms, end_ms) of a partition's month"""
+        year, month = int(name[-6:-2]), int(name[-2:])
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+        return to_epoch_ms(start), to_epoch_ms(end)
+
+    def partition_names(conn, schema="main"):
+        """A schema's snapshot partitions, oldest month first"""
+        return [row[0] for row in conn.execute(
+            f"SELECT name FROM {schema}.sqlite_master WHERE type = 'table' AND name GLOB ? ORDER BY name", (PARTITION_GLOB,)
+        )]
+
+    def snapshot_tables(conn, schema="main", start_ms=None, end_ms=None):
+        """Qualified names of schema's live snapshots table and of the partitions overlapping [start_ms, end_ms)"""
+        tables = [f"{schema}.snapshots"]
+        for name in partition_names(conn, schema):
+            low, high = partition_bounds(name)
+            if (start_ms is None or high > start_ms) and (end_ms is None or low < end_ms):
+                tables.append(f"{schema}.{name}")
+        return tables
+
+    def snapshot_columns(conn, schema="main"):
+        return [row[1] for row in conn.execute(f"PRAGMA {schema}.table_info(snapshots)")]
+
+    def union_view(conn, table, schemas):
+        """Shadow table with a temp view over every schema's copy of it (for snapshots, live table plus partitions)"""
+        conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA {schemas[0]}.table_xinfo({table})"))
+        sources = [
+            source for schema in schemas
+            for source in (snapshot_tables(conn, schema) if table == "snapshots" else [f"{schema}.{table}"])
+        ]
+        union = " UNION ALL ".join(f"SELECT {columns} FROM {source}" for source in sources)
+        conn.execute(f"CREATE TEMP VIEW {table} AS {union}")
+
+    def create_partition(conn, schema, name):
+        """Create a partition shaped like schema's live snapshots table, with its per-guild and time indexes"""
+        columns = ", ".join(
+            f"{row[1]} {row[2]}{' PRIMARY KEY' if row[5] else ''}"
+            for row in conn.execute(f"PRAGMA {schema}.table_info(snapshots)")
+        )
+        conn.execute(f"CREATE TABLE IF NOT EXISTS {schema}.{name} ({columns})")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_{name}_guild_ts_ms ON {name} (guild_id, timestamp_ms)")
+        conn.execute(f"CREATE INDEX IF NOT EXISTS {schema}.idx_{name}_ts_ms ON {name} (timestamp_ms)")
+
+    def align_partitions(conn):
+        """Give existing partitions the columns later migrations added to the live snapshots table"""
+        columns = [(row[1], row[2]) for row in conn.execute("PRAGMA table_info(snapshots)") if not row[5]]
+        for name in partition_names(conn):
+            add_missing_columns(conn, name, columns)
+
+    def delete_snapshot_ids(conn, ids, start_ms=None, end_ms=None):
+        """Delete snapshots by id from main's live table and the partitions overlapping [start_ms, end_ms)"""
+        for table in snapshot_tables(conn, start_ms=start_ms, end_ms=end_ms):
+            conn.executemany(f"DELETE FROM {table} WHERE id = ?", ids)
+
+    def delete_guild_snapshots(conn, guild_id):
+        """Delete every snapshot of a guild; returns the number of rows deleted"""
+        return sum(
+            conn.execute(f"DELETE FROM {table} WHERE guild_id = ?", (guild_id,)).rowcount
+            for table in snapshot_tables(conn)
+        )
+
+    def clear_guild_data(conn, guild_id):
+        """
+        Delete a guild's data for analytics clear in one transaction: live and partitioned snapshots, the
+        archive index, the structure log (and blobs no guild references any more), membership bitmaps, role
+        histograms and its guilds row.
+        Returns the archive segment paths to remove once it has committed.
+        """
+        delete_guild_snapshots(conn, guild_id)
+        paths = [row[0] for row in conn.execute("SELECT path FROM snapshot_archive WHERE guild_id = ?", (guild_id,))]
+        conn.execute("DELETE FROM snapshot_archive WHERE guild_id = ?", (guild_id,))
+        conn.execute("DELETE FROM guild_structures WHERE guild_id = ?", (guild_id,))
+        conn.execute("DELETE FROM structure_blobs WHERE hash NOT IN (SELECT hash FROM guild_structures)")
+        conn.execute("DELETE FROM membership_sets WHERE guild_id = ?", (guild_id,))
+        conn.execute("DELETE FROM role_histograms WHERE guild_id = ?", (guild_id,))
+        refresh_guild_row(conn, guild_id)
+        return paths
+
+    def refresh_guild_row(conn, guild_id):
+        """
+        Re-derive a guild's first snapshot in the guilds dimension after its oldest snapshots were deleted
+        (archived ones still count), or drop its row and name history once it has no snapshots left
+        """
+        first = conn.execute(
+            "SELECT timestamp_ms, timestamp FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms, id LIMIT 1", (guild_id,)
+        ).fetchone()
+        archived_ms = conn.execute("SELECT MIN(first_ms) FROM snapshot_archive WHERE guild_id = ?", (guild_id,)).fetchone()[0]
+        if archived_ms is not None and (first is None or archived_ms < first[0]):
+            first = (archived_ms, (UNIX_EPOCH + timedelta(milliseconds=archived_ms)).isoformat())
+        if first is None:
+            conn.execute("DELETE FROM guilds WHERE guild_id = ?", (guild_id,))
+            conn.execute("DELETE FROM guild_name_history WHERE guild_id = ?", (guild_id,))
+            return
+        conn.execute("UPDATE guilds SET first_snapshot_ms = ?, first_snapshot = ? WHERE guild_id = ?", (first[0], first[1], guild_id))
+
+    def seal_partition_batch(conn, schema, month_start_ms):
+        """
+        Move up to PARTITION_MOVE_ROWS of schema's oldest live snapshots from before month_start_ms into
+        their month's partition (one month per call). Returns the number of rows moved.
+        """
+        oldest = conn.execute(f"SELECT MIN(timestamp_ms) FROM {schema}.snapshots WHERE timestamp_ms < ?", (month_start_ms,)).fetchone()[0]
+        if oldest is None:
+            return 0
+        name = partition_name(oldest)
+        low, high = partition_bounds(name)
+        create_partition(conn, schema, name)
+        columns = ", ".join(snapshot_columns(conn, schema))
+        batch = (
+            f"SELECT id FROM {schema}.snapshots WHERE timestamp_ms >= ? AND timestamp_ms < ? "
+            "ORDER BY timestamp_ms, id LIMIT ?"
+        )
+        params = (low, high, PARTITION_MOVE_ROWS)
+        conn.execute(f"INSERT INTO {schema}.{name} ({columns}) SELECT {columns} FROM {schema}.snapshots WHERE id IN ({batch})", params)
+        return conn.execute(f"DELETE FROM {schema}.snapshots WHERE id IN ({batch})", params).rowcount
+
+    def merge_partitions(conn):
+        """Move every partition's rows back into its schema's live table and drop it; returns the number merged"""
+        merged = 0
+        for schema in shard_schemas(conn) or ["main"]:
+            columns = ", ".join(snapshot_columns(conn, schema))
+            for name in partition_names(conn, schema):
+                conn.execute(f"INSERT INTO {schema}.snapshots ({columns}) SELECT {columns} FROM {schema}.{name}")
+                conn.execute(f"DROP TABLE {schema}.{name}")
+                merged += 1
+        return merged
+
+    def drop_expired_partitions(conn, cutoffs):
+        """
+        Drop every partition whose rows (runs included) all end before the retention cutoff of their guild
+        (cutoffs: {guild_id: cutoff_ms}; guilds without one keep everything, and so their partitions).
+        Returns the number of rows dropped.
+        """
+        dropped = 0
+        for schema in shard_schemas(conn) or ["main"]:
+            for name in partition_names(conn, schema):
+                ends = conn.execute(f"SELECT guild_id, MAX(COALESCE(valid_to_ms, timestamp_ms)) FROM {schema}.{name} GROUP BY guild_id")
+                if all(cutoffs.get(guild_id, 0) > last_ms for guild_id, last_ms in ends.fetchall()):
+                    dropped += conn.execute(f"SELECT COUNT(*) FROM {schema}.{name}").fetchone()[0]
+                    conn.execute(f"DROP TABLE {schema}.{name}")
+        return dropped
+
+    async def seal_partitions():
+        """
+        Move every live snapshot from before the current month into its monthly partition,
+        PARTITION_MOVE_ROWS per DB-thread transaction. Returns the number of rows moved.
+        """
+        now = datetime.now(timezone.utc)
+        month_start_ms = to_epoch_ms(datetime(now.year, now.month, 1, tzinfo=timezone.utc))
+        total = 0
+        for schema in await run_db(lambda conn: shard_schemas(conn) or ["main"]):
+            while True:
+                moved = await run_db(seal_partition_batch, schema, month_start_ms)
+                if not moved:
+                    break
+                total += moved
+        if total:
+            print(f"[PARTITION] Moved {total} snapshots into monthly partitions", type_="INFO")
+        return total
+
+    # --- Async DB layer ---
+    # Every bot-side SQLite call runs on this one thread, so gateway heartbeats and the micro-API
+    # never wait on disk I/O, and the bot's own writes are serialized without lock contention.
+    DB_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="analytics-db")
+
+    # --- Sharded layout ---
+    # Optional (analytics shard on): each guild's rows of SHARD_TABLES live in shard file
+    # guild_id % SHARD_COUNT under SHARD_DIR, and DB_PATH becomes the catalog holding everything else.
+    # A guild-scoped connection opens the guild's shard as main with the catalog attached, so unqualified
+    # table names resolve to the right file for reads and writes alike; a cross-guild connection opens
+    # the catalog with every shard attached behind read-only UNION ALL temp views named after SHARD_TABLES.
+    SHARD_COUNT = 8  # stays under SQLite's default limit of 10 attached databases
+    SHARD_TABLES = ("snapshots", "demographics", "member_events", "membership_sets", "role_histograms")
+
+    def shard_paths(conn):
+        """Absolute shard file paths in shard order ([] when the DB is not sharded)"""
+        return [os.path.join(SHARD_DIR, path) for (path,) in conn.execute("SELECT path FROM main.shards ORDER BY shard")]
+
+    def shard_for(guild_id, count):
+        return int(guild_id) % count
+
+    def is_shard_local(table):
+        """Whether a table lives in shard files: SHARD_TABLES, their monthly snapshot partitions and the full-text index backing demographics"""
+        return table in SHARD_TABLES or table.startswith(("snapshots_p", "demographics_fts"))
+
+    def shard_schemas(conn):
+        """Schema names of the shards attached to a cross-guild connection ([] otherwise)"""
+        return [row[1] for row in conn.execute("PRAGMA database_list") if row[1].startswith("shard_")]
+
+    def prepare_shard(path):
+        """Create or migrate a shard file: the catalog's migrations, then drop every table that is not shard-local"""
+        conn = sqlite3.connect(path, isolation_level=None)
+        try:
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")  # only takes effect while the file is empty
+            run_schema_migrations(conn)
+            align_partitions(conn)
+            tables = conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'").fetchall()
+            for (table,) in tables:
+                if not is_shard_local(table):
+                    conn.execute(f"DROP TABLE IF EXISTS {table}")
+        finally:
+            conn.close()
+
+    def attach_shards(conn, paths):
+        """Attach every shard as shard_<n> and shadow SHARD_TABLES with UNION ALL temp views over them"""
+        for n, path in enumerate(paths):
+            conn.execute(f"ATTACH DATABASE ? AS shard_{n}", (path,))
+        for table in SHARD_TABLES:
+            union_view(conn, table, [f"shard_{n}" for n in range(len(paths))])
+
+    def connect_db(guild_id=None):
+        """
+        Connection for guild_id's data (its shard as main, catalog attached) or, without a guild_id,
+        for cross-guild work (catalog as main, every shard attached; SHARD_TABLES are read-only there).
+        Unsharded DBs always get a plain connection to DB_PATH.
+        """
+        conn = sqlite3.connect(DB_PATH)
+        paths = shard_paths(conn)
+        if paths and guild_id is not None:
+            conn.close()
+            conn = sqlite3.connect(paths[shard_for(guild_id, len(paths))])
+            conn.execute("ATTACH DATABASE ? AS catalog", (DB_PATH,))
+        elif paths:
+            attach_shards(conn, paths)
+            return conn
+        if partition_names(conn):
+            union_view(conn, "snapshots", ["main"])
+        return conn
+
+    def copy_shard_rows(conn, source, target, where="", exclude=()):
+        """
+        Copy source.table rows (matching where) into target.table for each of SHARD_TABLES, by column name.
+        Source snapshot partitions are copied into the target's live table; sealing re-partitions them.
+        """
+        for table in SHARD_TABLES:
+            target_columns = {row[1] for row in conn.execute(f"PRAGMA {target}.table_info({table})")} - set(exclude)
+            columns = ", ".join(row[1] for row in conn.execute(f"PRAGMA {source}.table_info({table})") if row[1] in target_columns)
+            sources = snapshot_tables(conn, source) if table == "snapshots" else [f"{source}.{table}"]
+            for source_table in sources:
+                conn.execute(f"INSERT INTO {target}.{table} ({columns}) SELECT {columns} FROM {source_table} {where}")
+
+    def enable_sharding(conn):
+        """
+        Create SHARD_COUNT shard files and move every guild's SHARD_TABLES rows out of the catalog into
+        its shard, in one transaction across all the files. Returns the number of shards (0 if already sharded).
+        """
+        if shard_paths(conn):
+            return 0
+        os.makedirs(SHARD_DIR, exist_ok=True)
+        names = [f"shard_{n:02}.db" for n in range(SHARD_COUNT)]
+        for name in names:
+            prepare_shard(os.path.join(SHARD_DIR, name))
+        attach_shards(conn, [os.path.join(SHARD_DIR, name) for name in names])
+        for n, name in enumerate(names):
+            copy_shard_rows(conn, "main", f"shard_{n}", f"WHERE guild_id % {SHARD_COUNT} = {n}")
+            conn.execute("INSERT INTO main.shards (shard, path) VALUES (?, ?)", (n, name))
+        for table in SHARD_TABLES:
+            conn.execute(f"DELETE FROM main.{table} WHERE guild_id IS NOT NULL")
+        for name in partition_names(conn):
+            conn.execute(f"DROP TABLE main.{name}")
+        return SHARD_COUNT
+
+    def disable_sharding(conn):
+        """Move every shard's rows back into the catalog and clear the layout; returns the shard paths to delete"""
+        paths = shard_paths(conn)
+        for n in range(len(paths)):
+            # Each shard numbers its snapshots independently, so the catalog assigns fresh ids
+            copy_shard_rows(conn, f"shard_{n}", "main", exclude=("id",))
+        conn.execute("DELETE FROM main.shards")
+        return paths
+
+    def remove_shard_files(paths):
+        """Delete shard files once the layout no longer lists them (DB thread)"""
+        for path in paths:
+            if os.path.isfile(path):
+                os.remove(path)
+
+    async def run_in_db_thread(func, *args):
+        """Await func(*args) on the DB thread"""
+        return await asyncio.get_running_loop().run_in_executor(DB_EXECUTOR, func, *args)
+
+    async def run_db(func, *args, guild_id=None):
+        """
+        Await func(conn, *args) on the DB thread with a fresh connection (routed to guild_id's shard
+        when given), as one transaction: committed when func returns, rolled back when it raises.
+        Returns func's result.
+        """
+        def work():
+            ensure_schema()
+            conn = connect_db(guild_id)
+            try:
+                result = func(conn, *args)
+                conn.commit()
+                return result
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+        return await run_in_db_thread(work)
+
+    async def db_fetchone(sql, params=(), guild_id=None):
+        return await run_db(lambda conn: conn.execute(sql, params).fetchone(), guild_id=guild_id)
+
+    async def db_fetchall(sql, params=(), guild_id=None):
+        return await run_db(lambda conn: conn.execute(sql, params).fetchall(), guild_id=guild_id)
+
+    async def db_execute(sql, params=(), guild_id=None):
+        """Run one write statement in its own transaction; returns the affected row count"""
+        return await run_db(lambda conn: conn.execute(sql, params).rowcount, guild_id=guild_id)
+
+    # --- Streaming export ---
+    EXPORT_BATCH_ROWS = 2000  # rows per DB-thread turn, so other DB work interleaves with a long export
+    EXPORT_PROGRESS_SECONDS = 5
+    # table: (exported columns, keyset columns the export walks in order)
+    EXPORT_DATASETS = {
+        "snapshots": (
+            ["guild_id", "guild_name", "timestamp", "member_count", "channel_count", "text_channels", "voice_channels",
+             "categories", "role_count", "bots", "boosters", "is_auto"],
+            # Row-value comparisons are never true against NULL, so a row missing timestamp_ms sorts as 0
+            ["guild_id", "COALESCE(timestamp_ms, 0)", "id"],
+        ),
+        "demographics": (
+            ["guild_id", "member_id", "name", "account_created", "joined_at", "first_seen_ms", "last_seen_ms"],
+            ["guild_id", "member_id"],
+        ),
+    }
+
+    def open_export_file(path, fmt, compress, columns):
+        """Open an export file for writing (gzip if compress) and write the CSV header (DB thread)"""
+        if compress:
+            f = gzip.open(path, "wt", encoding="utf-8", newline="")
+        else:
+            f = open(path, "w", encoding="utf-8", newline="")
+        if fmt == "csv":
+            csv.writer(f).writerow(columns)
+        return f
+
+    def export_batch(conn, f, fmt, table, guild_id, after):
+        """
+        Append the next EXPORT_BATCH_ROWS rows of table (one guild, or all if guild_id is None) that
+        sort after the keyset value `after` to f. Returns (rows written, keyset value of the last row).
+        """
+        columns, key = EXPORT_DATASETS[table]
+        where = []
+        params = []
+        if guild_id is not None:
+            where.append("guild_id = ?")
+            params.append(guild_id)
+        if after is not None:
+            where.append(f"({', '.join(key)}) > ({', '.join('?' * len(key))})")
+            params.extend(after)
+        rows = conn.execute(
+            f"SELECT {', '.join(columns + key)} FROM {table} WHERE {' AND '.join(where) or '1=1'} "
+            f"ORDER BY {', '.join(key)} LIMIT ?",
+            params + [EXPORT_BATCH_ROWS]
+        ).fetchall()
+        values = [row[:len(columns)] for row in rows]
+        if fmt == "csv":
+            csv.writer(f).writerows(values)
+        else:
+            # Snowflakes as strings, like the dashboard's JSON
+            f.writelines(
+                json.dumps({c: str(v) if c in ("guild_id", "member_id") and v is not None else v for c, v in zip(columns, row)}) + "\n"
+                for row in values
+            )
+        return len(rows), (tuple(rows[-1][len(columns):]) if rows else after)
+
+    async def export_table(table, path, fmt, compress, guild_id, progress):
+        """Stream table to path batch by batch off the event loop; awaits progress(rows written) after each batch"""
+        columns, _ = EXPORT_DATASETS[table]
+        guild_ids = [guild_id]
+        if guild_id is None and await run_db(shard_paths):
+            # Sharded: walk guild by guild, each on its own shard, instead of sorting the union every batch
+            guild_ids = [row[0] for row in await db_fetchall(f"SELECT DISTINCT guild_id FROM {table} WHERE guild_id IS NOT NULL ORDER BY guild_id")]
+        f = await run_in_db_thread(open_export_file, path, fmt, compress, columns)
+        written = 0
+        try:
+            for export_guild_id in guild_ids:
+                after = None
+                while True:
+                    count, after = await run_db(export_batch, f, fmt, table, export_guild_id, after, guild_id=export_guild_id)
+                    written += count
+                    await progress(written)
+                    if count < EXPORT_BATCH_ROWS:
+                        break
+        finally:
+            await run_in_db_thread(f.close)
+        return written
+
+    # --- Snapshot retention ---
+    RETENTION_BATCH_SIZE = 500  # snapshot rows deleted per write transaction
+    RETENTION_INTERVAL_SECONDS = 6 * 3600
+    INCREMENTAL_VACUUM_PAGES = 2000  # free pages released per pass
+
+    def is_retention_enabled():
+        return getConfigData().get(RETENTION_CONFIG_KEY, False)
+
+    def retention_plan(conn):
+        """[(guild_id, retention_days, cutoff_ms)] for every guild with snapshots; days <= 0 keeps everything"""
+        rows = conn.execute("""
+            SELECT g.guild_id, COALESCE(sc.snapshot_retention_days, ?)
+            FROM guilds g
+            LEFT JOIN server_config sc ON sc.guild_id = g.guild_id
+        """, (DATA_RETENTION_DAYS,)).fetchall()
+        now = datetime.now(timezone.utc)
+        return [(guild_id, days, to_epoch_ms(now - timedelta(days=days))) for guild_id, days in rows if days and days > 0]
+
+    def prune_snapshot_batch(conn, guild_id, cutoff_ms):
+        """
+        Delete up to RETENTION_BATCH_SIZE of a guild's oldest snapshots older than cutoff_ms (live table first,
+        then partitions). A run row stays while its run reaches past the cutoff.
+        """
+        deleted = 0
+        for table in snapshot_tables(conn, end_ms=cutoff_ms):
+            deleted += conn.execute(f"""
+                DELETE FROM {table} WHERE id IN (
+                    SELECT id FROM {table} WHERE guild_id = ? AND timestamp_ms < ? AND COALESCE(valid_to_ms, timestamp_ms) < ?
+                    ORDER BY timestamp_ms LIMIT ?
+                )
+            """, (guild_id, cutoff_ms, cutoff_ms, RETENTION_BATCH_SIZE - deleted)).rowcount
+            if deleted == RETENTION_BATCH_SIZE:
+                break
+        return deleted
+
+    def reclaim_free_pages(conn):
+        """
+        Return up to INCREMENTAL_VACUUM_PAGES free pages per file to the filesystem with a bounded
+        incremental_vacuum. A main DB created before incremental auto_vacuum is skipped until
+        `analytics vacuum now` converts it; shards are created incremental. Returns the free pages left.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            conn.execute(f"PRAGMA incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        for schema in shard_schemas(conn):
+            conn.execute(f"PRAGMA {schema}.incremental_vacuum({INCREMENTAL_VACUUM_PAGES})").fetchall()
+            free += conn.execute(f"PRAGMA {schema}.freelist_count").fetchone()[0]
+        return free
+
+    def enable_incremental_vacuum(conn):
+        """
+        Switch the main DB to incremental auto_vacuum so reclaim_free_pages can shrink it. This takes one
+        full VACUUM, which rewrites the whole file, needs as much free disk space again and holds the DB
+        thread until it finishes. Returns False if the DB is already incremental.
+        """
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        # VACUUM rebuilds main's indexes by table name, which the cross-guild temp views would shadow
+        for table in SHARD_TABLES:
+            conn.execute(f"DROP VIEW IF EXISTS temp.{table}")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        return True
+
+    async def prune_expired_snapshots():
+        """
+        Apply each guild's snapshot_retention_days, to live rows, monthly partitions, archive segments,
+        membership bitmaps and role histograms.
+        Partitions past every guild's cutoff are dropped whole; other deletes run in small batches, each its
+        own transaction on the DB thread, so other queries interleave and the write lock is never held long.
+        Returns the number of SQLite rows deleted.
+        """
+        plan = await run_db(retention_plan)
+        total = await run_db(drop_expired_partitions, {guild_id: cutoff_ms for guild_id, _, cutoff_ms in plan})
+        if total:
+            print(f"[RETENTION] Dropped expired monthly partitions holding {total} snapshots", type_="INFO")
+        for guild_id, days, cutoff_ms in plan:
+            deleted = RETENTION_BATCH_SIZE
+            guild_total = 0
+            while deleted == RETENTION_BATCH_SIZE:
+                deleted = await run_db(prune_snapshot_batch, guild_id, cutoff_ms, guild_id=guild_id)
+                guild_total += deleted
+            await db_execute("DELETE FROM membership_sets WHERE guild_id = ? AND timestamp_ms < ?", (guild_id, cutoff_ms), guild_id=guild_id)
+            await db_execute("DELETE FROM role_histograms WHERE guild_id = ? AND timestamp_ms < ?", (guild_id, cutoff_ms), guild_id=guild_id)
+            # Archive segments expire whole, once their newest row is past the cutoff
+            expired = await run_db(expired_archive_segments, guild_id, cutoff_ms)
+            if expired:
+                await run_in_db_thread(remove_archive_files, expired)
+            if guild_total or expired:
+                await run_db(refresh_guild_row, guild_id, guild_id=guild_id)
+            if guild_total:
+                print(f"[RETENTION] Pruned {guild_total} snapshots older than {days} days for guild {guild_id}", type_="INFO")
+            total += guild_total
+        return total
+
+    # --- Tiered compaction ---
+    COMPACTION_RAW_DAYS = 7  # newer snapshots stay raw
+    COMPACTION_HOURLY_DAYS = 90  # older snapshots collapse to one row per day, newer ones to one per hour
+    COMPACTION_BATCH_BUCKETS = 200  # buckets compacted per write transaction
+    HOUR_MS = 3600 * 1000
+    DAY_MS = 24 * HOUR_MS
+
+    def is_compaction_enabled():
+        return getConfigData().get(COMPACTION_CONFIG_KEY, False)
+
+    def compaction_buckets(conn, guild_id, level, bucket_ms, start_ms, end_ms):
+        """Buckets in [start_ms, end_ms) that still hold rows below this rollup level (run rows are already compact)"""
+        return [row[0] for row in conn.execute(
+            "SELECT DISTINCT timestamp_ms / ? FROM snapshots WHERE guild_id = ? AND timestamp_ms >= ? AND timestamp_ms < ? "
+            "AND COALESCE(rollup_level, 0) < ? AND valid_to_ms IS NULL ORDER BY 1",
+            (bucket_ms, guild_id, start_ms, end_ms, level),
+        )]
+
+    def compact_buckets(conn, guild_id, level, bucket_ms, buckets, start_ms, end_ms):
+        """
+        Collapse each bucket's rows (clipped to [start_ms, end_ms)) into the bucket's last row, carrying
+        first/min/max member_count and sample_count. Returns the number of rows deleted.
+        """
+        low = max(buckets[0] * bucket_ms, start_ms)
+        high = min((buckets[-1] + 1) * bucket_ms, end_ms)
+        rows = conn.execute("""
+            SELECT id, timestamp_ms, COALESCE(member_count_first, member_count), COALESCE(member_count_min, member_count),
+                   COALESCE(member_count_max, member_count), COALESCE(sample_count, 1)
+            FROM snapshots WHERE guild_id = ? AND timestamp_ms >= ? AND timestamp_ms < ? AND valid_to_ms IS NULL
+            ORDER BY timestamp_ms, id
+        """, (guild_id, low, high)).fetchall()
+        groups = defaultdict(list)
+        for row in rows:
+            groups[row[1] // bucket_ms].append(row)
+        updates = []
+        deletes = []
+        for group in groups.values():
+            updates.append((
+                group[0][2], min(row[3] for row in group), max(row[4] for row in group),
+                sum(row[5] for row in group), level, group[-1][0]
+            ))
+            deletes.extend((row[0],) for row in group[:-1])
+        for table in snapshot_tables(conn, start_ms=low, end_ms=high):
+            conn.executemany(
+                f"UPDATE {table} SET member_count_first = ?, member_count_min = ?, member_count_max = ?, sample_count = ?, rollup_level = ? WHERE id = ?",
+                updates,
+            )
+        delete_snapshot_ids(conn, deletes, low, high)
+        return len(deletes)
+
+    async def compact_snapshots():
+        """
+        Tiered downsampling: snapshots older than COMPACTION_RAW_DAYS collapse to one row per hour,
+        older than COMPACTION_HOURLY_DAYS to one row per day. Work is batched per guild and bucket
+        range, so each run only touches newly aged rows. Returns the number of rows deleted.
+        """
+        now = datetime.now(timezone.utc)
+        raw_cutoff = to_epoch_ms(now - timedelta(days=COMPACTION_RAW_DAYS))
+        hourly_cutoff = to_epoch_ms(now - timedelta(days=COMPACTION_HOURLY_DAYS))
+        tiers = [(1, HOUR_MS, hourly_cutoff, raw_cutoff), (2, DAY_MS, 0, hourly_cutoff)]
+        total = 0
+        for (guild_id,) in await db_fetchall("SELECT guild_id FROM guilds"):
+            guild_total = 0
+            for level, bucket_ms, start_ms, end_ms in tiers:
+                buckets = await run_db(compaction_buckets, guild_id, level, bucket_ms, start_ms, end_ms, guild_id=guild_id)
+                for i in range(0, len(buckets), COMPACTION_BATCH_BUCKETS):
+                    guild_total += await run_db(compact_buckets, guild_id, level, bucket_ms, buckets[i:i + COMPACTION_BATCH_BUCKETS], start_ms, end_ms, guild_id=guild_id)
+            if guild_total:
+                # A bucket keeps its last snapshot, so the guild's first one may have gone
+                await run_db(refresh_guild_row, guild_id, guild_id=guild_id)
+            total += guild_total
+        if total:
+            print(f"[COMPACTION] Collapsed {total} snapshots into hourly/daily rollups", type_="INFO")
+        return total
+
+    # --- Run-length snapshots ---
+    # Optional (analytics runs on): a snapshot identical to its guild's latest live row in RUN_COLUMNS
+    # extends that row instead of adding one. The row's timestamp_ms is where the run starts, valid_to_ms
+    # where it ends and sample_count how many snapshots it stands for; the dashboard's snapshot_history
+    # expands it back into that many evenly spaced points. Only raw rows form runs, and compaction
+    # leaves run rows alone.
+    RUN_COLUMNS = ["guild_name", "member_count", "channel_count", "text_channels", "voice_channels", "categories", "role_count", "bots", "boosters", "is_auto"]
+    RUN_BATCH_ROWS = 5000  # rows scanned per write transaction when collapsing existing history
+
+    def is_run_length_enabled():
+        return getConfigData().get(RUN_LENGTH_CONFIG_KEY, False)
+
+    def extend_snapshot_run(conn, guild_id, timestamp_ms, values):
+        """
+        Extend the guild's latest live row through timestamp_ms if it is a raw row whose RUN_COLUMNS
+        equal values. Returns whether it did (DB thread).
+        """
+        row = conn.execute(
+            f"SELECT id, COALESCE(valid_to_ms, timestamp_ms), COALESCE(rollup_level, 0), {', '.join(RUN_COLUMNS)} "
+            "FROM main.snapshots WHERE guild_id = ? ORDER BY timestamp_ms DESC LIMIT 1",
+            (guild_id,)
+        ).fetchone()
+        if row is None or row[2] != 0 or row[1] >= timestamp_ms or tuple(row[3:]) != tuple(values):
+            return False
+        conn.execute(
+            "UPDATE main.snapshots SET valid_to_ms = ?, sample_count = COALESCE(sample_count, 1) + 1 WHERE id = ?",
+            (timestamp_ms, row[0])
+        )
+        return True
+
+    def collapse_run_batch(conn, guild_id, after):
+        """
+        Collapse runs of identical raw snapshots among the guild's next RUN_BATCH_ROWS rows after the
+        (timestamp_ms, id) keyset `after` (() to start) into each run's first row. Returns (rows deleted,
+        keyset to resume from or None once the guild is done); resuming re-reads the last run's first
+        row, so a run that crosses batches keeps growing.
+        """
+        # Rows still waiting for their timestamp_ms backfill are left alone (and would stall the keyset)
+        where = "guild_id = ? AND timestamp_ms IS NOT NULL"
+        params = [guild_id]
+        if after:
+            where += " AND (timestamp_ms, id) > (?, ?)"
+            params.extend(after)
+        rows = conn.execute(
+            f"SELECT timestamp_ms, id, COALESCE(valid_to_ms, timestamp_ms), COALESCE(sample_count, 1), COALESCE(rollup_level, 0), "
+            f"{', '.join(RUN_COLUMNS)} FROM snapshots WHERE {where} ORDER BY timestamp_ms, id LIMIT ?",
+            params + [RUN_BATCH_ROWS]
+        ).fetchall()
+        # Rollup rows never join a run
+        runs = [list(run) for _, run in groupby(rows, key=lambda row: tuple(row[5:]) if row[4] == 0 else row[1])]
+        updates = []
+        deletes = []
+        for run in runs:
+            if len(run) > 1:
+                updates.append((max(row[2] for row in run), sum(row[3] for row in run), run[0][1]))
+                deletes.extend((row[1],) for row in run[1:])
+        for table in snapshot_tables(conn):
+            conn.executemany(f"UPDATE {table} SET valid_to_ms = ?, sample_count = ? WHERE id = ?", updates)
+        delete_snapshot_ids(conn, deletes)
+        if len(rows) < RUN_BATCH_ROWS:
+            return len(deletes), None
+        first_ms, first_id = runs[-1][0][:2]
+        return len(deletes), (first_ms, first_id - 1)
+
+    async def collapse_snapshot_runs():
+        """
+        Collapse every guild's existing runs of identical snapshots, RUN_BATCH_ROWS per DB-thread
+        transaction. Returns the number of rows removed.
+        """
+        total = 0
+        for (guild_id,) in await db_fetchall("SELECT guild_id FROM guilds"):
+            after = ()
+            while after is not None:
+                removed, after = await run_db(collapse_run_batch, guild_id, after, guild_id=guild_id)
+                total += removed
+        if total:
+            print(f"[RUNS] Collapsed {total} identical snapshots into runs", type_="INFO")
+        return total
+
+    # Columns of the series snapshot_history builds, and the live-row expressions they are read from
+    HISTORY_COLUMNS = [
+        ("timestamp", "timestamp"),
+        ("timestamp_ms", "timestamp_ms"),
+        ("member_count", "member_count"),
+        ("member_count_first", "COALESCE(member_count_first, member_count)"),
+        ("member_count_max", "COALESCE(member_count_max, member_count)"),
+        ("channel_count", "channel_count"),
+        ("text_channels", "text_channels"),
+        ("voice_channels", "voice_channels"),
+        ("categories", "categories"),
+        ("role_count", "role_count"),
+        ("bots", "bots"),
+        ("is_auto", "is_auto"),
+        ("sample_count", "COALESCE(sample_count, 1)"),
+    ]
+
+    def expand_snapshot_run(point, valid_to_ms):
+        """
+        A run row's point expanded into sample_count points (one sample each) evenly spaced over
+        [timestamp_ms, valid_to_ms], as the dashboard's expand_runs spaces them; other rows as-is
+        """
+        start, count = point["timestamp_ms"], point["sample_count"]
+        if start is None or valid_to_ms is None or valid_to_ms <= start or count < 2:
+            return [point]
+        points = []
+        for i in range(count):
+            ms = start + (valid_to_ms - start) * i // (count - 1)
+            timestamp = point["timestamp"] if i == 0 else (UNIX_EPOCH + timedelta(milliseconds=ms)).isoformat()
+            points.append(dict(point, timestamp=timestamp, timestamp_ms=ms, sample_count=1))
+        return points
+
+    def snapshot_history_rows(conn, guild_id):
+        """A guild's snapshots, live then archived, newest first as (point dict keyed by HISTORY_COLUMNS, valid_to_ms)"""
+        rows = conn.execute(
+            f"SELECT {', '.join(expr for _, expr in HISTORY_COLUMNS)}, COALESCE(valid_to_ms, timestamp_ms) "
+            "FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms DESC, id DESC",
+            (guild_id,)
+        )
+        live = (
+            (dict(zip((name for name, _ in HISTORY_COLUMNS), row)), row[-1]) for row in rows
+        )
+        # Archived snapshots are all older than the guild's live ones
+        return chain(live, archived_history_rows(conn, guild_id))
+
+    def snapshot_history(conn, guild_id, last=None):
+        """
+        A guild's snapshots oldest first as dicts keyed by HISTORY_COLUMNS, with run rows expanded
+        into the snapshots they stand for; sample_count is what each point counts for (a compacted
+        row's bucket size). With last, only the newest `last` points (DB thread).
+        """
+        points = []
+        for point, valid_to_ms in snapshot_history_rows(conn, guild_id):
+            points.extend(reversed(expand_snapshot_run(point, valid_to_ms)))
+            if last and len(points) >= last:
+                break
+        points.reverse()
+        return points[-last:] if last else points
+
+    # --- Cold snapshot archive ---
+    # Segment file layout (little-endian), read by the dashboard through a memory map:
+    #   ARCHIVE_HEADER, then one ARCHIVE_COLUMN entry per column, then each column's delta-of-delta
+    #   array (row_count - 2 signed ints of the entry's width, 8-byte aligned). Width 0 means every
+    #   delta-of-delta is zero and nothing is stored. NULLs are stored as ARCHIVE_NULL.
+    # Keep in sync with the reader in analytics_dashboard.py.
+    ARCHIVE_AFTER_DAYS = 180  # snapshots older than this move out of SQLite
+    ARCHIVE_SEGMENT_ROWS = 100000  # rows per segment file (and per write transaction)
+    ARCHIVE_MAGIC = b"SNAPARC1"
+    ARCHIVE_HEADER = struct.Struct("<8sHI")  # magic, column count, row count
+    ARCHIVE_COLUMN = struct.Struct("<32sBqqQ")  # name, delta-of-delta width, first value, first delta, data offset
+    ARCHIVE_WIDTH_CODES = {1: "b", 2: "h", 4: "i", 8: "q"}
+    ARCHIVE_NULL = -1
+    # Archived columns and the live-row expressions they are read from
+    ARCHIVE_COLUMNS = [
+        ("timestamp_ms", "timestamp_ms"),
+        ("member_count", "member_count"),
+        ("member_count_first", "COALESCE(member_count_first, member_count)"),
+        ("member_count_min", "COALESCE(member_count_min, member_count)"),
+        ("member_count_max", "COALESCE(member_count_max, member_count)"),
+        ("sample_count", "COALESCE(sample_count, 1)"),
+        ("rollup_level", "COALESCE(rollup_level, 0)"),
+        ("channel_count", f"COALESCE(channel_count, {ARCHIVE_NULL})"),
+        ("text_channels", f"COALESCE(text_channels, {ARCHIVE_NULL})"),
+        ("voice_channels", f"COALESCE(voice_channels, {ARCHIVE_NULL})"),
+        ("categories", f"COALESCE(categories, {ARCHIVE_NULL})"),
+        ("role_count", f"COALESCE(role_count, {ARCHIVE_NULL})"),
+        ("bots", f"COALESCE(bots, {ARCHIVE_NULL})"),
+        ("boosters", f"COALESCE(boosters, {ARCHIVE_NULL})"),
+        ("is_auto", f"COALESCE(is_auto, {ARCHIVE_NULL})"),
+        ("valid_to_ms", "COALESCE(valid_to_ms, timestamp_ms)"),
+    ]
+
+    def is_archive_enabled():
+        return getConfigData().get(ARCHIVE_CONFIG_KEY, False)
+
+    def encode_archive_column(values):
+        """(width, first value, first delta, packed delta-of-deltas) for one column"""
+        first = values[0]
+        delta = values[1] - values[0] if len(values) > 1 else 0
+        deltas = [b - a for a, b in zip(values, values[1:])]
+        dods = [b - a for a, b in zip(deltas, deltas[1:])]
+        if not any(dods):
+            return 0, first, delta, b""
+        peak = max(max(dods), -min(dods) - 1)
+        width = next((w for w in (1, 2, 4, 8) if peak < 1 << (8 * w - 1)), None)
+        if width is None:
+            raise ValueError("delta-of-delta does not fit in 64 bits")
+        packed = array(ARCHIVE_WIDTH_CODES[width], dods)
+        if sys.byteorder == "big":
+            packed.byteswap()
+        return width, first, delta, packed.tobytes()
+
+    def write_archive_segment(path, columns):
+        """Write {name: values} as a segment file, atomically (temp file, fsync, rename)"""
+        row_count = len(next(iter(columns.values())))
+        encoded = [(name, encode_archive_column(values)) for name, values in columns.items()]
+        offset = ARCHIVE_HEADER.size + ARCHIVE_COLUMN.size * len(encoded)
+        entries = []
+        blobs = []
+        for name, (width, first, delta, data) in encoded:
+            offset += -offset % 8
+            entries.append(ARCHIVE_COLUMN.pack(name.encode(), width, first, delta, offset))
+            blobs.append((offset, data))
+            offset += len(data)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, len(encoded), row_count))
+            f.write(b"".join(entries))
+            for data_offset, data in blobs:
+                f.write(b"\0" * (data_offset - f.tell()))
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return offset
+
+    def archive_segment(conn, guild_id, cutoff_ms):
+        """
+        Move up to ARCHIVE_SEGMENT_ROWS of a guild's oldest snapshots older than cutoff_ms into a new
+        segment file (a run row only once its whole run is). The file is written before the rows are
+        deleted, in the same transaction as its snapshot_archive entry, whose last_ms is where the
+        segment's last run ends. Returns the number of rows archived.
+        """
+        rows = conn.execute(
+            f"SELECT id, {', '.join(expr for _, expr in ARCHIVE_COLUMNS)} FROM snapshots "
+            "WHERE guild_id = ? AND COALESCE(valid_to_ms, timestamp_ms) < ? ORDER BY timestamp_ms, id LIMIT ?",
+            (guild_id, cutoff_ms, ARCHIVE_SEGMENT_ROWS)
+        ).fetchall()
+        if not rows:
+            return 0
+        columns = {name: [row[i + 1] for row in rows] for i, (name, _) in enumerate(ARCHIVE_COLUMNS)}
+        first_ms, last_start_ms = rows[0][1], rows[-1][1]
+        last_ms = max(columns["valid_to_ms"])
+        relative_path = f"{guild_id}/{first_ms}-{last_start_ms}.snap"
+        size = write_archive_segment(os.path.join(ARCHIVE_DIR, relative_path), columns)
+        conn.execute(
+            "INSERT OR REPLACE INTO snapshot_archive (guild_id, first_ms, last_ms, row_count, sample_count, path, bytes) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (guild_id, first_ms, last_ms, len(rows), sum(columns["sample_count"]), relative_path, size)
+        )
+        delete_snapshot_ids(conn, [(row[0],) for row in rows], first_ms, last_start_ms + 1)
+        return len(rows)
+
+    def expired_archive_segments(conn, guild_id, cutoff_ms):
+        """Drop the index entries of segments that end (runs included) before cutoff_ms; returns their file paths"""
+        paths = [row[0] for row in conn.execute(
+            "SELECT path FROM snapshot_archive WHERE guild_id = ? AND last_ms < ?", (guild_id, cutoff_ms)
+        )]
+        conn.execute("DELETE FROM snapshot_archive WHERE guild_id = ? AND last_ms < ?", (guild_id, cutoff_ms))
+        return paths
+
+    def remove_archive_files(paths):
+        for path in paths:
+            try:
+                os.remove(os.path.join(ARCHIVE_DIR, path))
+            except FileNotFoundError:
+                pass
+
+    def read_archive_segment(path):
+        """Decode a segment file into {column: [values]}"""
+        with open(path, "rb") as f:
+            data = f.read()
+        magic, column_count, row_count = ARCHIVE_HEADER.unpack_from(data, 0)
+        if magic != ARCHIVE_MAGIC:
+            raise ValueError(f"{path} is not a snapshot archive segment")
+        dod_count = max(row_count - 2, 0)
+        columns = {}
+        for i in range(column_count):
+            name, width, first, delta, offset = ARCHIVE_COLUMN.unpack_from(data, ARCHIVE_HEADER.size + i * ARCHIVE_COLUMN.size)
+            if width == 0:
+                dods = [0] * dod_count
+            else:
+                dods = array(ARCHIVE_WIDTH_CODES[width], data[offset:offset + width * dod_count])
+                if sys.byteorder == "big":
+                    dods.byteswap()
+            columns[name.rstrip(b"\0").decode()] = list(accumulate(accumulate(dods, initial=delta), initial=first))[:row_count]
+        return columns
+
+    def archived_history_rows(conn, guild_id):
+        """Yield a guild's archived snapshots newest first, as snapshot_history_rows yields live ones (DB thread)"""
+        segments = conn.execute(
+            "SELECT path FROM snapshot_archive WHERE guild_id = ? ORDER BY first_ms DESC", (guild_id,)
+        ).fetchall()
+        for (path,) in segments:
+            try:
+                columns = read_archive_segment(os.path.join(ARCHIVE_DIR, path))
+            except FileNotFoundError:
+                continue
+            # Segments written before schema v15 have no valid_to_ms column
+            valid_to = columns.get("valid_to_ms", columns["timestamp_ms"])
+            for i in reversed(range(len(columns["timestamp_ms"]))):
+                ms = columns["timestamp_ms"][i]
+                point = {"timestamp": (UNIX_EPOCH + timedelta(milliseconds=ms)).isoformat()}
+                for name, _ in HISTORY_COLUMNS[1:]:
+                    value = columns[name][i]
+                    point[name] = None if value == ARCHIVE_NULL else value
+                yield point, valid_to[i]
+
+    async def archive_snapshots():
+        """
+        Move every guild's snapshots older than ARCHIVE_AFTER_DAYS into delta-of-delta column segments,
+        ARCHIVE_SEGMENT_ROWS per DB-thread transaction. Returns the number of rows archived.
+        """
+        cutoff_ms = to_epoch_ms(datetime.now(timezone.utc) - timedelta(days=ARCHIVE_AFTER_DAYS))
+        total = 0
+        for (guild_id,) in await db_fetchall("SELECT guild_id FROM guilds"):
+            archived = ARCHIVE_SEGMENT_ROWS
+            while archived == ARCHIVE_SEGMENT_ROWS:
+                archived = await run_db(archive_segment, guild_id, cutoff_ms, guild_id=guild_id)
+                total += archived
+        if total:
+            print(f"[ARCHIVE] Moved {total} snapshots older than {ARCHIVE_AFTER_DAYS} days into archive segments", type_="INFO")
+        return total
+
+    async def retention_worker():
+        """Background loop that runs snapshot retention, compaction, archiving and partitioning (each when enabled) every RETENTION_INTERVAL_SECONDS"""
+        while True:
             try:
-                c.execute('ALTER TABLE snapshots ADD COLUMN boosters INTEGER DEFAULT 0')
+                removed = await prune_expired_snapshots() if is_retention_enabled() else 0
+                if is_compaction_enabled():
+                    removed += await compact_snapshots()
+                if is_archive_enabled():
+                    removed += await archive_snapshots()
+                if is_partitioning_enabled():
+                    await seal_partitions()
+                if removed:
+                    remaining_free = await run_db(reclaim_free_pages)
+                    print(f"[RETENTION] Removed {removed} snapshots; {remaining_free} free pages left", type_="INFO")
             except Exception as e:
-                print(f"[DB MIGRATION] Could not add 'boosters' column: {e}")
-        # For fresh DBs, boosters column is always present. For legacy DBs, migration should be handled separately.
-        c.execute('''CREATE TABLE IF NOT EXISTS demographics (
-            guild_id TEXT,
-            member_id TEXT,
-            name TEXT,
-            account_created TEXT,
-            joined_at TEXT,
-            timestamp TEXT,
-            PRIMARY KEY (guild_id, member_id)
-        )''')
-        # For fresh DBs, timestamp column is always present. For legacy DBs, migration should be handled separately.
-        c.execute('''CREATE TABLE IF NOT EXISTS server_config (
-            guild_id TEXT PRIMARY KEY,
-            auto_snapshot INTEGER,
-            last_auto_snapshot TEXT,
-            first_snapshot_date TEXT,
-            chart_style TEXT,
-            snapshot_retention_days INTEGER,
-            auto_snapshot_interval_hours REAL
-        )''')
-        c.execute('''CREATE TABLE IF NOT EXISTS demographics_servers (
-            guild_id TEXT PRIMARY KEY
-        )''')
-        conn.commit()
-        conn.close()
+                print(f"[RETENTION] Pruning failed: {e}", type_="ERROR")
+            await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
 
     def set_db_migrated():
         updateConfigData("analytics_db_migrated", True)
@@ -1823,33 +3361,15 @@ format: csv (comma-separated values)
                 print(f"[WebAPI] Fetched {len(members_list)} members from {guild.name} using channel {text_channel.id if text_channel else 'N/A'}", type_="INFO")
                 
                 # Insert members into demographics table
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                fetched_count = 0
+                written, fetched_count = await run_db(ingest_members, guild.id, members_list, guild.member_count, guild_id=guild.id)
                 
-                for member in members_list:
-                    c.execute("""
-                        INSERT OR REPLACE INTO demographics (guild_id, member_id, name, account_created, joined_at, timestamp)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    """, (
-                        str(guild.id),
-                        str(member.id),
-                        str(member),
-                        member.created_at.isoformat() if member.created_at else None,
-                        member.joined_at.isoformat() if member.joined_at else None,
-                        datetime.now(timezone.utc).isoformat()
-                    ))
-                    fetched_count += 1
-                
-                conn.commit()
-                conn.close()
-                
-                print(f"[WebAPI] Successfully inserted {fetched_count} members into database for {guild.name}", type_="INFO")
+                print(f"[WebAPI] Successfully upserted {fetched_count} members ({written} new or changed) for {guild.name}", type_="INFO")
                 
                 return web.json_response({
                     'success': True,
                     'guild_name': guild.name,
                     'members_fetched': fetched_count,
+                    'members_changed': written,
                     'message': f'Successfully fetched {fetched_count} members from {guild.name}',
                     'channel_id': text_channel.id if text_channel else None
                 })
@@ -1895,13 +3415,10 @@ format: csv (comma-separated values)
                 await take_snapshot(guild, is_auto=not manual)
                 
                 # Get the latest snapshot data
-                conn = sqlite3.connect(DB_PATH)
-                c = conn.cursor()
-                latest_snapshot = c.execute(
-                    "SELECT member_count FROM snapshots WHERE guild_id = ? ORDER BY timestamp DESC LIMIT 1",
-                    (str(guild.id),)
-                ).fetchone()
-                conn.close()
+                latest_snapshot = await db_fetchone(
+                    "SELECT member_count FROM snapshots WHERE guild_id = ? ORDER BY timestamp_ms DESC LIMIT 1",
+                    (guild.id,), guild_id=guild.id
+                )
                 
                 member_count = latest_snapshot[0] if latest_snapshot else 0
                 
@@ -1977,6 +3494,12 @@ format: csv (comma-separated values)
             print(f"[WebAPI] Failed to start API server: {e}", type_="ERROR")
             print(f"[WebAPI] Error details: {type(e).__name__}: {str(e)}", type_="ERROR")
 
+    @bot.listen("on_ready")
+    async def start_retention_worker():
+        """Start the retention worker once (on_ready fires again after reconnects)"""
+        if getattr(bot, "analytics_retention_task", None) is None or bot.analytics_retention_task.done():
+            bot.analytics_retention_task = asyncio.create_task(retention_worker())
+
     async def send_analytics_notification(guild_id, guild_name, member_count, is_auto=True):
         """Send notification to analytics dashboard about snapshot taken"""
         try: